@@ -28,6 +28,7 @@ setup(name='aCT',
             'actreport = act.common.aCTReport:main',
             'actcriticalmonitor = act.common.aCTCriticalMonitor:main',
             'actheartbeatwatchdog = act.atlas.aCTHeartbeatWatchdog:main',
+            'actdbschema = act.db.aCTDBSchema:main',
 
             'actbulksub = act.client.actbulksub:main',
             'actclean   = act.client.actclean:main',
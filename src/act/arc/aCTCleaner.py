@@ -9,18 +9,31 @@ from act.common.aCTProcess import aCTProcess
 
 class aCTCleaner(aCTProcess):
 
+    def __init__(self):
+
+        aCTProcess.__init__(self)
+
+        # maximum number of jobs cleaned per cycle
+        self.cleanbatch = int(self.conf.get(['jobs', 'cleanbatch']) or 1000)
+
     def processToClean(self):
 
-        jobstoclean = self.db.getArcJobs("arcstate='toclean' and cluster='"+self.cluster+"' limit 100")
+        # Claim jobs so that other cleaners for the same cluster skip them
+        claimed = self.db.claimArcJobs("arcstate='toclean' and cluster='"+self.cluster+"'", self.cleanbatch, cursor='toclean')
+        if not claimed:
+            return
+        jobstoclean = self.db.getArcJobs("id in (%s)" % ','.join([str(j['id']) for j in claimed]),
+                                         self.db.supervisorattrs)
 
         if not jobstoclean:
             return
 
         self.log.info("Cleaning %d jobs" % sum(len(v) for v in jobstoclean.values()))
+        cleaned = []
         for proxyid, jobs in jobstoclean.items():
             self.uc.CredentialString(str(self.db.getProxy(proxyid)))
 
-            job_supervisor = arc.JobSupervisor(self.uc, [j[2] for j in jobs])
+            job_supervisor = arc.JobSupervisor(self.uc, [j[2].arcJob() for j in jobs])
             job_supervisor.Update()
             job_supervisor.Clean()
 
@@ -30,7 +43,10 @@ class aCTCleaner(aCTProcess):
                 if job.JobID in notcleaned:
                     self.log.error("%s: Could not clean job %s" % (appjobid, job.JobID))
 
-                self.db.deleteArcJob(id)
+                cleaned.append(id)
+
+        # remove the whole batch in one transaction
+        self.db.deleteArcJobs(cleaned)
 
     def process(self):
 
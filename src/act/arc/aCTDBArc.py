@@ -1,44 +1,64 @@
-import re
 import os
 import arc
-from act.db.aCTDB import aCTDB
+from act.arc.aCTJobCodec import getJobCodec
+from act.db.aCTDB import aCTDB, HOTCOLDSTATES
+from act.db.aCTDBClusters import aCTDBClusters
+from act.db import aCTDBQuery
+
+
+class aCTArcJobRow:
+    '''
+    Lightweight view of an arcjobs row returned by aCTDBArc.getArcJobs().
+    Job attributes are decoded when accessed and the full arc.Job is only
+    built by arcJob(), e.g. when the job is handed to arc.JobSupervisor.
+    Attributes which were not selected have their arc.Job default value.
+    '''
+
+    __slots__ = ('row', '_db', '_job')
+
+    def __init__(self, row, db):
+        self.row = row
+        self._db = db
+        self._job = None
+
+    def __getattr__(self, attr):
+        if attr not in self._db.jobattrs:
+            raise AttributeError(attr)
+        if self._job is not None:
+            return getattr(self._job, attr)
+        return self._db.codec.decodeAttr(attr, self.row.get(attr))
+
+    def arcJob(self):
+        '''
+        Return the arc.Job for this row, built on first call
+        '''
+        if self._job is None:
+            self._job = self._db.codec.decode(self.row)
+        return self._job
+
 
 class aCTDBArc(aCTDB):
 
     def __init__(self, log):
         aCTDB.__init__(self, log, 'arcjobs')
+        # clusters on which each job may run
+        self.clusters = aCTDBClusters(log)
 
         self.proxydir = self.conf.get(["voms","proxystoredir"])
 
-        # mapping from Job class attribute types to column types
-        self.jobattrmap = {int: 'integer',
-                      str: 'varchar(255)',
-                      arc.JobState: 'varchar(255)',
-                      arc.StringList: 'varchar(1024)',
-                      arc.URL: 'varchar(255)',
-                      arc.Period: 'int',
-                      arc.Time: 'datetime',
-                      arc.StringStringMap: 'varchar(1024)'}
-        ignoremems=['STDIN',
-                    'STDOUT',
-                    'STDERR',
-                    'STAGEINDIR',
-                    'STAGEOUTDIR',
-                    'SESSIONDIR',
-                    'JOBLOG',
-                    'JOBDESCRIPTION',
-                    'JobDescriptionDocument']
-
-        # Attributes of Job class mapped to DB column type
-        self.jobattrs={}
-        j=arc.Job()
-        for i in dir(j):
-            if re.match('^__',i):
-                continue
-            if i in ignoremems:
-                continue
-            if type(getattr(j, i)) in self.jobattrmap:
-                self.jobattrs[i] = type(getattr(j, i))
+        # Attributes of Job class mapped to their type
+        self.codec = getJobCodec()
+        self.jobattrs = self.codec.jobattrs
+
+        # Attributes needed by arc.JobSupervisor to find and manage a job
+        # created from the DB. JobSupervisor.Update() fills in the rest, so
+        # callers which only hand jobs to JobSupervisor can select just these.
+        self.supervisorattrs = [a for a in ['JobID', 'IDFromEndpoint', 'State', 'DelegationID',
+                                            'ServiceInformationURL', 'ServiceInformationInterfaceName',
+                                            'JobStatusURL', 'JobStatusInterfaceName',
+                                            'JobManagementURL', 'JobManagementInterfaceName',
+                                            'StageInDir', 'StageOutDir', 'SessionDir']
+                                if a in self.jobattrs]
 
 
     def createTables(self):
@@ -50,7 +70,9 @@ class aCTDBArc(aCTDB):
           - arcstate: tosubmit, submitting, submitted, running, stalled, tocancel,
                       cancelling, cancelled, finished, failed, tofetch, torerun,
                       toresubmit, done, donefailed, lost, toclean
-            "to" states are set by application engine or ARC engine for retries
+            "to" states are set by application engine or ARC engine for retries.
+            Jobs in cold states (see HOTCOLDSTATES) are kept in a separate
+            partition from active jobs.
           - tarcstate: time stamp of last arcstate
           - tstate: time stamp of last arc Job state change
           - cluster: hostname of the cluster chosen for the job
@@ -67,9 +89,17 @@ class aCTDBArc(aCTDB):
           - priority: ARC job priority, extracted from the job description
           - fairshare: A string representing a share. Job submission for the same
             cluster will be spread evenly over shares.
-        jobdescriptions: job description added by the application engine
+          - claimedby: worker which currently holds a claim on the job, see
+            claimArcJobs()
+          - claimeduntil: time at which the claim expires
+        jobdescriptions: job descriptions added by the application engines,
+        shared by all jobs with identical descriptions
           - id: primary key
-          - jobdescription: job description text
+          - jobdescription: job description text, only set in rows created
+            before descriptions were compressed
+          - hash: sha256 of the job description
+          - refcount: number of jobs using the description
+          - data: zlib-compressed job description
         proxies: columns are the following:
           - id:
           - proxy:
@@ -92,21 +122,22 @@ class aCTDBArc(aCTDB):
             tstate TIMESTAMP,
             cluster VARCHAR(255),
             clusterlist VARCHAR(1024),
-            jobdesc INT(11),
+            jobdesc INTEGER,
             attemptsleft INTEGER,
             downloadfiles VARCHAR(255),
             proxyid INTEGER,
             appjobid VARCHAR(255),
             priority SMALLINT,
             fairshare VARCHAR(255),
-            """+",".join(['%s %s' % (k, self.jobattrmap[v]) for k, v in self.jobattrs.items()])+")"
+            claimedby VARCHAR(255),
+            claimeduntil DATETIME,
+            """+",".join(['%s %s' % (k, v) for k, v in self.codec.columntypes.items()])+")"
 
         # First check if table already exists
         c = self.db.getCursor()
-        c.execute("show tables like 'arcjobs'")
-        row = c.fetchone()
+        exists = self.db.tableExists('arcjobs')
         self.Commit()
-        if row:
+        if exists:
             answer = input("Table arcjobs already exists!\nAre you sure you want to recreate it? (y/n) ")
             if answer != 'y':
                 return True
@@ -116,6 +147,7 @@ class aCTDBArc(aCTDB):
         self.log.info("creating arcjobs table")
         try:
             c.execute(create)
+            self.db.partitionByState('arcjobs', *HOTCOLDSTATES['arcjobs'])
             self.Commit()
         except Exception as x:
             self.log.error("failed create table %s" %x)
@@ -125,7 +157,10 @@ class aCTDBArc(aCTDB):
         self.log.info("creating jobdescriptions table")
         create="""CREATE TABLE jobdescriptions (
             id INTEGER PRIMARY KEY AUTO_INCREMENT,
-            jobdescription mediumtext)
+            jobdescription mediumtext,
+            hash CHAR(64),
+            refcount INTEGER,
+            data MEDIUMBLOB)
             """
         try:
             c.execute("drop table jobdescriptions")
@@ -134,7 +169,10 @@ class aCTDBArc(aCTDB):
         try:
             c.execute(create)
             # add indexes
-            c.execute("ALTER TABLE arcjobs ADD INDEX (arcstate)")
+            c.execute("CREATE INDEX arcjobs_arcstate ON arcjobs (arcstate)")
+            c.execute("CREATE INDEX arcjobs_cluster_state ON arcjobs (cluster, arcstate, tarcstate)")
+            c.execute("CREATE INDEX arcjobs_state_tstate ON arcjobs (state, tstate)")
+            c.execute("CREATE INDEX jobdescriptions_hash ON jobdescriptions (hash)")
             self.Commit()
         except Exception as x:
             self.log.error("failed create table %s" %x)
@@ -168,19 +206,14 @@ class aCTDBArc(aCTDB):
         '''
         Add new arc Job object. Only used for testing and recreating db.
         '''
-        c=self.db.getCursor()
         jobdesc = str(job.JobDescriptionDocument)
-        s = "insert into jobdescriptions (jobdescription) values (%s)"
-        c.execute(s, [jobdesc])
-        c.execute("SELECT LAST_INSERT_ID()")
-        jobdescid = c.fetchone()['LAST_INSERT_ID()']
-
-        j = self._job2db(job)
-        c.execute("insert into arcjobs (created,tstate,jobdesc"+",".join(j.keys())+") values ('"+str(self.getTimeStamp())+"','"+str(self.getTimeStamp())+"','"+str(jobdescid)+"','"+"','".join(j.values())+"')")
-        c.execute("SELECT LAST_INSERT_ID()")
-        row = c.fetchone()
-        self.Commit()
-        return row
+        with self.transaction():
+            desc = {'created': self.getTimeStamp(), 'tstate': self.getTimeStamp(),
+                    'jobdesc': self._storeJobDescription(jobdesc)}
+            desc.update(self.codec.encode(job))
+            id = self.db.insert(aCTDBQuery.insert('arcjobs', desc))
+            self.clusters.insertJobClusters('arcjobs', id, desc.get('clusterlist', ''), desc.get('arcstate'))
+        return {'LAST_INSERT_ID()': id}
 
 
     def insertArcJobDescription(self, jobdesc, proxyid='', maxattempts=0, clusterlist='', appjobid='', downloadfiles='', fairshare=''):
@@ -188,7 +221,17 @@ class aCTDBArc(aCTDB):
         Add a new job description for the ARC engine to process. If specified
         the job will be sent to a cluster in the given list.
         '''
-        # extract priority from job desc (also checks if desc is valid)
+        ids = self.insertArcJobDescriptions([{'jobdesc': jobdesc, 'proxyid': proxyid, 'maxattempts': maxattempts,
+                                              'clusterlist': clusterlist, 'appjobid': appjobid,
+                                              'downloadfiles': downloadfiles, 'fairshare': fairshare}])
+        if ids[0] is None:
+            return None
+        return {'LAST_INSERT_ID()': ids[0]}
+
+    def getJobDescriptionPriority(self, jobdesc, appjobid=''):
+        '''
+        Return the priority of a job description, None if it is not valid
+        '''
         jobdescs = arc.JobDescriptionList()
         if not arc.JobDescription_Parse(str(jobdesc), jobdescs):
             self.log.error("%s: Failed to prepare job description" % appjobid)
@@ -196,48 +239,73 @@ class aCTDBArc(aCTDB):
         priority = jobdescs[0].Application.Priority
         if priority == -1: # use nicer default priority
             priority = 50
-
+        return priority
+
+    def insertArcJobDescriptions(self, jobs):
+        '''
+        Add a list of new job descriptions in one transaction. Each job is a
+        dictionary of the arguments of insertArcJobDescription() and may give
+        the priority of a job description which the caller already parsed.
+        Returns the list of ids of the new jobs in the same order, None for
+        job descriptions which are not valid.
+        '''
+        now = self.getTimeStamp()
+        valid = []
+        for i, job in enumerate(jobs):
+            priority = job.get('priority')
+            if priority is None:
+                # extract priority from job desc (also checks if desc is valid)
+                priority = self.getJobDescriptionPriority(job['jobdesc'], job.get('appjobid', ''))
+                if priority is None:
+                    continue
+            desc = {}
+            desc['created'] = now
+            desc['arcstate'] = "tosubmit"
+            desc['tarcstate']  = now
+            desc['tstate'] = now
+            desc['cluster']  = ''
+            desc['clusterlist'] = job.get('clusterlist', '')
+            desc['attemptsleft'] = job.get('maxattempts', 0)
+            desc['proxyid'] = job.get('proxyid', '')
+            desc['appjobid'] = job.get('appjobid', '')
+            desc['downloadfiles'] = job.get('downloadfiles', '')
+            desc['priority'] = priority
+            desc['fairshare'] = job.get('fairshare', '')
+            valid.append((i, desc))
+
+        ids = [None] * len(jobs)
+        if not valid:
+            return ids
         # todo: find some useful default for proxyid
-        c=self.db.getCursor()
-
-        s = "insert into jobdescriptions (jobdescription) values (%s)"
-        c.execute(s, [jobdesc])
-        c.execute("SELECT LAST_INSERT_ID()")
-        jobdescid = c.fetchone()['LAST_INSERT_ID()']
-
-        desc = {}
-        desc['created'] = self.getTimeStamp()
-        desc['arcstate'] = "tosubmit"
-        desc['tarcstate']  = desc['created']
-        desc['tstate'] = desc['created']
-        desc['cluster']  = ''
-        desc['clusterlist'] = clusterlist
-        desc['jobdesc'] = jobdescid
-        desc['attemptsleft'] = maxattempts
-        desc['proxyid'] = proxyid
-        desc['appjobid'] = appjobid
-        desc['downloadfiles'] = downloadfiles
-        desc['priority'] = priority
-        desc['fairshare'] = fairshare
-        s="insert into arcjobs" + " ( " + ",".join(['%s' % (k) for k in desc.keys()]) + " ) " + " values " + \
-            " ( " + ",".join(['%s' % (k) for k in ["%s"] * len(desc.keys()) ]) + " ) "
-        c.execute(s, list(desc.values()))
-        c.execute("SELECT LAST_INSERT_ID()")
-        row = c.fetchone()
-        self.Commit()
-        return row
+        with self.transaction():
+            for (i, desc) in valid:
+                desc['jobdesc'] = self._storeJobDescription(jobs[i]['jobdesc'])
+            columns = list(valid[0][1].keys())
+            rowids = self.db.insertMany('arcjobs', columns, [[desc[c] for c in columns] for (i, desc) in valid])
+            self.clusters.insertManyJobClusters('arcjobs', [(id, desc['clusterlist'], desc['arcstate'])
+                                                            for (i, desc), id in zip(valid, rowids)])
+        for (i, desc), id in zip(valid, rowids):
+            ids[i] = id
+        return ids
 
     def deleteArcJob(self, id):
         '''
         Delete job from ARC table.
         '''
-        c=self.db.getCursor()
-        c.execute("select jobdesc from arcjobs where id="+str(id))
-        row = c.fetchone()
-        if row:
-            c.execute("delete from jobdescriptions where id="+str(row['jobdesc']))
-        c.execute("delete from arcjobs where id="+str(id))
-        self.Commit()
+        self.deleteArcJobs([id])
+
+    def deleteArcJobs(self, ids):
+        '''
+        Delete a list of jobs from ARC table in one transaction and
+        release their job descriptions. Returns the number of deleted jobs.
+        '''
+        if not ids:
+            return 0
+        with self.transaction():
+            rows = self.db.fetch(aCTDBQuery.select('arcjobs', ['jobdesc'], {'id': list(ids)}))
+            self._releaseJobDescriptions([row['jobdesc'] for row in rows])
+            n = self.db.execute(aCTDBQuery.delete('arcjobs', {'id': list(ids)}))
+        return n
 
     def updateArcJob(self, id, desc, job=None):
         '''
@@ -252,23 +320,15 @@ class aCTDBArc(aCTDB):
         Update arc job fields specified in desc and fields represented by arc
         Job if job is specified. Does not commit after executing update.
         '''
-        c = self.db.getCursor()
-        c.execute("select id from arcjobs where id=%d limit 1" % id)
-        row = c.fetchone()
-        if row is None:
+        if not self.db.fetch(aCTDBQuery.select('arcjobs', ['id'], {'id': id}, limit=1)):
             self.log.warning("Arc job id %d no longer exists" % id)
             return
 
         desc['modified']=self.getTimeStamp()
-        s = "update arcjobs set " + ",".join(['%s=%%s' % (k) for k in desc.keys()])
+        values = dict(desc)
         if job:
-            s += "," + ",".join(['%s=%%s' % (k) for k in self._job2db(job).keys()])
-        s+=" where id="+str(id)
-        print(s)
-        if job:
-            c.execute(s, list(desc.values()) + list(self._job2db(job).values()))
-        else:
-            c.execute(s, list(desc.values()))
+            values.update(self.codec.encode(job))
+        self.db.execute(aCTDBQuery.update('arcjobs', values, {'id': id}))
 
     def updateArcJobs(self, desc, select):
         '''
@@ -288,23 +348,97 @@ class aCTDBArc(aCTDB):
         c=self.db.getCursor()
         c.execute(s, list(desc.values()))
 
+    def updateArcJobsByID(self, ids, desc, chunksize=1000):
+        '''
+        Update arc job fields specified in desc for all jobs in the list of
+        ids. One update statement is issued and committed per chunk of ids.
+        '''
+        ids = list(ids)
+        for i in range(0, len(ids), chunksize):
+            with self.transaction():
+                self.updateArcJobsByIDLazy(ids[i:i+chunksize], desc)
+
+    def updateArcJobsByIDLazy(self, ids, desc):
+        '''
+        Update arc job fields specified in desc for all jobs in the list of
+        ids. Does not commit after executing update.
+        '''
+        if not ids:
+            return
+        desc = dict(desc)
+        desc['modified'] = self.getTimeStamp()
+        self.db.execute(aCTDBQuery.update('arcjobs', desc, {'id': list(ids)}))
+
+    def updateArcJobsBulk(self, updates, chunksize=1000):
+        '''
+        Apply a list of (id, desc, job) transitions, where job may be None.
+        Transitions without a job which share the same desc are applied with
+        a single "where id in (...)" update, the others are grouped by the
+        set of columns they change and sent with executemany. The transaction
+        is committed once per chunk of updates.
+        '''
+        updates = list(updates)
+        for i in range(0, len(updates), chunksize):
+            with self.transaction():
+                self.updateArcJobsBulkLazy(updates[i:i+chunksize])
+
+    def updateArcJobsBulkLazy(self, updates):
+        '''
+        Apply a list of (id, desc, job) transitions as in updateArcJobsBulk.
+        Does not commit after executing the updates.
+        '''
+        modified = self.getTimeStamp()
+        byvalue = {}
+        bycolumns = {}
+        for (id, desc, job) in updates:
+            if job is None:
+                byvalue.setdefault(tuple(desc.items()), []).append(id)
+                continue
+            row = dict(desc)
+            row.update(self.codec.encode(job))
+            bycolumns.setdefault(tuple(row.keys()), []).append(list(row.values()) + [modified, id])
+
+        for desc, ids in byvalue.items():
+            self.updateArcJobsByIDLazy(ids, dict(desc))
+
+        c = self.db.getCursor()
+        for columns, rows in bycolumns.items():
+            s = "update arcjobs set " + ",".join(['%s=%%s' % (k) for k in columns])
+            s += ",modified=%s where id=%s"
+            c.executemany(s, rows)
+
+    def claimArcJobs(self, select, limit, columns=['id'], desc=None, lease=600, cursor=None):
+        '''
+        Claim up to limit arc jobs matching select for this worker and return
+        a list of column: value dictionaries for them. Jobs claimed by other
+        workers are skipped until their lease of lease seconds expires or is
+        released with releaseArcJobs(). If desc is given the claimed jobs are
+        updated with it in the same transaction, e.g. to move them out of the
+        state being claimed, and no lease is kept. If cursor is given jobs are
+        claimed in id order after those of the previous call with the same
+        cursor, so that jobs left in the state are not claimed over and over.
+        '''
+        return self._claimRows(select, limit, columns, desc, lease, cursor)
+
+    def releaseArcJobs(self, ids):
+        '''
+        Release the claim on the given arc jobs
+        '''
+        self._releaseRows(ids)
+
     def getArcJobInfo(self,id,columns=[]):
         '''
         Return a dictionary of column name: value for the given id and columns
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT "+self._column_list2str(columns)+" FROM arcjobs WHERE id="+str(id))
-        row=c.fetchone()
-        if not row:
+        rows = self.db.fetch(aCTDBQuery.select('arcjobs', columns, {'id': id}))
+        if not rows:
             return {}
-        # mysql SELECT returns list, we want dict
-        if not isinstance(row,dict):
-            row = dict(zip([col[0] for col in c.description], row))
-        return row
+        return rows[0]
 
     def getArcJobsInfo(self, select, columns=[], tables="arcjobs", lock=False):
         '''
         Return a list of column: value dictionaries for jobs matching select.
+        select is either a where clause or conditions for aCTDBQuery.
         If lock is True the row will be locked if possible.
         '''
         c=self.db.getCursor()
@@ -313,128 +447,92 @@ class aCTDBArc(aCTDB):
             if not res:
                 self.log.debug("Could not get lock: %s"%str(res))
                 return []
+        if not isinstance(select, str):
+            return self.db.fetch(aCTDBQuery.select(tables, columns, select))
         c.execute("SELECT "+self._column_list2str(columns)+" FROM "+tables+" WHERE "+select)
         rows=c.fetchall()
         return rows
 
-    def getArcJobs(self,select):
+    def getArcJobs(self, select, attrs=None):
         '''
-        Return a dictionary of {proxyid: [(id, appjobid, arc.Job, created), ...]} for jobs matching select
+        Return a dictionary of {proxyid: [(id, appjobid, aCTArcJobRow, created), ...]}
+        for jobs matching select, a where clause or conditions for aCTDBQuery.
+        Only the arc.Job attributes in attrs are selected, all of them if
+        attrs is None. Call arcJob() on the row to get the arc.Job object.
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT id, proxyid, appjobid, created, "+",".join(self.jobattrs.keys())+" FROM arcjobs WHERE "+select)
-        rows=c.fetchall()
+        if attrs is None:
+            attrs = list(self.jobattrs.keys())
+        columns = ['id', 'proxyid', 'appjobid', 'created'] + [a for a in attrs if a in self.jobattrs]
+        if not isinstance(select, str):
+            rows = self.db.fetch(aCTDBQuery.select('arcjobs', columns, select))
+        else:
+            c=self.db.getCursor()
+            c.execute("SELECT "+",".join(columns)+" FROM arcjobs WHERE "+select)
+            rows = c.fetchall()
         d = {}
-        if isinstance(rows, tuple):
-            rows = dict(zip([col[0] for col in c.description], zip(*[list(row) for row in rows])))
-            for row in rows:
-                d[row[0]] = self._db2job(dict(zip([col[0] for col in c.description], row[1:])))
-        # mysql returns list of dictionaries
-        if isinstance(rows, list):
-            for row in rows:
-                if not row['proxyid'] in d:
-                    d[row['proxyid']] = []
-                d[row['proxyid']].append((row['id'], row['appjobid'], self._db2job(row), row['created']))
-
+        for row in rows:
+            d.setdefault(row['proxyid'], []).append((row['id'], row['appjobid'], aCTArcJobRow(row, self), row['created']))
         return d
 
+    def getArcJobsStream(self, select, attrs=None, chunksize=1000):
+        '''
+        Generator of (proxyid, [(id, appjobid, aCTArcJobRow, created), ...])
+        for jobs matching select, like getArcJobs() but streamed from the DB
+        in chunks of at most chunksize jobs of one proxy, so memory is bounded
+        by chunksize per proxy instead of growing with the number of jobs.
+        Statements may be executed between chunks.
+        '''
+        if attrs is None:
+            attrs = list(self.jobattrs.keys())
+        columns = ['id', 'proxyid', 'appjobid', 'created'] + [a for a in attrs if a in self.jobattrs]
+        query = ("SELECT "+",".join(columns)+" FROM arcjobs WHERE "+select, [])
+        byproxy = {}
+        for rows in self.db.stream(query, chunksize):
+            for row in rows:
+                jobs = byproxy.setdefault(row['proxyid'], [])
+                jobs.append((row['id'], row['appjobid'], aCTArcJobRow(row, self), row['created']))
+                if len(jobs) >= chunksize:
+                    yield (row['proxyid'], byproxy.pop(row['proxyid']))
+        for proxyid, jobs in byproxy.items():
+            yield (proxyid, jobs)
+
     def getArcJobDescription(self, jobdescid):
         '''
         Return the job description for the given id in jobdescriptions
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT jobdescription from jobdescriptions where id="+str(jobdescid))
-        row = c.fetchone()
-        if not row:
-            return None
-        return row['jobdescription']
+        return self._getJobDescription(jobdescid)
 
     def getNArcJobs(self):
         '''
         Return the total number of jobs in the table
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT COUNT(*) FROM arcjobs")
-        row = c.fetchone()
-        return row['COUNT(*)']
+        return self.db.fetch(aCTDBQuery.count('arcjobs'))[0]['count']
 
     def getActiveClusters(self):
         '''
-        Return a list and count of clusters
+        Return a list and count of clusters, from the job counters
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT cluster, COUNT(*) FROM arcjobs WHERE cluster!='' GROUP BY cluster")
-        rows=c.fetchall()
-        return rows
+        return [{'cluster': r['cluster'], 'COUNT(*)': r['njobs']} for r in
+                self.getStateCounts([('cluster', '!=', '')], ['cluster'])]
 
-    def getClusterLists(self):
+    def getSubmitClusters(self):
         '''
-        Return a list and count of clusterlists for jobs to submit
+        Return a list and count of clusters for jobs to submit, from the
+        job_clusters table
         '''
-        c=self.db.getCursor()
         # submitting state is included here so that a submitter process is not
         # killed while submitting jobs
-        c.execute("SELECT clusterlist, COUNT(*) FROM arcjobs WHERE arcstate='tosubmit' or arcstate='submitting' or arcstate='torerun' or arcstate='toresubmit' or arcstate='tocancel' GROUP BY clusterlist")
-        rows=c.fetchall()
-        return rows
-
-    def _db2job(self, dbinfo):
-        '''
-        Convert a dictionary of DB key value into arc Job object
-        '''
-        j = arc.Job()
-        for attr in self.jobattrs:
-            if attr not in dbinfo or dbinfo[attr] is None:
-                continue
-            # Some object types need special treatment
-            if self.jobattrs[attr] == arc.StringList:
-                l = arc.StringList()
-                for item in dbinfo[attr].split('|'):
-                    l.append(item)
-                setattr(j, attr, l)
-                continue
-            if self.jobattrs[attr] == arc.StringStringMap:
-                m = arc.StringStringMap()
-                d = eval(dbinfo[attr])
-                if not isinstance(d, dict):
-                    continue
-                for (k,v) in d.items():
-                    m[k] = v
-                setattr(j, attr, m)
-                continue
+        states = ['tosubmit', 'submitting', 'torerun', 'toresubmit', 'tocancel']
+        return [{'cluster': r['cluster'], 'COUNT(*)': r['njobs']} for r in
+                self.clusters.getClusters('arcjobs', states)]
 
-            setattr(j, attr, self.jobattrs[attr](str(dbinfo[attr])))
-        return j
-
-    def _job2db(self, job):
+    def clusterSelect(self, cluster, states):
         '''
-        Convert an arc Job object to a dictionary of column name: value
+        Return an aCTDBQuery.Raw condition selecting jobs in one of states
+        which may run on cluster, or which have an empty clusterlist if
+        cluster is ''
         '''
-        d = {}
-        for attr in self.jobattrs:
-            if self.jobattrs[attr] == int or self.jobattrs[attr] == str:
-                d[attr] = str(getattr(job, attr))[:250]
-            elif self.jobattrs[attr] == arc.JobState:
-                d[attr] = getattr(job, attr).GetGeneralState()
-            elif self.jobattrs[attr] == arc.StringList:
-                d[attr] = '|'.join(getattr(job, attr))[:1000]
-            elif self.jobattrs[attr] == arc.URL:
-                d[attr] = getattr(job, attr).str().replace(r'\2f',r'/')
-            elif self.jobattrs[attr] == arc.Period:
-                d[attr] = str(getattr(job, attr).GetPeriod())
-            elif self.jobattrs[attr] == arc.Time:
-                if getattr(job, attr).GetTime() != -1:
-                    # Use UTC time but strip trailing Z since mysql doesn't like it
-                    t = str(getattr(job, attr).str(arc.UTCTime))
-                    d[attr] = re.sub('Z$', '', t)
-            elif self.jobattrs[attr] == arc.StringStringMap:
-                ssm = getattr(job, attr)
-                tmpdict = dict(zip(ssm.keys(), ssm.values()))
-                d[attr] = str(tmpdict)[:1000]
-            # Force everything to ASCII
-            if attr in d:
-                d[attr] = ''.join([i for i in d[attr] if ord(i) < 128])
-        return d
+        return self.clusters.clusterSelect('arcjobs', cluster, states)
 
     def _writeProxyFile(self, proxypath, proxy):
         if os.path.isfile(proxypath):
@@ -456,16 +554,12 @@ class aCTDBArc(aCTDB):
           - myproxyid: id from myproxy
         Returns id of db entrance
         '''
-        c=self.db.getCursor()
-        s="INSERT INTO proxies (proxy, dn, attribute, proxytype, myproxyid, expirytime) VALUES ('"\
-                  +proxy+"','"+dn+"','"+attribute+"','"+proxytype+"','"+myproxyid+"','"+expirytime+"')"
-        c.execute(s)
-        c.execute("SELECT LAST_INSERT_ID()")
-        row = c.fetchone()
-        id=row['LAST_INSERT_ID()']
-        proxypath=os.path.join(self.proxydir,"proxiesid"+str(id))
-        c.execute("UPDATE proxies SET proxypath='"+proxypath+"' WHERE id="+str(id))
-        self.Commit()
+        with self.transaction():
+            id = self.db.insert(aCTDBQuery.insert('proxies', {'proxy': proxy, 'dn': dn, 'attribute': attribute,
+                                                              'proxytype': proxytype, 'myproxyid': myproxyid,
+                                                              'expirytime': expirytime}))
+            proxypath=os.path.join(self.proxydir,"proxiesid"+str(id))
+            self.db.execute(aCTDBQuery.update('proxies', {'proxypath': proxypath}, {'id': id}))
         self._writeProxyFile(proxypath, proxy)
         return id
 
@@ -473,11 +567,8 @@ class aCTDBArc(aCTDB):
         '''
         Update proxy fields specified in desc.
         '''
-        s="UPDATE proxies SET "+",".join(['%s=\'%s\'' % (k, v) for k, v in desc.items()])
-        s+=" WHERE id="+str(id)
-        c=self.db.getCursor()
-        c.execute(s)
-        self.Commit()
+        with self.transaction():
+            self.db.execute(aCTDBQuery.update('proxies', desc, {'id': id}))
         # rewrite proxy file if proxy was updated
         if 'proxy' in desc:
             self._writeProxyFile(self.getProxyPath(id), self.getProxy(id))
@@ -486,11 +577,9 @@ class aCTDBArc(aCTDB):
         '''
         Get the path to the proxy file of a proxy
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT proxypath FROM proxies WHERE id="+str(id))
-        row = c.fetchone()
+        rows = self.db.fetch(aCTDBQuery.select('proxies', ['proxypath'], {'id': id}))
         try:
-            proxypath=row['proxypath']
+            proxypath=rows[0]['proxypath']
             if not os.path.isfile(proxypath):
                 self._writeProxyFile(proxypath, self.getProxy(id))
             return proxypath
@@ -501,11 +590,9 @@ class aCTDBArc(aCTDB):
         '''
         Get the string representation of a proxy
         '''
-        c=self.db.getCursor()
-        c.execute("SELECT proxy FROM proxies WHERE id="+str(id))
-        row = c.fetchone()
+        rows = self.db.fetch(aCTDBQuery.select('proxies', ['proxy'], {'id': id}))
         try:
-            proxy = row['proxy']
+            proxy = rows[0]['proxy']
             return proxy
         except Exception as x:
             self.log.error("Could not find proxyid in proxies table. %s", x)
@@ -533,9 +620,8 @@ class aCTDBArc(aCTDB):
         proxypath=self.getProxyPath(id)
         if os.path.isfile(proxypath):
             os.remove(proxypath)
-        c=self.db.getCursor()
-        c.execute("DELETE FROM proxies WHERE id="+str(id))
-        self.Commit()
+        with self.transaction():
+            self.db.execute(aCTDBQuery.delete('proxies', {'id': id}))
 
 if __name__ == '__main__':
     import logging, sys
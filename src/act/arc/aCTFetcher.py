@@ -135,8 +135,16 @@ class aCTFetcher(aCTProcess):
 
     def fetchJobs(self, arcstate, nextarcstate):
 
-        # Get list of jobs in the right state
-        jobstofetch = self.db.getArcJobs("arcstate='"+arcstate+"' and cluster='"+self.cluster+"'" + " limit 100")
+        # Claim jobs in the right state so that other fetchers for the same
+        # cluster skip them while they are downloaded. Jobs which fail to
+        # download stay in the state, so claim in id order after the last
+        # claimed job to reach the jobs behind them.
+        claimed = self.db.claimArcJobs("arcstate='"+arcstate+"' and cluster='"+self.cluster+"'", 100, cursor=arcstate)
+        if not claimed:
+            return
+        claimedids = [j['id'] for j in claimed]
+        jobstofetch = self.db.getArcJobs("id in (%s)" % ','.join([str(i) for i in claimedids]),
+                                         self.db.supervisorattrs)
 
         if not jobstofetch:
             return
@@ -155,7 +163,7 @@ class aCTFetcher(aCTProcess):
             # id: downloadfiles
             downloadfiles = dict((row['id'], row['downloadfiles']) for row in filestodl)
             # jobs to download all files
-            jobs_downloadall = dict((j[0], j[2]) for j in jobs if j[0] in downloadfiles and not downloadfiles[j[0]])
+            jobs_downloadall = dict((j[0], j[2].arcJob()) for j in jobs if j[0] in downloadfiles and not downloadfiles[j[0]])
             # jobs to download specific files
             jobs_downloadsome = dict((j[0], j[2]) for j in jobs if j[0] in downloadfiles and downloadfiles[j[0]])
 
@@ -191,9 +199,13 @@ class aCTFetcher(aCTProcess):
         if len(notfetched) > 10 and len(notfetched) == len(jobstofetch) or \
            len(notfetchedretry) > 10 and len(notfetchedretry) == len(jobstofetch):
             self.log.error("Failed to get any jobs from %s, sleeping for 5 mins" % self.cluster)
+            self.db.releaseArcJobs(claimedids)
             time.sleep(300)
             return
 
+        donefailed = []
+        donejobs = []
+        retry = []
         for proxyid, jobs in jobstofetch.items():
             for (id, appjobid, job, created) in jobs:
                 if job.JobID in notfetchedretry:
@@ -208,17 +220,24 @@ class aCTFetcher(aCTProcess):
                     # TODO Check other permanent errors
                     if not status and status.GetErrno() == errno.ENOENT:
                         self.log.warning("%s: Job %s no longer exists" % (appjobid, job.JobID))
-                        self.db.updateArcJob(id, {"arcstate": "donefailed",
-                                                  "tarcstate": self.db.getTimeStamp()})
-                    # Otherwise try again next time
+                        donefailed.append(id)
+                    else:
+                        # Otherwise try again next time
+                        retry.append(id)
                 elif job.JobID in notfetched:
                     self.log.error("%s: Failed to download job %s" % (appjobid, job.JobID))
-                    self.db.updateArcJob(id, {"arcstate": "donefailed",
-                                              "tarcstate": self.db.getTimeStamp()})
+                    donefailed.append(id)
                 else:
                     self.log.info("%s: Downloaded job %s" % (appjobid, job.JobID))
-                    self.db.updateArcJob(id, {"arcstate": nextarcstate,
-                                              "tarcstate": self.db.getTimeStamp()})
+                    donejobs.append(id)
+
+        self.db.updateArcJobsByID(donefailed, {"arcstate": "donefailed",
+                                               "tarcstate": self.db.getTimeStamp(),
+                                               "claimedby": None, "claimeduntil": None})
+        self.db.updateArcJobsByID(donejobs, {"arcstate": nextarcstate,
+                                             "tarcstate": self.db.getTimeStamp(),
+                                             "claimedby": None, "claimeduntil": None})
+        self.db.releaseArcJobs(retry)
 
 
     def process(self):
@@ -0,0 +1,170 @@
+'''
+Conversion between arc.Job objects and arcjobs rows. The set of stored
+attributes and the encoder and decoder of each attribute are worked out
+once per process from the arc.Job type, so converting a job is a single
+pass over precomputed functions.
+'''
+import ast
+import json
+import arc
+
+# mapping from Job class attribute types to column types
+COLUMNTYPES = {int: 'integer',
+               str: 'varchar(255)',
+               arc.JobState: 'varchar(255)',
+               arc.StringList: 'varchar(1024)',
+               arc.URL: 'varchar(255)',
+               arc.Period: 'int',
+               arc.Time: 'datetime',
+               arc.StringStringMap: 'varchar(1024)'}
+
+# Job class members which are not stored
+IGNOREDMEMBERS = ['STDIN',
+                  'STDOUT',
+                  'STDERR',
+                  'STAGEINDIR',
+                  'STAGEOUTDIR',
+                  'SESSIONDIR',
+                  'JOBLOG',
+                  'JOBDESCRIPTION',
+                  'JobDescriptionDocument']
+
+
+def _ascii(value):
+    # Force everything to ASCII
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        return value.encode('ascii', 'ignore').decode('ascii')
+
+
+def _encodeMap(ssm):
+    # json escapes non-ASCII characters so the result is always ASCII. Drop
+    # entries rather than truncate so the value stays decodable.
+    d = dict(zip(ssm.keys(), ssm.values()))
+    value = json.dumps(d)
+    while len(value) > 1000 and d:
+        d.popitem()
+        value = json.dumps(d)
+    return value
+
+
+def _encodeTime(t):
+    if t.GetTime() == -1:
+        return None
+    # Use UTC time but strip trailing Z since mysql doesn't like it
+    return str(t.str(arc.UTCTime)).rstrip('Z')
+
+
+ENCODERS = {int: lambda v: _ascii(str(v)[:250]),
+            str: lambda v: _ascii(str(v)[:250]),
+            arc.JobState: lambda v: v.GetGeneralState(),
+            arc.StringList: lambda v: _ascii('|'.join(v)[:1000]),
+            arc.URL: lambda v: _ascii(v.str().replace(r'\2f', r'/')),
+            arc.Period: lambda v: str(v.GetPeriod()),
+            arc.Time: _encodeTime,
+            arc.StringStringMap: _encodeMap}
+
+
+def _decodeList(value):
+    l = arc.StringList()
+    for item in value.split('|'):
+        l.append(item)
+    return l
+
+
+def _decodeMap(value):
+    try:
+        d = json.loads(value)
+    except ValueError:
+        # rows written before maps were stored as json hold a python repr
+        try:
+            d = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return None
+    if not isinstance(d, dict):
+        return None
+    m = arc.StringStringMap()
+    for (k, v) in d.items():
+        m[str(k)] = str(v)
+    return m
+
+
+DECODERS = {int: int,
+            str: str,
+            arc.JobState: lambda v: arc.JobState(str(v)),
+            arc.StringList: _decodeList,
+            arc.URL: lambda v: arc.URL(str(v)),
+            arc.Period: lambda v: arc.Period(str(v)),
+            arc.Time: lambda v: arc.Time(str(v)),
+            arc.StringStringMap: _decodeMap}
+
+
+class aCTJobCodec:
+    '''
+    Encoder and decoder of arc.Job objects. Use getJobCodec() to get the
+    instance of the current process.
+    '''
+
+    def __init__(self):
+        # Attributes of Job class mapped to their type
+        self.jobattrs = {}
+        self.emptyjob = arc.Job()
+        for i in dir(self.emptyjob):
+            if i.startswith('__') or i in IGNOREDMEMBERS:
+                continue
+            t = type(getattr(self.emptyjob, i))
+            if t in COLUMNTYPES:
+                self.jobattrs[i] = t
+
+        self.columntypes = dict((attr, COLUMNTYPES[t]) for attr, t in self.jobattrs.items())
+        self.encoders = [(attr, ENCODERS[t]) for attr, t in self.jobattrs.items()]
+        self.decoders = dict((attr, DECODERS[t]) for attr, t in self.jobattrs.items())
+
+    def encode(self, job):
+        '''
+        Convert an arc Job object to a dictionary of column name: value
+        '''
+        d = {}
+        for attr, encoder in self.encoders:
+            value = encoder(getattr(job, attr))
+            if value is not None:
+                d[attr] = value
+        return d
+
+    def decode(self, dbinfo):
+        '''
+        Convert a dictionary of DB key value into arc Job object
+        '''
+        j = arc.Job()
+        for attr, value in dbinfo.items():
+            if value is None or attr not in self.decoders:
+                continue
+            value = self.decoders[attr](value)
+            if value is not None:
+                setattr(j, attr, value)
+        return j
+
+    def decodeAttr(self, attr, value):
+        '''
+        Convert a DB value into the type of the arc Job attribute attr. An
+        unset or invalid value gives the default of the attribute.
+        '''
+        if value is not None:
+            value = self.decoders[attr](value)
+        if value is None:
+            return getattr(self.emptyjob, attr)
+        return value
+
+
+_codec = None
+
+def getJobCodec():
+    '''
+    Return the codec of this process, creating it on first use
+    '''
+    global _codec
+    if _codec is None:
+        _codec = aCTJobCodec()
+    return _codec
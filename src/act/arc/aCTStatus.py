@@ -20,21 +20,8 @@ class aCTStatus(aCTProcess):
 
         # store the last checkJobs time to avoid overloading of GIIS
         self.checktime=time.time()
-
-
-    def resetJobs(self, jobstoreset):
-        '''
-        Empty all StringLists in jobs so that when they are updated they do not
-        contain duplicate values, since ARC always appends to these lists.
-        '''
-        emptylist = arc.StringList()
-        j = arc.Job()
-        attrstoreset = [attr for attr in dir(j) if type(getattr(j, attr)) == arc.StringList]
-
-        for jobs in jobstoreset.values():
-            for job in jobs:
-                for attr in attrstoreset:
-                    setattr(job[2], attr, emptylist)
+        # maximum number of jobs checked with one JobSupervisor
+        self.chunksize = 1000
 
 
     def processJobErrors(self, id, appjobid, failedjob):
@@ -84,87 +71,109 @@ class aCTStatus(aCTProcess):
             return
         self.checktime=time.time()
 
-        # check jobs which were last checked more than checkinterval ago
-        jobstocheck=self.db.getArcJobs("(arcstate='submitted' or arcstate='running' or arcstate='cancelling' or arcstate='holding') and " \
-                                       "jobid not like '' and cluster='"+self.cluster+"' and "+ \
-                                       self.db.timeStampLessThan("tarcstate", self.conf.get(['jobs','checkinterval'])) + \
-                                       " limit 100000")
+        # check jobs which were last checked more than checkinterval ago.
+        # StringLists are not selected so that they are empty when the jobs
+        # are updated, since ARC always appends to these lists.
+        attrs = [attr for attr, attrtype in self.db.jobattrs.items() if attrtype != arc.StringList]
+        select = "(arcstate='submitted' or arcstate='running' or arcstate='cancelling' or arcstate='holding') and " \
+                 "jobid not like '' and cluster='"+self.cluster+"' and "+ \
+                 self.db.timeStampLessThan("tarcstate", self.conf.get(['jobs','checkinterval'])) + \
+                 " limit 100000"
+
+        # Jobs are streamed from the DB in chunks of one proxy and each chunk
+        # is checked and written back before the next is read, so memory
+        # stays flat however many jobs there are to check
+        njobstocheck = 0
+        currentproxyid = None
+        for proxyid, jobs in self.db.getArcJobsStream(select, attrs, self.chunksize):
+            if proxyid != currentproxyid:
+                self.uc.CredentialString(str(self.db.getProxy(proxyid)))
+                currentproxyid = proxyid
+            njobstocheck += len(jobs)
+            self.checkJobsChunk(jobs)
 
-        njobstocheck = sum(len(v) for v in jobstocheck.values())
         if not njobstocheck:
             return
-        self.log.info("%d jobs to check" % njobstocheck)
-        self.resetJobs(jobstocheck)
-
-        # Loop over proxies
-        for proxyid, jobs in jobstocheck.items():
-            self.uc.CredentialString(str(self.db.getProxy(proxyid)))
-
-            job_supervisor = arc.JobSupervisor(self.uc, [j[2] for j in jobs])
-            job_supervisor.Update()
-            jobsupdated = job_supervisor.GetAllJobs()
-            jobsnotupdated = job_supervisor.GetIDsNotProcessed()
-
-            for (originaljobinfo, updatedjob) in zip(jobs, jobsupdated):
-                (id, appjobid, originaljob, created) = originaljobinfo
-                if updatedjob.JobID in jobsnotupdated:
-                    self.log.error("%s: Failed to find information on %s" % (appjobid, updatedjob.JobID))
-                    continue
-                if updatedjob.JobID != originaljob.JobID:
-                    # something went wrong with list order
-                    self.log.warning("%s: Bad job id (%s), expected %s" % (appjobid, updatedjob.JobID, originaljob.JobID))
-                    continue
-                # compare strings here to get around limitations of JobState API
-                # map INLRMS:S and O to HOLD (not necessary when ARC 4.1 is used)
-                if updatedjob.State.GetGeneralState() == 'Queuing' and (updatedjob.State.GetSpecificState() == 'INLRMS:S' or updatedjob.State.GetSpecificState() == 'INLRMS:O'):
-                    updatedjob.State = arc.JobState('Hold')
-                if originaljob.State.GetGeneralState() == updatedjob.State.GetGeneralState() \
-                     and self.cluster not in ['gsiftp://gar-ex-etpgrid1.garching.physik.uni-muenchen.de:2811/preempt', 'gsiftp://arc1-it4i.farm.particle.cz/qfree', 'gsiftp://arc2-it4i.farm.particle.cz/qfree']:
-                    # just update timestamp
-                    # Update numbers every time for superMUC since walltime is missing for finished jobs
-                    self.db.updateArcJob(id, {'tarcstate': self.db.getTimeStamp()})
-                    continue
+        self.log.info('Done, checked %d jobs' % njobstocheck)
+
+    def checkJobsChunk(self, jobs):
+        '''
+        Query the status of a list of (id, appjobid, aCTArcJobRow, created)
+        jobs of the current proxy and write the changes to the DB
+        '''
+        self.log.info("%d jobs to check" % len(jobs))
+
+        # ids of jobs whose state did not change and list of (id, desc, job)
+        # for those that did, written to the DB in bulk after the loop
+        jobstotouch = []
+        jobstoupdate = []
+
+        job_supervisor = arc.JobSupervisor(self.uc, [j[2].arcJob() for j in jobs])
+        job_supervisor.Update()
+        jobsupdated = job_supervisor.GetAllJobs()
+        jobsnotupdated = job_supervisor.GetIDsNotProcessed()
+
+        for (originaljobinfo, updatedjob) in zip(jobs, jobsupdated):
+            (id, appjobid, originaljob, created) = originaljobinfo
+            if updatedjob.JobID in jobsnotupdated:
+                self.log.error("%s: Failed to find information on %s" % (appjobid, updatedjob.JobID))
+                continue
+            if updatedjob.JobID != originaljob.JobID:
+                # something went wrong with list order
+                self.log.warning("%s: Bad job id (%s), expected %s" % (appjobid, updatedjob.JobID, originaljob.JobID))
+                continue
+            # compare strings here to get around limitations of JobState API
+            # map INLRMS:S and O to HOLD (not necessary when ARC 4.1 is used)
+            if updatedjob.State.GetGeneralState() == 'Queuing' and (updatedjob.State.GetSpecificState() == 'INLRMS:S' or updatedjob.State.GetSpecificState() == 'INLRMS:O'):
+                updatedjob.State = arc.JobState('Hold')
+            if originaljob.State.GetGeneralState() == updatedjob.State.GetGeneralState() \
+                 and self.cluster not in ['gsiftp://gar-ex-etpgrid1.garching.physik.uni-muenchen.de:2811/preempt', 'gsiftp://arc1-it4i.farm.particle.cz/qfree', 'gsiftp://arc2-it4i.farm.particle.cz/qfree']:
+                # just update timestamp
+                # Update numbers every time for superMUC since walltime is missing for finished jobs
+                jobstotouch.append(id)
+                continue
 
-                self.log.info("%s: Job %s: %s -> %s (%s)" % (appjobid, originaljob.JobID, originaljob.State.GetGeneralState(),
-                               updatedjob.State.GetGeneralState(), updatedjob.State.GetSpecificState()))
-
-                # state changed, update whole Job object
-                arcstate = 'submitted'
-                if updatedjob.State == arc.JobState.FINISHED:
-                    if updatedjob.ExitCode == -1:
-                        # Missing exit code, but assume success
-                        self.log.warning("%s: Job %s FINISHED but has missing exit code, setting to zero" % (appjobid, updatedjob.JobID))
-                        updatedjob.ExitCode = 0
-                    arcstate = 'finished'
-                    self.log.debug('%s: reported walltime %d, cputime %d' % (appjobid, updatedjob.UsedTotalWallTime.GetPeriod(), updatedjob.UsedTotalCPUTime.GetPeriod()))
-                elif updatedjob.State == arc.JobState.FAILED:
-                    arcstate = self.processJobErrors(id, appjobid, updatedjob)
-                elif updatedjob.State == arc.JobState.KILLED:
-                    arcstate = 'cancelled'
-                elif updatedjob.State == arc.JobState.RUNNING or \
-                     updatedjob.State == arc.JobState.FINISHING:
-                    arcstate = 'running'
-                elif updatedjob.State == arc.JobState.HOLD:
-                    arcstate = 'holding'
-                elif updatedjob.State == arc.JobState.DELETED or \
-                     updatedjob.State == arc.JobState.OTHER:
-                    # unexpected
-                    arcstate = 'failed'
-
-                # Walltime reported by ARC 6 is multiplied by cores
-                if arc.ARC_VERSION_MAJOR >= 6 and updatedjob.RequestedSlots > 0:
-                    updatedjob.UsedTotalWallTime = arc.Period(updatedjob.UsedTotalWallTime.GetPeriod() // updatedjob.RequestedSlots)
-                # Fix crazy wallclock and CPU times
-                if updatedjob.UsedTotalWallTime > arc.Time() - arc.Time(int(created.strftime("%s"))):
-                    fixedwalltime = arc.Time() - arc.Time(int(created.strftime("%s")))
-                    self.log.warning("%s: Fixing reported walltime %d to %d" % (appjobid, updatedjob.UsedTotalWallTime.GetPeriod(), fixedwalltime.GetPeriod()))
-                    updatedjob.UsedTotalWallTime = fixedwalltime
-                if updatedjob.UsedTotalCPUTime > arc.Period(10**7):
-                    self.log.warning("%s: Discarding reported CPUtime %d" % (appjobid, updatedjob.UsedTotalCPUTime.GetPeriod()))
-                    updatedjob.UsedTotalCPUTime = arc.Period(-1)
-                self.db.updateArcJob(id, {'arcstate': arcstate, 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()}, updatedjob)
-
-        self.log.info('Done')
+            self.log.info("%s: Job %s: %s -> %s (%s)" % (appjobid, originaljob.JobID, originaljob.State.GetGeneralState(),
+                           updatedjob.State.GetGeneralState(), updatedjob.State.GetSpecificState()))
+
+            # state changed, update whole Job object
+            arcstate = 'submitted'
+            if updatedjob.State == arc.JobState.FINISHED:
+                if updatedjob.ExitCode == -1:
+                    # Missing exit code, but assume success
+                    self.log.warning("%s: Job %s FINISHED but has missing exit code, setting to zero" % (appjobid, updatedjob.JobID))
+                    updatedjob.ExitCode = 0
+                arcstate = 'finished'
+                self.log.debug('%s: reported walltime %d, cputime %d' % (appjobid, updatedjob.UsedTotalWallTime.GetPeriod(), updatedjob.UsedTotalCPUTime.GetPeriod()))
+            elif updatedjob.State == arc.JobState.FAILED:
+                arcstate = self.processJobErrors(id, appjobid, updatedjob)
+            elif updatedjob.State == arc.JobState.KILLED:
+                arcstate = 'cancelled'
+            elif updatedjob.State == arc.JobState.RUNNING or \
+                 updatedjob.State == arc.JobState.FINISHING:
+                arcstate = 'running'
+            elif updatedjob.State == arc.JobState.HOLD:
+                arcstate = 'holding'
+            elif updatedjob.State == arc.JobState.DELETED or \
+                 updatedjob.State == arc.JobState.OTHER:
+                # unexpected
+                arcstate = 'failed'
+
+            # Walltime reported by ARC 6 is multiplied by cores
+            if arc.ARC_VERSION_MAJOR >= 6 and updatedjob.RequestedSlots > 0:
+                updatedjob.UsedTotalWallTime = arc.Period(updatedjob.UsedTotalWallTime.GetPeriod() // updatedjob.RequestedSlots)
+            # Fix crazy wallclock and CPU times
+            if updatedjob.UsedTotalWallTime > arc.Time() - arc.Time(int(created.strftime("%s"))):
+                fixedwalltime = arc.Time() - arc.Time(int(created.strftime("%s")))
+                self.log.warning("%s: Fixing reported walltime %d to %d" % (appjobid, updatedjob.UsedTotalWallTime.GetPeriod(), fixedwalltime.GetPeriod()))
+                updatedjob.UsedTotalWallTime = fixedwalltime
+            if updatedjob.UsedTotalCPUTime > arc.Period(10**7):
+                self.log.warning("%s: Discarding reported CPUtime %d" % (appjobid, updatedjob.UsedTotalCPUTime.GetPeriod()))
+                updatedjob.UsedTotalCPUTime = arc.Period(-1)
+            jobstoupdate.append((id, {'arcstate': arcstate, 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()}, updatedjob))
+
+        self.db.updateArcJobsByID(jobstotouch, {'tarcstate': self.db.getTimeStamp()})
+        self.db.updateArcJobsBulk(jobstoupdate)
 
     def checkLostJobs(self):
         '''
@@ -176,13 +185,17 @@ class aCTStatus(aCTProcess):
                                     "cluster='"+self.cluster+"' and "+self.db.timeStampLessThan("tarcstate", 172800),
                                     ['id', 'appjobid', 'JobID', 'arcstate'])
 
+        cancelled = []
+        lost = []
         for job in jobs:
             if job['arcstate'] == 'cancelling':
                 self.log.warning("%s: Job %s lost from information system, marking as cancelled" % (job['appjobid'], job['JobID']))
-                self.db.updateArcJob(job['id'], {'arcstate': 'cancelled', 'tarcstate': self.db.getTimeStamp()})
+                cancelled.append(job['id'])
             else:
                 self.log.warning("%s: Job %s lost from information system, marking as lost" % (job['appjobid'], job['JobID']))
-                self.db.updateArcJob(job['id'], {'arcstate': 'lost', 'tarcstate': self.db.getTimeStamp()})
+                lost.append(job['id'])
+        self.db.updateArcJobsByID(cancelled, {'arcstate': 'cancelled', 'tarcstate': self.db.getTimeStamp()})
+        self.db.updateArcJobsByID(lost, {'arcstate': 'lost', 'tarcstate': self.db.getTimeStamp()})
 
 
     def checkStuckJobs(self):
@@ -204,6 +217,8 @@ class aCTStatus(aCTProcess):
             select = "state='%s' and %s" % (jobstate, self.db.timeStampLessThan("tstate", maxtime))
             jobs = self.db.getArcJobsInfo(select, columns=['id', 'JobID', 'appjobid', 'arcstate'])
 
+            tocancel = []
+            cancelled = []
             for job in jobs:
                 if job['arcstate'] == 'toclean':
                     # delete jobs stuck in toclean
@@ -214,17 +229,19 @@ class aCTStatus(aCTProcess):
                 self.log.warning("%s: Job %s too long in state %s, cancelling" % (job['appjobid'], job['JobID'], jobstate))
                 if job['JobID']:
                     # If jobid is defined, cancel
-                    self.db.updateArcJob(job['id'], {'arcstate': 'tocancel', 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()})
+                    tocancel.append(job['id'])
                 else:
                     # Otherwise mark cancelled
-                    self.db.updateArcJob(job['id'], {'arcstate': 'cancelled', 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()})
+                    cancelled.append(job['id'])
+            self.db.updateArcJobsByID(tocancel, {'arcstate': 'tocancel', 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()})
+            self.db.updateArcJobsByID(cancelled, {'arcstate': 'cancelled', 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()})
 
         jobs = self.db.getArcJobsInfo("arcstate='cancelling' and " \
                                       "cluster='"+self.cluster+"' and "+self.db.timeStampLessThan("tstate", 3600),
                                       ['id', 'appjobid'])
         for job in jobs:
             self.log.info("%s: Job stuck in cancelling for more than 1 hour, marking cancelled" % job['appjobid'])
-            self.db.updateArcJob(job['id'], {'arcstate': 'cancelled', 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()})
+        self.db.updateArcJobsByID([job['id'] for job in jobs], {'arcstate': 'cancelled', 'tarcstate': self.db.getTimeStamp(), 'tstate': self.db.getTimeStamp()})
 
 
     def process(self):
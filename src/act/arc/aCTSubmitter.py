@@ -2,8 +2,10 @@ import re
 import time
 import arc
 from random import shuffle
+from act.arc.aCTJobCodec import getJobCodec
 from act.common.aCTProcess import aCTProcess
 from act.common.aCTSignal import ExceptInterrupt
+from act.db import aCTDBQuery
 import multiprocessing, logging
 import signal
 import os
@@ -22,99 +24,6 @@ def KillPool(pool):
         pass
     pool.terminate()
 
-class JobConv:
-
-    def __init__(self):
-        self.jobattrmap = {int: 'integer',
-                      str: 'varchar(255)',
-                      arc.JobState: 'varchar(255)',
-                      arc.StringList: 'varchar(1024)',
-                      arc.URL: 'varchar(255)',
-                      arc.Period: 'int',
-                      arc.Time: 'datetime',
-                      arc.StringStringMap: 'varchar(1024)'}
-        ignoremems=['STDIN',
-                    'STDOUT',
-                    'STDERR',
-                    'STAGEINDIR',
-                    'STAGEOUTDIR',
-                    'SESSIONDIR',
-                    'JOBLOG',
-                    'JOBDESCRIPTION',
-                    'JobDescriptionDocument']
-
-        # Attributes of Job class mapped to DB column type
-        self.jobattrs={}
-        j=arc.Job()
-        for i in dir(j):
-            if re.match('^__',i):
-                continue
-            if i in ignoremems:
-                continue
-            if type(getattr(j, i)) in self.jobattrmap:
-                self.jobattrs[i] = type(getattr(j, i))
-
-    def db2job(self,dbinfo):
-        '''
-        Convert a dictionary of DB key value into arc Job object
-        '''
-        if dbinfo is None:
-            return None
-        j = arc.Job()
-        for attr in self.jobattrs:
-            if attr not in dbinfo or dbinfo[attr] is None:
-                continue
-            # Some object types need special treatment
-            if self.jobattrs[attr] == arc.StringList:
-                l = arc.StringList()
-                for item in dbinfo[attr].split('|'):
-                    l.append(item)
-                setattr(j, attr, l)
-                continue
-            if self.jobattrs[attr] == arc.StringStringMap:
-                m = arc.StringStringMap()
-                d = eval(dbinfo[attr])
-                if not isinstance(d, dict):
-                    continue
-                for (k,v) in d.items():
-                    m[k] = v
-                setattr(j, attr, m)
-                continue
-
-            setattr(j, attr, self.jobattrs[attr](str(dbinfo[attr])))
-        return j
-
-    def job2db(self,job):
-        '''
-        Convert an arc Job object to a dictionary of column name: value
-        '''
-        d = {}
-        for attr in self.jobattrs:
-            if self.jobattrs[attr] == int or self.jobattrs[attr] == str:
-                d[attr] = str(getattr(job, attr))[:250]
-            elif self.jobattrs[attr] == arc.JobState:
-                d[attr] = getattr(job, attr).GetGeneralState()
-            elif self.jobattrs[attr] == arc.StringList:
-                d[attr] = '|'.join(getattr(job, attr))[:1000]
-            elif self.jobattrs[attr] == arc.URL:
-                d[attr] = getattr(job, attr).str().replace(r'\2f',r'/')
-            elif self.jobattrs[attr] == arc.Period:
-                d[attr] = str(getattr(job, attr).GetPeriod())
-            elif self.jobattrs[attr] == arc.Time:
-                if getattr(job, attr).GetTime() != -1:
-                    # Use UTC time but strip trailing Z since mysql doesn't like it
-                    t = str(getattr(job, attr).str(arc.UTCTime))
-                    d[attr] = re.sub('Z$', '', t)
-            elif self.jobattrs[attr] == arc.StringStringMap:
-                ssm = getattr(job, attr)
-                tmpdict = dict(zip(ssm.keys(), ssm.values()))
-                d[attr] = str(tmpdict)[:1000]
-            # Force everything to ASCII
-                        # Force everything to ASCII
-            if attr in d:
-                d[attr] = ''.join([i for i in d[attr] if ord(i) < 128])
-        return d
-
 def Submit(id, appjobid, jobdescstr, ucproxy, timeout):
 
     global queuelist
@@ -162,8 +71,7 @@ def Submit(id, appjobid, jobdescstr, ucproxy, timeout):
         log.error("%s: Submission failed" % appjobid)
         return None
 
-    jconv = JobConv()
-    return jconv.job2db(job)
+    return getJobCodec().encode(job)
 
 class aCTSubmitter(aCTProcess):
 
@@ -190,10 +98,8 @@ class aCTSubmitter(aCTProcess):
             clusterqueue = clusterurl.Path()[1:] # strip off leading slash
 
         # Apply fair-share
-        if self.cluster:
-            fairshares = self.db.getArcJobsInfo("arcstate='tosubmit' and clusterlist like '%"+self.cluster+"%'", ['fairshare', 'proxyid'])
-        else:
-            fairshares = self.db.getArcJobsInfo("arcstate='tosubmit' and clusterlist=''", ['fairshare', 'proxyid'])
+        tosubmit = [('arcstate', 'tosubmit'), self.db.clusterSelect(self.cluster or '', ['tosubmit'])]
+        fairshares = self.db.getArcJobsInfo(tosubmit, ['fairshare', 'proxyid'])
 
         if not fairshares:
             self.log.info('Nothing to submit')
@@ -207,35 +113,12 @@ class aCTSubmitter(aCTProcess):
 
         for fairshare, proxyid in fairshares:
 
-            try:
-                # catch any exceptions here to avoid leaving lock
-                if self.cluster:
-                    # Lock row for update in case multiple clusters are specified
-                    #jobs=self.db.getArcJobsInfo("arcstate='tosubmit' and ( clusterlist like '%{0}' or clusterlist like '%{0},%' ) and fairshare='{1}' order by priority desc limit 10".format(self.cluster, fairshare),
-                    jobs=self.db.getArcJobsInfo("arcstate='tosubmit' and ( clusterlist like '%{0}' or clusterlist like '%{0},%' ) and fairshare='{1}' and proxyid='{2}' limit 10".format(self.cluster, fairshare, proxyid),
-                                                columns=["id", "jobdesc", "appjobid", "priority", "proxyid", "clusterlist"], lock=True)
-                    if jobs:
-                        self.log.debug("started lock for writing %d jobs"%len(jobs))
-                else:
-                    jobs=self.db.getArcJobsInfo("arcstate='tosubmit' and clusterlist='' and fairshare='{0} and proxyid={1}' limit 10".format(fairshare, proxyid),
-                                                columns=["id", "jobdesc", "appjobid", "priority", "proxyid", "clusterlist"])
-                # mark submitting in db
-                jobs_taken=[]
-                for j in jobs:
-                    jd={'cluster': self.cluster, 'arcstate': 'submitting', 'tarcstate': self.db.getTimeStamp()}
-                    self.db.updateArcJobLazy(j['id'],jd)
-                    jobs_taken.append(j)
-                jobs=jobs_taken
-
-            finally:
-                if self.cluster:
-                    try:
-                        self.db.Commit(lock=True)
-                        self.log.debug("ended lock")
-                    except:
-                        self.log.warning("Failed to release DB lock")
-                else:
-                    self.db.Commit()
+            # Claim jobs and mark them submitting in one transaction, so that
+            # several submitters (also for other clusters in the clusterlist)
+            # never pick the same job
+            select = tosubmit + [('fairshare', fairshare), ('proxyid', proxyid)]
+            jd={'cluster': self.cluster, 'arcstate': 'submitting', 'tarcstate': self.db.getTimeStamp()}
+            jobs=self.db.claimArcJobs(select, 10, columns=["id", "jobdesc", "appjobid", "priority", "proxyid", "clusterlist"], desc=jd)
 
             if len(jobs) == 0:
                 #self.log.debug("No jobs to submit")
@@ -313,30 +196,32 @@ class aCTSubmitter(aCTProcess):
                     target.ComputingShare.LocalWaitingJobs = 0
                     target.ComputingShare.PreLRMSWaitingJobs = 0
                     target.ExecutionEnvironment.CPUClockSpeed = 2000
-                    qjobs=self.db.getArcJobsInfo("cluster='" +str(self.cluster)+ "' and  arcstate='submitted' and fairshare='%s'" % fairshare, ['id','priority'])
-                    rjobs=self.db.getArcJobsInfo("cluster='" +str(self.cluster)+ "' and  arcstate='running' and fairshare='%s'" % fairshare, ['id'])
+                    counts = dict((c['state'], c['njobs']) for c in self.db.getStateCounts(
+                        {'cluster': str(self.cluster), 'state': ['submitted', 'running'], 'fairshare': fairshare or ''}))
+                    nqueued = counts.get('submitted', 0)
+                    nrunning = counts.get('running', 0)
 
                     # max queued priority
-                    try:
-                        maxprioqueued = max(qjobs,key = lambda x : x['priority'])['priority']
-                    except:
-                        maxprioqueued = 0
+                    maxprioqueued = 0
+                    if nqueued:
+                        qjobs = self.db.getArcJobsInfo("cluster='" +str(self.cluster)+ "' and  arcstate='submitted' and fairshare='%s'" % fairshare, ['MAX(priority) AS priority'])
+                        maxprioqueued = (qjobs[0]['priority'] if qjobs else 0) or 0
                     self.log.info("Max priority queued: %d" % maxprioqueued)
 
                     # Limit number of submitted jobs using configuration or default (0.15 + 100/num of shares)/num CEs
                     # Note: assumes only a few shares are used
                     qfraction = float(self.conf.get(['jobs', 'queuefraction'])) if self.conf.get(['jobs', 'queuefraction']) else 0.15
                     qoffset = int(self.conf.get(['jobs', 'queueoffset'])) if self.conf.get(['jobs', 'queueoffset']) else 100
-                    jlimit = (len(rjobs) * qfraction + qoffset/len(fairshares)) / len(jobs[0]['clusterlist'].split(','))
-                    self.log.debug("running %d, queued %d, queue limit %d" % (len(rjobs), len(qjobs), jlimit))
+                    jlimit = (nrunning * qfraction + qoffset/len(fairshares)) / len(jobs[0]['clusterlist'].split(','))
+                    self.log.debug("running %d, queued %d, queue limit %d" % (nrunning, nqueued, jlimit))
                     if str(self.cluster).find('arc-boinc-0') != -1:
-                        jlimit = len(rjobs)*0.15 + 400
+                        jlimit = nrunning*0.15 + 400
                     if str(self.cluster).find('XXXpikolit') != -1:
-                        jlimit = len(rjobs)*0.15 + 100
+                        jlimit = nrunning*0.15 + 100
                     if str(self.cluster).find('arc05.lcg') != -1:
-                        jlimit = len(rjobs)*0.15 + 400
-                    target.ComputingShare.PreLRMSWaitingJobs=len(qjobs)
-                    if len(qjobs) < jlimit or ( ( maxpriowaiting > maxprioqueued ) and ( maxpriowaiting > 10 ) ) :
+                        jlimit = nrunning*0.15 + 400
+                    target.ComputingShare.PreLRMSWaitingJobs=nqueued
+                    if nqueued < jlimit or ( ( maxpriowaiting > maxprioqueued ) and ( maxpriowaiting > 10 ) ) :
                         if maxpriowaiting > maxprioqueued :
                             self.log.info("Overriding limit, maxpriowaiting: %d > maxprioqueued: %d" % (maxpriowaiting, maxprioqueued))
                         queuelist.append(target)
@@ -381,11 +266,11 @@ class aCTSubmitter(aCTProcess):
             # timeout per submission
             timeout = 60
             stopflag = False
+            submitted = []
             for result,task in zip(results,tasks):
                 try:
                     jdb = result.get(timeout)
-                    jconv = JobConv()
-                    job = jconv.db2job(jdb)
+                    job = getJobCodec().decode(jdb) if jdb is not None else None
                 except multiprocessing.TimeoutError:
                     self.log.error("%s: submission timeout: exit and try again" % task[1])
                     # abort submission if Submit process is stuck
@@ -406,7 +291,9 @@ class aCTSubmitter(aCTProcess):
                 # extract hostname of cluster (depends on JobID being a URL)
                 self.log.info("%s: job id %s" % (task[1], job.JobID))
                 jd['cluster']=self.cluster
-                self.db.updateArcJobLazy(task[0],jd,job)
+                submitted.append((task[0], jd, job))
+            # write all submitted jobs in one go, also in case of abort below
+            self.db.updateArcJobsBulk(submitted)
             if not stopflag:
                 pool.terminate()
                 pool.join()
@@ -432,17 +319,18 @@ class aCTSubmitter(aCTProcess):
 
         # TODO query GIIS for job name specified in description to see if job
         # was really submitted or not
-        for j in jobs:
-            # set to toresubmit and the application should figure out what to do
-            self.db.updateArcJob(j['id'], {"arcstate": "toresubmit",
-                                           "tarcstate": self.db.getTimeStamp()})
+        # set to toresubmit and the application should figure out what to do
+        self.db.updateArcJobsByID([j['id'] for j in jobs], {"arcstate": "toresubmit",
+                                                            "tarcstate": self.db.getTimeStamp()})
 
     def processToCancel(self):
 
         if self.cluster:
-            jobstocancel = self.db.getArcJobs("arcstate='tocancel' and (cluster='{0}' or clusterlist like '%{0}' or clusterlist like '%{0},%')".format(self.cluster))
+            oncluster = self.db.clusterSelect(self.cluster, ['tocancel'])
+            oncluster = aCTDBQuery.Raw("(cluster=%s or " + oncluster.sql + ")", [self.cluster] + oncluster.params)
+            jobstocancel = self.db.getArcJobs([('arcstate', 'tocancel'), oncluster], self.db.supervisorattrs)
         else:
-            jobstocancel = self.db.getArcJobs("arcstate='tocancel' and cluster=''")
+            jobstocancel = self.db.getArcJobs("arcstate='tocancel' and cluster=''", self.db.supervisorattrs)
         if not jobstocancel:
             return
 
@@ -450,51 +338,56 @@ class aCTSubmitter(aCTProcess):
         for proxyid, jobs in jobstocancel.items():
             self.uc.CredentialString(str(self.db.getProxy(proxyid)))
 
-            job_supervisor = arc.JobSupervisor(self.uc, [j[2] for j in jobs])
+            job_supervisor = arc.JobSupervisor(self.uc, [j[2].arcJob() for j in jobs])
             job_supervisor.Update()
             job_supervisor.Cancel()
 
             notcancelled = job_supervisor.GetIDsNotProcessed()
 
+            cancelled = []
+            cancelling = []
             for (id, appjobid, job, created) in jobs:
 
                 if not job.JobID:
                     # Job not submitted
                     self.log.info("%s: Marking unsubmitted job cancelled" % appjobid)
-                    self.db.updateArcJob(id, {"arcstate": "cancelled",
-                                              "tarcstate": self.db.getTimeStamp()})
+                    cancelled.append(id)
 
                 elif job.JobID in notcancelled:
                     if job.State == arc.JobState.UNDEFINED:
                         # If longer than one hour since submission assume job never made it
                         if arc.Time(int(created.strftime("%s"))) + arc.Period(3600) < arc.Time():
                             self.log.warning("%s: Assuming job %s is lost and marking as cancelled" % (appjobid, job.JobID))
-                            self.db.updateArcJob(id, {"arcstate": "cancelled",
-                                                      "tarcstate": self.db.getTimeStamp()})
+                            cancelled.append(id)
                         else:
                             # Job has not yet reached info system
                             self.log.warning("%s: Job %s is not yet in info system so cannot be cancelled" % (appjobid, job.JobID))
                     else:
                         self.log.error("%s: Could not cancel job %s" % (appjobid, job.JobID))
                         # Just to mark as cancelled so it can be cleaned
-                        self.db.updateArcJob(id, {"arcstate": "cancelled",
-                                                  "tarcstate": self.db.getTimeStamp()})
+                        cancelled.append(id)
                 else:
-                    self.db.updateArcJob(id, {"arcstate": "cancelling",
-                                              "tarcstate": self.db.getTimeStamp()})
+                    cancelling.append(id)
+
+            self.db.updateArcJobsByID(cancelled, {"arcstate": "cancelled",
+                                                  "tarcstate": self.db.getTimeStamp()})
+            self.db.updateArcJobsByID(cancelling, {"arcstate": "cancelling",
+                                                   "tarcstate": self.db.getTimeStamp()})
 
     def processToResubmit(self):
 
         if self.cluster:
-            jobstoresubmit = self.db.getArcJobs("arcstate='toresubmit' and cluster='"+self.cluster+"'")
+            jobstoresubmit = self.db.getArcJobs("arcstate='toresubmit' and cluster='"+self.cluster+"'",
+                                                self.db.supervisorattrs)
         else:
-            jobstoresubmit = self.db.getArcJobs("arcstate='toresubmit' and clusterlist=''")
+            jobstoresubmit = self.db.getArcJobs([('arcstate', 'toresubmit'), self.db.clusterSelect('', ['toresubmit'])],
+                                                self.db.supervisorattrs)
 
         for proxyid, jobs in jobstoresubmit.items():
             self.uc.CredentialString(str(self.db.getProxy(proxyid)))
 
             # Clean up jobs which were submitted
-            jobstoclean = [job[2] for job in jobs if job[2].JobID]
+            jobstoclean = [job[2].arcJob() for job in jobs if job[2].JobID]
 
             if jobstoclean:
 
@@ -527,10 +420,9 @@ class aCTSubmitter(aCTProcess):
 
             # Empty job to reset DB info
             j = arc.Job()
-            for (id, appjobid, job, created) in jobs:
-                self.db.updateArcJob(id, {"arcstate": "tosubmit",
-                                          "tarcstate": self.db.getTimeStamp(),
-                                          "cluster": None}, j)
+            self.db.updateArcJobsBulk([(id, {"arcstate": "tosubmit",
+                                             "tarcstate": self.db.getTimeStamp(),
+                                             "cluster": None}, j) for (id, appjobid, job, created) in jobs])
 
     def processToRerun(self):
 
@@ -538,7 +430,7 @@ class aCTSubmitter(aCTProcess):
             # Rerun only applies to job which have been submitted
             return
 
-        jobstorerun = self.db.getArcJobs("arcstate='torerun' and cluster='"+self.cluster+"'")
+        jobstorerun = self.db.getArcJobs("arcstate='torerun' and cluster='"+self.cluster+"'", self.db.supervisorattrs)
         if not jobstorerun:
             return
 
@@ -551,27 +443,32 @@ class aCTSubmitter(aCTProcess):
         for proxyid, jobs in jobstorerun.items():
             self.uc.CredentialString(str(self.db.getProxy(proxyid)))
 
-            job_supervisor = arc.JobSupervisor(self.uc, [j[2] for j in jobs])
+            job_supervisor = arc.JobSupervisor(self.uc, [j[2].arcJob() for j in jobs])
             job_supervisor.Update()
             # Renew proxy to be safe
             job_supervisor.Renew()
-            job_supervisor = arc.JobSupervisor(self.uc, [j[2] for j in jobs])
+            job_supervisor = arc.JobSupervisor(self.uc, [j[2].arcJob() for j in jobs])
             job_supervisor.Update()
             job_supervisor.Resume()
 
             notresumed = job_supervisor.GetIDsNotProcessed()
 
+            failed = []
+            resumed = []
             for (id, appjobid, job, created) in jobs:
                 if job.JobID in notresumed:
                     self.log.error("%s: Could not resume job %s" % (appjobid, job.JobID))
-                    self.db.updateArcJob(id, {"arcstate": "failed",
-                                              "tarcstate": self.db.getTimeStamp()})
+                    failed.append(id)
                 else:
-                    # Force a wait before next status check, to allow the
-                    # infosys to update and avoid the failed state being picked
-                    # up again
-                    self.db.updateArcJob(id, {"arcstate": "submitted",
-                                              "tarcstate": self.db.getTimeStamp(time.time()+3600)})
+                    resumed.append(id)
+
+            self.db.updateArcJobsByID(failed, {"arcstate": "failed",
+                                               "tarcstate": self.db.getTimeStamp()})
+            # Force a wait before next status check, to allow the
+            # infosys to update and avoid the failed state being picked
+            # up again
+            self.db.updateArcJobsByID(resumed, {"arcstate": "submitted",
+                                                "tarcstate": self.db.getTimeStamp(time.time()+3600)})
 
 
     def process(self):
@@ -4,6 +4,7 @@ app_processes = ['aCTAGISFetcher',
                  'aCTAutopilot',
                  'aCTAutopilotSent',
                  'aCTPandaGetJobs',
+                 'aCTPandaArchiver',
                  'aCTPanda2Arc',
                  'aCTPanda2Condor',
                  'aCTValidator',
@@ -12,6 +12,7 @@ from act.condor import aCTDBCondor
 from act.atlas import aCTAGISParser
 from act.atlas import aCTAPFMon
 from act.atlas import aCTDBPanda
+from act.db import aCTDBEvents
 
 
 class aCTATLASProcess:
@@ -39,6 +40,13 @@ class aCTATLASProcess:
         self.dbarc=aCTDBArc.aCTDBArc(self.log)
         self.dbcondor=aCTDBCondor.aCTDBCondor(self.log)
         self.dbpanda=aCTDBPanda.aCTDBPanda(self.log)
+        # job state transitions, see getChangedJobs()
+        self.dbevents=aCTDBEvents.aCTDBEvents(self.log)
+        self.fullscaninterval = 600
+        self.lastfullscan = 0
+        self.eventseq = None
+        # processes reading the events wake up as soon as events arrive
+        self.waitevents = False
 
         # APFMon
         self.apfmon = aCTAPFMon.aCTAPFMon(self.conf)
@@ -60,6 +68,39 @@ class aCTATLASProcess:
         # For DB queries
         self.sitesselect =  "('%s')" % "','".join(self.sites.keys())
 
+    def getChangedJobs(self, table):
+        '''
+        Return a where clause restricting table (arcjobs or condorjobs) to the
+        jobs whose state, or the actpandastatus of whose pandajob, changed
+        since the last call, read from the job events outbox. Every
+        fullscaninterval seconds all jobs are selected instead, to catch
+        anything the events did not cover. Call ackChangedJobs() once the
+        jobs are processed.
+        '''
+        if time.time() - self.lastfullscan > self.fullscaninterval:
+            # events up to now are covered by the full scan
+            self.eventseq = self.dbevents.getScanPosition(self.name)
+            self.lastfullscan = time.time()
+            return "1=1"
+        (events, self.eventseq) = self.dbevents.getEvents(self.name, [table, 'pandajobs'])
+        ids = set([e['jobid'] for e in events if e['tablename'] == table])
+        pandaids = set([e['jobid'] for e in events if e['tablename'] == 'pandajobs'])
+        if pandaids:
+            column = 'arcjobid' if table == 'arcjobs' else 'condorjobid'
+            jobs = self.dbpanda.getJobs({'id': list(pandaids)}, [column])
+            ids.update([j[column] for j in jobs if j[column]])
+        if not ids:
+            return "1=0"
+        return "%s.id in (%s)" % (table, ','.join([str(i) for i in ids]))
+
+    def ackChangedJobs(self):
+        '''
+        Acknowledge the events returned by the last getChangedJobs()
+        '''
+        if self.eventseq is not None:
+            self.dbevents.setPosition(self.name, self.eventseq)
+            self.eventseq = None
+
     def process(self):
         '''
         Called every loop during the main loop. Subclasses must implement this
@@ -79,7 +120,10 @@ class aCTATLASProcess:
                 # do class-specific things
                 self.process()
                 # sleep
-                aCTUtils.sleep(2)
+                if self.waitevents:
+                    self.dbevents.waitEvents(2)
+                else:
+                    aCTUtils.sleep(2)
                 # restart periodically in case of hangs
                 #ip=int(self.conf.get(['periodicrestart', self.name.lower()]))
                 #if time.time()-self.starttime > ip and ip != 0 :
@@ -17,6 +17,7 @@ class aCTATLASStatus(aCTATLASProcess):
 
     def __init__(self):
         aCTATLASProcess.__init__(self, ceflavour=['ARC-CE'])
+        self.waitevents = True
 
     def checkJobstoKill(self):
         """
@@ -108,7 +109,8 @@ class aCTATLASStatus(aCTATLASProcess):
         """
         select = "((arcjobs.arcstate in ('submitted', 'holding') and pandajobs.actpandastatus='sent') or"
         select += " (arcjobs.arcstate in ('tosubmit', 'submitting', 'submitted', 'holding') and pandajobs.actpandastatus='running'))"
-        select += " and arcjobs.id=pandajobs.arcjobid and pandajobs.sitename in %s limit 100000" % self.sitesselect
+        select += " and arcjobs.id=pandajobs.arcjobid and pandajobs.sitename in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
         columns = ["arcjobs.id", "arcjobs.cluster", "arcjobs.appjobid"]
         jobstoupdate=self.dbarc.getArcJobsInfo(select, columns=columns, tables="arcjobs,pandajobs")
 
@@ -117,15 +119,15 @@ class aCTATLASStatus(aCTATLASProcess):
         else:
             self.log.debug("Found %d submitted jobs (%s)" % (len(jobstoupdate), ','.join([j['appjobid'] for j in jobstoupdate])))
 
-        for aj in jobstoupdate:
-            select = "arcjobid='"+str(aj["id"])+"'"
-            desc = {}
-            desc["pandastatus"] = "starting"
-            desc["actpandastatus"] = "starting"
-            if aj['cluster']:
-                desc["computingElement"] = urlparse(aj['cluster']).hostname
-            self.dbpanda.updateJobsLazy(select, desc)
-        self.dbpanda.Commit()
+        with self.dbpanda.transaction():
+            for aj in jobstoupdate:
+                select = "arcjobid='"+str(aj["id"])+"'"
+                desc = {}
+                desc["pandastatus"] = "starting"
+                desc["actpandastatus"] = "starting"
+                if aj['cluster']:
+                    desc["computingElement"] = urlparse(aj['cluster']).hostname
+                self.dbpanda.updateJobsLazy(select, desc)
 
 
     def updateRunningJobs(self):
@@ -141,7 +143,8 @@ class aCTATLASStatus(aCTATLASProcess):
         # todo: pandajobs.starttime will not be updated if a job is resubmitted
         # internally by the ARC part.
         select = "arcjobs.id=pandajobs.arcjobid and arcjobs.arcstate='running' and pandajobs.actpandastatus in ('starting', 'sent')"
-        select += " and pandajobs.sitename in %s limit 100000" % self.sitesselect
+        select += " and pandajobs.sitename in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
 
         columns = ["arcjobs.id", "arcjobs.UsedTotalWalltime", "arcjobs.ExecutionNode",
                    "arcjobs.cluster", "arcjobs.RequestedSlots", "pandajobs.pandaid", "pandajobs.siteName", "arcjobs.appjobid"]
@@ -197,7 +200,8 @@ class aCTATLASStatus(aCTATLASProcess):
         select += " and pandajobs.actpandastatus != 'toresubmit'"
         select += " and pandajobs.actpandastatus != 'toclean'"
         select += " and pandajobs.actpandastatus != 'finished'"
-        select += " and pandajobs.sitename in %s limit 100000" % self.sitesselect
+        select += " and pandajobs.sitename in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
         columns = ["arcjobs.id", "arcjobs.UsedTotalWallTime", "arcjobs.EndTime", "arcjobs.appjobid", "pandajobs.sendhb", "pandajobs.siteName"]
         jobstoupdate=self.dbarc.getArcJobsInfo(select, tables="arcjobs,pandajobs", columns=columns)
 
@@ -419,7 +423,7 @@ class aCTATLASStatus(aCTATLASProcess):
         If not do post-processing and fill status in pandajobs
         """
         # Get outputs to download for failed jobs
-        select = "arcstate='failed'"
+        select = "arcstate='failed' and " + self.changedjobs
         columns = ['id']
         arcjobs = self.dbarc.getArcJobsInfo(select, columns)
         if arcjobs:
@@ -432,7 +436,8 @@ class aCTATLASStatus(aCTATLASProcess):
         # Look for failed final states in ARC which are still starting or running in panda
         select = "(arcstate='donefailed' or arcstate='cancelled' or arcstate='lost')"
         select += " and actpandastatus in ('sent', 'starting', 'running')"
-        select += " and pandajobs.arcjobid = arcjobs.id and siteName in %s limit 100000" % self.sitesselect
+        select += " and pandajobs.arcjobid = arcjobs.id and siteName in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
         columns = ['arcstate', 'arcjobid', 'appjobid', 'JobID', 'arcjobs.Error', 'arcjobs.EndTime',
                    'siteName', 'ExecutionNode', 'pandaid', 'UsedTotalCPUTime', 'pandajobs.created',
                    'UsedTotalWallTime', 'ExitCode', 'sendhb', 'stdout', 'metadata', 'cluster', 'corecount']
@@ -573,6 +578,9 @@ class aCTATLASStatus(aCTATLASProcess):
         self.setSites()
         # Check for jobs that panda told us to kill and cancel them in ARC
         self.checkJobstoKill()
+        # Only look at jobs whose state changed since the last loop, apart
+        # from a periodic full scan
+        self.changedjobs = self.getChangedJobs('arcjobs')
         # Check status of arcjobs
         # Query jobs that were submitted since last time
         self.updateStartingJobs()
@@ -588,6 +596,8 @@ class aCTATLASStatus(aCTATLASProcess):
         self.updateFailedJobs()
         # Clean up jobs left behind in arcjobs table
         self.cleanupLeftovers()
+        # All changed jobs were processed
+        self.ackChangedJobs()
 
 
 if __name__ == '__main__':
@@ -9,6 +9,7 @@ class aCTATLASStatusCondor(aCTATLASProcess):
 
     def __init__(self):
         aCTATLASProcess.__init__(self, ceflavour=['HTCONDOR-CE', 'CREAM-CE'])
+        self.waitevents = True
 
     def checkJobstoKill(self):
         """
@@ -91,7 +92,7 @@ class aCTATLASStatusCondor(aCTATLASProcess):
 
         select = "condorjobs.id=pandajobs.condorjobid and (condorjobs.condorstate='submitted' or condorjobs.condorstate='holding')"
         select += " and pandajobs.actpandastatus='sent' and siteName in %s" % self.sitesselect
-        select += " limit 100000"
+        select += " and %s limit 100000" % self.changedjobs
         columns = ["condorjobs.id", "condorjobs.cluster", "condorjobs.appjobid"]
         jobstoupdate = self.dbcondor.getCondorJobsInfo(select, columns=columns, tables="condorjobs,pandajobs")
 
@@ -121,7 +122,8 @@ class aCTATLASStatusCondor(aCTATLASProcess):
 
         # do an inner join to pick up all jobs that should be set to running
         select = "condorjobs.id=pandajobs.condorjobid and condorjobs.condorstate='running' and pandajobs.actpandastatus='starting'"
-        select += " and siteName in %s limit 100000" % self.sitesselect
+        select += " and siteName in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
         columns = ["condorjobs.id", "condorjobs.JobCurrentStartDate",
                    "condorjobs.cluster", "pandajobs.pandaid", "pandajobs.siteName", "condorjobs.appjobid"]
         jobstoupdate = self.dbcondor.getCondorJobsInfo(select, columns=columns, tables="condorjobs,pandajobs")
@@ -160,7 +162,8 @@ class aCTATLASStatusCondor(aCTATLASProcess):
         select += " and pandajobs.actpandastatus != 'toresubmit'"
         select += " and pandajobs.actpandastatus != 'toclean'"
         select += " and pandajobs.actpandastatus != 'finished'"
-        select += " and pandajobs.sitename in %s limit 100000" % self.sitesselect
+        select += " and pandajobs.sitename in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
         columns = ["condorjobs.id", "condorjobs.JobCurrentStartDate", "condorjobs.CompletionDate",
                    "condorjobs.appjobid", "pandajobs.sendhb", "pandajobs.siteName"]
         jobstoupdate = self.dbcondor.getCondorJobsInfo(select, tables="condorjobs,pandajobs", columns=columns)
@@ -192,7 +195,7 @@ class aCTATLASStatusCondor(aCTATLASProcess):
         status in pandajobs
         """
         # Get outputs to download for failed jobs
-        select = "condorstate='failed'"
+        select = "condorstate='failed' and " + self.changedjobs
         columns = ['id']
         condorjobs = self.dbcondor.getCondorJobsInfo(select, columns)
         if condorjobs:
@@ -205,7 +208,8 @@ class aCTATLASStatusCondor(aCTATLASProcess):
         # Look for failed final states
         select = "(condorstate='donefailed' or condorstate='cancelled' or condorstate='lost')"
         select += " and actpandastatus!='toclean' and actpandastatus!='toresubmit'"
-        select += " and pandajobs.condorjobid = condorjobs.id and pandajobs.sitename in %s limit 100000" % self.sitesselect
+        select += " and pandajobs.condorjobid = condorjobs.id and pandajobs.sitename in %s" % self.sitesselect
+        select += " and %s limit 100000" % self.changedjobs
         columns = ['condorstate', 'appjobid', 'condorjobid', 'JobCurrentStartDate', 'CompletionDate', 'actpandastatus']
 
         jobstoupdate = self.dbcondor.getCondorJobsInfo(select, columns=columns, tables='condorjobs,pandajobs')
@@ -306,6 +310,9 @@ class aCTATLASStatusCondor(aCTATLASProcess):
         self.setSites()
         # Check for jobs that panda told us to kill and cancel them in Condor
         self.checkJobstoKill()
+        # Only look at jobs whose state changed since the last loop, apart
+        # from a periodic full scan
+        self.changedjobs = self.getChangedJobs('condorjobs')
         # Check status of condorjobs
         # Query jobs that were submitted since last time
         self.updateStartingJobs()
@@ -319,6 +326,8 @@ class aCTATLASStatusCondor(aCTATLASProcess):
         self.updateFailedJobs()
         # Clean up jobs left behind in condorjobs table
         self.cleanupLeftovers()
+        # All changed jobs were processed
+        self.ackChangedJobs()
 
 
 if __name__ == '__main__':
@@ -11,6 +11,7 @@ from act.common import aCTProxy
 from act.common import aCTUtils
 from act.atlas import aCTPanda
 from act.atlas.aCTATLASProcess import aCTATLASProcess
+from act.atlas.aCTDBPanda import isEventService
 from act.atlas.aCTPandaJob import aCTPandaJob
 
 class PandaThr(Thread):
@@ -111,7 +112,7 @@ class aCTAutopilot(aCTATLASProcess):
         Heartbeat status updates.
         """
         columns = ['pandaid', 'siteName', 'startTime', 'computingElement', 'node', 'corecount', 'eventranges']
-        jobs=self.dbpanda.getJobs("pandastatus='"+pstatus+"' and sendhb=1 and ("+self.dbpanda.timeStampLessThan("theartbeat", self.conf.get(['panda','heartbeattime']))+" or modified > theartbeat) limit 1000", columns)
+        jobs=self.dbpanda.getJobsPage('heartbeat-'+pstatus, "pandastatus='"+pstatus+"' and sendhb=1 and ("+self.dbpanda.timeStampLessThan("theartbeat", self.conf.get(['panda','heartbeattime']))+" or modified > theartbeat)", 1000, columns)
         if not jobs:
             return
 
@@ -190,7 +191,7 @@ class aCTAutopilot(aCTATLASProcess):
         Heartbeat status updates in bulk.
         """
         columns = ['pandaid', 'siteName', 'startTime', 'computingElement', 'node', 'corecount', 'eventranges']
-        jobs=self.dbpanda.getJobs("pandastatus='"+pstatus+"' and sendhb=1 and ("+self.dbpanda.timeStampLessThan("theartbeat", self.conf.get(['panda','heartbeattime']))+" or modified > theartbeat) limit 1000", columns)
+        jobs=self.dbpanda.getJobsPage('heartbeat-'+pstatus, "pandastatus='"+pstatus+"' and sendhb=1 and ("+self.dbpanda.timeStampLessThan("theartbeat", self.conf.get(['panda','heartbeattime']))+" or modified > theartbeat)", 1000, columns)
         #jobs=self.dbpanda.getJobs("pandastatus='"+pstatus+"' and sendhb=1 and ("+self.dbpanda.timeStampLessThan("theartbeat", 60)+" or modified > theartbeat) limit 1000", columns)
         if not jobs:
             return
@@ -282,7 +283,7 @@ class aCTAutopilot(aCTATLASProcess):
         Final status update for completed jobs (finished or failed in athena)
         and cancelled jobs
         """
-        jobs=self.dbpanda.getJobs("actpandastatus='finished' or actpandastatus='failed' or actpandastatus='cancelled' limit 1000")
+        jobs=self.dbpanda.getJobsPage('finished', "actpandastatus='finished' or actpandastatus='failed' or actpandastatus='cancelled'", 1000)
 
         if not jobs:
             return
@@ -382,7 +383,7 @@ class aCTAutopilot(aCTATLASProcess):
 
             if j['actpandastatus'] == 'finished' \
               and 'plugin=arc' in self.sites[j['siteName']]['catchall'] \
-              and re.search('eventService=True', j['pandajob']):
+              and isEventService(j):
 
                 # Check if we are running in harvester mode
                 try:
@@ -531,39 +532,6 @@ class aCTAutopilot(aCTATLASProcess):
         self.log.info("missing jobs: %d removed" % count)
 
 
-    def updateArchive(self):
-        """
-        Move old jobs older than 1 day to archive table
-        """
-
-        # modified column is reported in local time so may not be exactly one day
-        select = self.dbpanda.timeStampLessThan('modified', 60*60*24)
-        select += ' and (actpandastatus="done" or actpandastatus="donefailed" or actpandastatus="donecancelled")'
-        columns = ['pandaid', 'sitename', 'actpandastatus', 'starttime', 'endtime', 'modified']
-        jobs = self.dbpanda.getJobs(select, columns)
-        if not jobs:
-            return
-
-        self.log.info('Archiving %d jobs' % len(jobs))
-        for job in jobs:
-            self.log.debug('Archiving panda job %d' % job['pandaid'])
-            # Fill out empty start/end time
-            if job['starttime']:
-                if not job['endtime']:
-                    job['endtime'] = job['modified']
-            elif job['endtime']:
-                job['starttime'] = job['endtime']
-            else:
-                job['starttime'] = self.dbpanda.getTimeStamp()
-                job['endtime'] = self.dbpanda.getTimeStamp()
-
-            # archive table doesn't have modified
-            jobarchive = job.copy()
-            del jobarchive['modified']
-            self.dbpanda.insertJobArchiveLazy(jobarchive)
-            self.dbpanda.deleteJob(job['pandaid']) # commit is called here
-
-
     def process(self):
         """
         Method called from loop
@@ -580,11 +548,7 @@ class aCTAutopilot(aCTATLASProcess):
         # Update jobs which finished
         self.updatePandaFinishedPilot()
 
-        # Move old jobs to archive - every hour
-        if time.time()-self.starttime > 3600:
-            self.log.info("Checking for jobs to archive")
-            self.updateArchive()
-            self.starttime = time.time()
+        # Moving old jobs to the archive is done in aCTPandaArchiver
 
 
 if __name__ == '__main__':
@@ -1,9 +1,142 @@
-from act.db.aCTDB import aCTDB
+import datetime
+import json
+import urllib.parse
+from act.db.aCTDB import aCTDB, monthRange
+from act.db import aCTDBQuery
+
+# Large pandajobs columns which getJobs() only loads when they are accessed
+LAZYCOLUMNS = ['pandajob', 'eventranges', 'metadata', 'error', 'jobinfo']
+
+# Fields of the panda job description stored in the jobinfo column, i.e. all
+# those used by aCT after the job is retrieved from panda
+JOBINFOFIELDS = ['PandaID', 'prodSourceLabel', 'jobName', 'jobsetID', 'taskID',
+                 'eventService', 'eventServiceMerge', 'coreCount', 'maxDiskCount',
+                 'minRamCount', 'maxCpuCount', 'currentPriority', 'transformation',
+                 'jobPars', 'swRelease', 'homepackage', 'cmtConfig', 'prodUserID',
+                 'inFiles', 'outFiles', 'logFile', 'fsize', 'GUID', 'scopeIn',
+                 'realDatasetsIn', 'prodDBlockToken', 'ddmEndPointIn']
+
+
+def decodePandaJob(pandajob):
+    '''
+    Decode the urlencoded panda job description into a dictionary of the
+    fields in JOBINFOFIELDS
+    '''
+    fields = urllib.parse.parse_qs(pandajob)
+    return dict((k, fields[k][0]) for k in JOBINFOFIELDS if k in fields)
+
+
+def getJobDesc(pandadbjob):
+    '''
+    Return the job description of a pandajobs row in the format returned by
+    parse_qs(), using the decoded jobinfo column if it is filled
+    '''
+    if pandadbjob.get('jobinfo'):
+        return dict((k, [v]) for k, v in json.loads(pandadbjob['jobinfo']).items())
+    return urllib.parse.parse_qs(pandadbjob['pandajob'])
+
+
+def isEventService(pandadbjob):
+    '''
+    Return True if the pandajobs row is an event service job
+    '''
+    if pandadbjob.get('eventservice') is not None:
+        return bool(pandadbjob['eventservice'])
+    # rows inserted before the description was decoded at insertion
+    return 'eventService=True' in (pandadbjob.get('pandajob') or '')
+
+
+class aCTPandaJobRow(dict):
+    '''
+    Row of pandajobs returned by aCTDBPanda.getJobs() when no columns are
+    given. The columns in LAZYCOLUMNS are not selected up front: the first
+    access to one of them loads that column for all rows of the same result
+    set in one query. Iterating over the row or its keys, values or items
+    loads all of them. Copies and pickles of a row are plain dictionaries
+    with all columns loaded, so they can be passed to other processes.
+    '''
+
+    __slots__ = ('_resultset',)
+
+    def __init__(self, row, resultset):
+        dict.__init__(self, row)
+        self._resultset = resultset
+
+    def _loadAll(self):
+        for key in LAZYCOLUMNS:
+            if not dict.__contains__(self, key):
+                self._resultset.load(key)
+
+    def __missing__(self, key):
+        if key not in LAZYCOLUMNS:
+            raise KeyError(key)
+        self._resultset.load(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in LAZYCOLUMNS
+
+    def __len__(self):
+        return dict.__len__(self) + len([k for k in LAZYCOLUMNS if not dict.__contains__(self, k)])
+
+    def __iter__(self):
+        self._loadAll()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self._loadAll()
+        return dict.keys(self)
+
+    def values(self):
+        self._loadAll()
+        return dict.values(self)
+
+    def items(self):
+        self._loadAll()
+        return dict.items(self)
+
+    def copy(self):
+        self._loadAll()
+        return dict(dict.items(self))
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class aCTPandaJobResultSet:
+    '''
+    Rows returned by one getJobs() call, used to load lazy columns in bulk
+    '''
+
+    def __init__(self, db, rows, chunksize=1000):
+        self.db = db
+        self.rows = [aCTPandaJobRow(row, self) for row in rows]
+        self.chunksize = chunksize
+
+    def load(self, column):
+        byid = dict((row['id'], row) for row in self.rows)
+        ids = list(byid.keys())
+        for i in range(0, len(ids), self.chunksize):
+            for value in self.db.fetch(aCTDBQuery.select('pandajobs', ['id', column], {'id': ids[i:i+self.chunksize]})):
+                dict.__setitem__(byid[value['id']], column, value[column])
+        # rows deleted in the meantime
+        for row in self.rows:
+            if not dict.__contains__(row, column):
+                dict.__setitem__(row, column, None)
+
 
 class aCTDBPanda(aCTDB):
 
     def __init__(self, log):
         aCTDB.__init__(self, log, 'pandajobs')
+        # pandajobs columns, filled on first use
+        self.columns = []
 
     def createTables(self):
         '''
@@ -47,10 +180,23 @@ class aCTDBPanda(aCTDB):
            - corecount: Number of cores used by job
            - metadata: Generic json metadata sent by the client
            - error: Error string from a failed job
+           - eventservice: Whether the job is an event service job
+           - jobinfo: JSON of the fields of pandajob used by aCT, decoded once
+             when the job is inserted (see JOBINFOFIELDS)
 
-        pandaarchive:
+        pandaarchive: partitioned by month of endTime, see
+        maintainArchivePartitions()
           - Selected fields from above list:
             - pandaid, siteName, actpandastatus, startTime, endTime
+
+        pandaarchive_daily: roll-up of pandaarchive per day of endTime,
+        maintained by rollupArchive()
+          - day, siteName, actpandastatus: key of the roll-up
+          - njobs: Number of jobs
+          - walltime: Sum of endTime-startTime of all jobs in seconds
+          - walltime50, walltime90, walltime99: Percentiles of endTime-startTime
+          - firststart: Earliest startTime
+          - lastend: Latest endTime
         '''
 
         str="""
@@ -73,21 +219,22 @@ class aCTDBPanda(aCTDB):
         endTime TIMESTAMP,
         computingElement VARCHAR(255),
         proxyid integer,
-        sendhb TINYINT(1) DEFAULT 1,
+        sendhb SMALLINT DEFAULT 1,
         eventranges mediumtext,
         corecount integer,
         metadata BLOB,
         error mediumtext,
+        eventservice SMALLINT,
+        jobinfo mediumtext,
         UNIQUE (pandaid)
     )
 """
 
         # First check if table already exists
         c = self.db.getCursor()
-        c.execute("show tables like 'pandajobs'")
-        row = c.fetchone()
+        exists = self.db.tableExists('pandajobs')
         self.Commit()
-        if row:
+        if exists:
             answer = input("Table pandajobs already exists!\nAre you sure you want to recreate it? (y/n) ")
             if answer != 'y':
                 return True
@@ -96,12 +243,14 @@ class aCTDBPanda(aCTDB):
         try:
             c.execute(str)
             # add indexes
-            c.execute("ALTER TABLE pandajobs ADD INDEX (arcjobid)")
-            c.execute("ALTER TABLE pandajobs ADD INDEX (condorjobid)")
-            c.execute("ALTER TABLE pandajobs ADD INDEX (pandaid)")
-            c.execute("ALTER TABLE pandajobs ADD INDEX (pandastatus)")
-            c.execute("ALTER TABLE pandajobs ADD INDEX (actpandastatus)")
-            c.execute("ALTER TABLE pandajobs ADD INDEX (siteName)")
+            c.execute("CREATE INDEX pandajobs_arcjobid ON pandajobs (arcjobid)")
+            c.execute("CREATE INDEX pandajobs_condorjobid ON pandajobs (condorjobid)")
+            c.execute("CREATE INDEX pandajobs_pandaid ON pandajobs (pandaid)")
+            c.execute("CREATE INDEX pandajobs_pandastatus ON pandajobs (pandastatus)")
+            c.execute("CREATE INDEX pandajobs_actpandastatus ON pandajobs (actpandastatus)")
+            c.execute("CREATE INDEX pandajobs_siteName ON pandajobs (siteName)")
+            c.execute("CREATE INDEX pandajobs_site_actstatus ON pandajobs (siteName, actpandastatus)")
+            c.execute("CREATE INDEX pandajobs_status_heartbeat ON pandajobs (pandastatus, sendhb, theartbeat)")
         except Exception as x:
             self.log.error("failed create table %s" %x)
             return False
@@ -120,6 +269,35 @@ class aCTDBPanda(aCTDB):
             c.execute("drop table pandaarchive")
         except:
             self.log.warning("no pandaarchive table")
+        try:
+            c.execute(str)
+            c.execute("CREATE INDEX pandaarchive_site_endtime ON pandaarchive (siteName, endTime)")
+            today = datetime.date.today()
+            self.db.partitionByMonth('pandaarchive', 'endTime', monthRange(today, today + datetime.timedelta(days=31)))
+        except Exception as x:
+            self.log.error("failed create table %s" %x)
+            return False
+
+        str="""
+        create table pandaarchive_daily (
+        day DATE,
+        siteName VARCHAR(255),
+        actpandastatus VARCHAR(255),
+        njobs INTEGER,
+        walltime BIGINT,
+        walltime50 INTEGER,
+        walltime90 INTEGER,
+        walltime99 INTEGER,
+        firststart DATETIME,
+        lastend DATETIME,
+        PRIMARY KEY (day, siteName, actpandastatus)
+    )
+"""
+
+        try:
+            c.execute("drop table pandaarchive_daily")
+        except:
+            self.log.warning("no pandaarchive_daily table")
         try:
             c.execute(str)
         except Exception as x:
@@ -130,27 +308,175 @@ class aCTDBPanda(aCTDB):
         return True
 
 
-    def insertJob(self,pandaid,pandajob,desc={}):
+    def insertJob(self,pandaid,pandajob,desc={},jobinfo=None):
+        '''
+        Insert a new job. jobinfo is the decoded pandajob, as returned by
+        decodePandaJob(), and is decoded here if not given.
+        '''
+        if jobinfo is None:
+            jobinfo = decodePandaJob(pandajob)
         desc['created']=self.getTimeStamp()
         desc['pandaid']=pandaid
         desc['pandajob']=pandajob
-        s="insert into pandajobs (" + ",".join([k for k in desc.keys()]) + ") values (" + ",".join(['%s' for k in desc.keys()]) + ")"
-        c=self.db.getCursor()
-        c.execute(s,list(desc.values()))
-        c.execute("SELECT LAST_INSERT_ID()")
-        row = c.fetchone()
-        self.Commit()
-        return row
+        desc['eventservice']=jobinfo.get('eventService') == 'True'
+        desc['jobinfo']=json.dumps(jobinfo)
+        with self.transaction():
+            id = self.db.insert(aCTDBQuery.insert('pandajobs', desc))
+        return {'LAST_INSERT_ID()': id}
+
+    def insertJobs(self, jobs):
+        '''
+        Insert a batch of new jobs in one transaction and return the list of
+        their row ids. jobs is a list of (pandaid, pandajob, desc, jobinfo)
+        as for insertJob(). Jobs with pandaid 0 are pull mode jobs, which get
+        their row id as pandaid and a pandajob with only the PandaID and
+        prodSourceLabel in the same transaction. If the batch fails, e.g.
+        because of a duplicate pandaid, the jobs are inserted one by one and
+        the id of a job which cannot be inserted is None.
+        '''
+        try:
+            return self._insertJobs(jobs)
+        except Exception as x:
+            if len(jobs) == 1:
+                self.log.error("%s: Failed to insert job: %s" % (jobs[0][0], str(x)))
+                return [None]
+            self.log.warning("Failed to insert %d jobs, inserting them one by one: %s" % (len(jobs), str(x)))
+        ids = []
+        for job in jobs:
+            ids.extend(self.insertJobs([job]))
+        return ids
+
+    def _insertJobs(self, jobs):
+        now = self.getTimeStamp()
+        bycolumns = {}
+        for i, (pandaid, pandajob, desc, jobinfo) in enumerate(jobs):
+            if jobinfo is None:
+                jobinfo = decodePandaJob(pandajob)
+            row = dict(desc)
+            row['created'] = now
+            # pandaid is unique, pull mode jobs are inserted without one
+            row['pandaid'] = pandaid or None
+            row['pandajob'] = pandajob
+            row['eventservice'] = jobinfo.get('eventService') == 'True'
+            row['jobinfo'] = json.dumps(jobinfo)
+            bycolumns.setdefault(tuple(row.keys()), []).append((i, list(row.values())))
+
+        ids = [None] * len(jobs)
+        with self.transaction():
+            for columns, rows in bycolumns.items():
+                for (i, values), id in zip(rows, self.db.insertMany('pandajobs', columns, [r[1] for r in rows])):
+                    ids[i] = id
+            pull = []
+            for (pandaid, pandajob, desc, jobinfo), id in zip(jobs, ids):
+                if pandaid == 0:
+                    # Pull mode: use row id as job id for output files
+                    pandajob = 'PandaID=%d&prodSourceLabel=%s' % (id, desc.get('prodSourceLabel'))
+                    pull.append([id, pandajob, json.dumps(decodePandaJob(pandajob)), False, now, id])
+            if pull:
+                c = self.db.getCursor()
+                c.executemany("update pandajobs set pandaid=%s, pandajob=%s, jobinfo=%s, eventservice=%s, modified=%s where id=%s", pull)
+        return ids
 
     def insertJobArchiveLazy(self,desc={}):
-        s="insert into pandaarchive (" + ",".join([k for k in desc.keys()]) + ") values (" + ",".join(['%s' for k in desc.keys()]) + ")"
-        c=self.db.getCursor()
-        c.execute(s,list(desc.values()))
+        self.db.execute(aCTDBQuery.insert('pandaarchive', desc))
+
+    def archiveJobs(self, select, limit=1000, days=None):
+        '''
+        Move up to limit jobs matching select (a where clause or conditions
+        for aCTDBQuery) to pandaarchive in one transaction, filling in empty
+        start and end times. Returns the number of jobs archived. Each call is
+        atomic so an interrupted archiving run is simply continued by the
+        next call. If days is a set the days of the end times of the archived
+        jobs are added to it, for rollupArchive().
+        '''
+        if isinstance(select, str):
+            select = aCTDBQuery.Raw(select)
+        now = self.getTimeStamp()
+        with self.transaction():
+            rows = self.db.fetch(aCTDBQuery.select('pandajobs', ['id'], select, orderby='id', limit=limit,
+                                                   lock=self.db.addLock()))
+            ids = [row['id'] for row in rows]
+            if not ids:
+                return 0
+            # Same rules as for a single job: a missing end time is taken
+            # from modified, a missing start time from the end time, and if
+            # both are missing the current time is used for both
+            wsql, params = aCTDBQuery.where({'id': ids})
+            endtime = "COALESCE(endTime, CASE WHEN startTime IS NULL THEN %s ELSE modified END)"
+            if days is not None:
+                rows = self.db.fetch(("SELECT DISTINCT DATE(" + endtime + ") AS day FROM pandajobs WHERE " + wsql,
+                                      [now] + params))
+                days.update(row['day'] for row in rows)
+            self.db.execute(("INSERT INTO pandaarchive (pandaid, siteName, actpandastatus, startTime, endTime) "
+                             "SELECT pandaid, siteName, actpandastatus, COALESCE(startTime, endTime, %s), " + endtime +
+                             " FROM pandajobs WHERE " + wsql, [now, now] + params))
+            self.db.execute(aCTDBQuery.delete('pandajobs', {'id': ids}))
+        return len(ids)
+
+    def rollupArchive(self, days):
+        '''
+        Recompute the pandaarchive_daily rows of the given days (datetime.date)
+        from pandaarchive
+        '''
+        for day in sorted(days):
+            rows = self.db.fetch(aCTDBQuery.select('pandaarchive', ['siteName', 'actpandastatus', 'startTime', 'endTime'],
+                                                   [('endTime', '>=', day.isoformat()),
+                                                    ('endTime', '<', (day + datetime.timedelta(days=1)).isoformat())]))
+            groups = {}
+            for row in rows:
+                groups.setdefault((row['siteName'], row['actpandastatus']), []).append(row)
+
+            with self.transaction():
+                self.db.execute(aCTDBQuery.delete('pandaarchive_daily', {'day': day}))
+                for (site, state), jobs in groups.items():
+                    walltimes = sorted(max(int((j['endTime'] - j['startTime']).total_seconds()), 0) for j in jobs)
+                    percentile = lambda p: walltimes[min(len(walltimes) - 1, len(walltimes) * p // 100)]
+                    self.db.execute(aCTDBQuery.insert('pandaarchive_daily',
+                                                      {'day': day, 'siteName': site, 'actpandastatus': state,
+                                                       'njobs': len(jobs), 'walltime': sum(walltimes),
+                                                       'walltime50': percentile(50), 'walltime90': percentile(90),
+                                                       'walltime99': percentile(99),
+                                                       'firststart': min(j['startTime'] for j in jobs),
+                                                       'lastend': max(j['endTime'] for j in jobs)}))
+
+    def getArchiveDaily(self, select=None, columns=[], groupby=None, orderby=None):
+        '''
+        Return a list of column: value dictionaries from the daily archive
+        roll-up matching select (conditions for aCTDBQuery), e.g.
+        getArchiveDaily([('day', '>=', since)], ['siteName', 'SUM(njobs) AS njobs'], groupby='siteName')
+        '''
+        return self.db.fetch(aCTDBQuery.select('pandaarchive_daily', columns, select, groupby=groupby, orderby=orderby))
+
+    def maintainArchivePartitions(self, keepmonths=0):
+        '''
+        Make sure pandaarchive has partitions for this and next month, and
+        drop the partitions of months older than keepmonths months (0 keeps
+        all). The daily roll-up is kept for dropped months. Returns the names
+        of the dropped partitions.
+        '''
+        partitions = self.db.getPartitions('pandaarchive')
+        if not partitions:
+            self.log.warning("pandaarchive is not partitioned, run the schema migrations")
+            return []
+        today = datetime.date.today()
+        for month in monthRange(today, today + datetime.timedelta(days=31)):
+            if 'p' + month.strftime('%Y%m') not in partitions:
+                self.log.info("Adding pandaarchive partition for %s" % month.strftime('%Y-%m'))
+                self.db.addMonthPartition('pandaarchive', month)
+
+        dropped = []
+        if keepmonths:
+            oldest = monthRange(today - datetime.timedelta(days=31 * keepmonths), today)[0]
+            for name in partitions:
+                if name < 'p' + oldest.strftime('%Y%m'):
+                    self.log.info("Dropping pandaarchive partition %s" % name)
+                    self.db.dropPartition('pandaarchive', name)
+                    dropped.append(name)
+        return dropped
 
     def deleteJob(self,pandaid):
-        c=self.db.getCursor()
-        c.execute("delete from pandajobs where pandaid="+str(pandaid))
-        self.Commit()
+        with self.transaction():
+            self.db.execute(aCTDBQuery.delete('pandajobs', {'pandaid': pandaid}))
 
     def updateJob(self,pandaid,desc):
         self.updateJobLazy(pandaid,desc)
@@ -158,10 +484,7 @@ class aCTDBPanda(aCTDB):
 
     def updateJobLazy(self,pandaid,desc):
         desc['modified']=self.getTimeStamp()
-        s="UPDATE pandajobs SET " + ",".join(['%s=%%s' % (k) for k in desc.keys()])
-        s+=" WHERE pandaid="+str(pandaid)
-        c=self.db.getCursor()
-        c.execute(s,list(desc.values()))
+        self.db.execute(aCTDBQuery.update('pandajobs', desc, {'pandaid': pandaid}))
 
     def updateJobs(self, select, desc):
         self.updateJobsLazy(select, desc)
@@ -175,21 +498,57 @@ class aCTDBPanda(aCTDB):
         c.execute(s,list(desc.values()))
 
     def getJob(self,pandaid,columns=[]):
-        c=self.db.getCursor()
-        c.execute("SELECT "+self._column_list2str(columns)+" FROM pandajobs WHERE pandaid="+str(pandaid))
-        row=c.fetchone()
-        return row
+        rows=self.db.fetch(aCTDBQuery.select('pandajobs', columns, {'pandaid': pandaid}))
+        return rows[0] if rows else None
 
     def getJobs(self,select,columns=[]):
-        c=self.db.getCursor()
-        c.execute("SELECT "+self._column_list2str(columns)+" FROM pandajobs WHERE "+select)
-        rows=c.fetchall()
+        '''
+        Return a list of column: value dictionaries for jobs matching select,
+        which is either a where clause or conditions for aCTDBQuery. If no
+        columns are given the large columns (LAZYCOLUMNS) are only loaded
+        when first accessed.
+        '''
+        lazy = not columns
+        if lazy:
+            columns = [col for col in self.getColumns() if col not in LAZYCOLUMNS]
+        if not isinstance(select, str):
+            rows = self.db.fetch(aCTDBQuery.select('pandajobs', columns, select))
+        else:
+            c=self.db.getCursor()
+            c.execute("SELECT "+self._column_list2str(columns)+" FROM pandajobs WHERE "+select)
+            rows=c.fetchall()
+        if lazy:
+            return aCTPandaJobResultSet(self.db, rows).rows
         return rows
 
+    def getJobsPage(self, cursor, select, limit, columns=[]):
+        '''
+        Return the next page of at most limit jobs matching select (a where
+        clause) for the named keyset cursor, as getJobs(). See
+        aCTDB.getPageIds().
+        '''
+        ids = self.getPageIds(cursor, select, limit)
+        if not ids:
+            return []
+        return self.getJobs({'id': ids}, columns)
+
+    def getColumns(self):
+        '''
+        Return the list of columns of the pandajobs table
+        '''
+        if not self.columns:
+            c=self.db.getCursor()
+            c.execute("SELECT * FROM pandajobs LIMIT 0")
+            c.fetchall()
+            self.columns = [col[0] for col in c.description]
+        return self.columns
+
     def getNJobs(self,select):
+        if not isinstance(select, str):
+            return int(self.db.fetch(aCTDBQuery.count('pandajobs', select))[0]['count'])
         c=self.db.getCursor()
-        c.execute("select count(*) from pandajobs where " + select)
-        njobs=c.fetchone()['count(*)']
+        c.execute("select count(*) as count from pandajobs where " + select)
+        njobs=c.fetchone()['count']
         return int(njobs)
 
     def getJobReport(self):
@@ -1,98 +1,222 @@
 import http.client
+import multiprocessing
 import os
 import traceback
 import json
+from collections import deque
 
+import arc
+
+from act.arc.aCTSubmitter import KillPool
 from act.atlas.aCTATLASProcess import aCTATLASProcess
 from act.atlas.aCTPanda2Xrsl import aCTPanda2Xrsl
 
+# pandajobs columns used to convert and insert a job. They are selected
+# explicitly so that plain dictionaries are passed to the converters.
+CONVERTCOLUMNS = ['id', 'pandaid', 'siteName', 'proxyid', 'created', 'pandajob',
+                  'jobinfo', 'eventranges', 'metadata']
+
+# (osmap, tmpdir, conf, log) of the parent process, set before the converter
+# processes are forked
+converterenv = None
+
+def Convert(job, siteinfo):
+    '''
+    Convert a pandajob to xRSL in a converter process. Returns a dictionary
+    with the xrsl (None if it could not be created), its priority, the rucio
+    traces and the log file of the job, or with an error if the job
+    description cannot be handled.
+    '''
+    (osmap, tmpdir, conf, log) = converterenv
+    parser = aCTPanda2Xrsl(job, siteinfo, osmap, tmpdir, conf, log)
+
+    log.info("site %s maxwalltime %s", job['siteName'], siteinfo['maxwalltime'])
+
+    try:
+        parser.parse()
+    except Exception as e:
+        return {'error': 'Cant handle job description: %s' % str(e), 'traceback': traceback.format_exc()}
+    result = {'xrsl': None, 'priority': None, 'traces': parser.traces, 'logfile': None}
+    try:
+        result['xrsl'] = parser.getXrsl()
+    except:
+        pass
+    try:
+        result['logfile'] = parser.jobdesc['logFile'][0]
+    except:
+        pass
+    if result['xrsl'] is not None:
+        # extract priority here so that the description is not parsed again
+        # when inserting it
+        jobdescs = arc.JobDescriptionList()
+        if arc.JobDescription_Parse(str(result['xrsl']), jobdescs):
+            result['priority'] = jobdescs[0].Application.Priority
+            if result['priority'] == -1: # use nicer default priority
+                result['priority'] = 50
+    return result
+
 
 class aCTPanda2Arc(aCTATLASProcess):
     '''
     Take new jobs in Panda table and insert then into the arcjobs table.
     '''
 
+    # Number of processes converting job descriptions to xRSL
+    nconverters = 4
+    # Maximum number of jobs queued in the converter processes at a time
+    maxinflight = 200
+    # Number of converted jobs inserted per transaction
+    insertbatch = 100
+    # Seconds to wait for the conversion of one job
+    converttimeout = 60
+
     def __init__(self):
         aCTATLASProcess.__init__(self, ceflavour=['ARC-CE'])
 
     def createArcJobs(self):
-
-        jobs = self.dbpanda.getJobs("arcjobid is NULL and siteName in %s limit 10000" % self.sitesselect)
+        '''
+        Convert new jobs in a pool of converter processes and insert them in
+        batches. Results are taken in the order of the jobs, so the arcjobs
+        and pandajobs updates of a job are always written together and in
+        order, see insertArcJobs().
+        '''
+
+        # jobs which cannot be converted stay here, page through the rest
+        jobs = self.dbpanda.getJobsPage('new', "arcjobid is NULL and siteName in %s" % self.sitesselect, 10000,
+                                        CONVERTCOLUMNS)
+        if not jobs:
+            return
         proxies_map = {}
 
-        for job in jobs:
-
-            if job['proxyid'] not in proxies_map:
-                proxies_map[job['proxyid']] = self.dbarc.getProxyPath(job['proxyid'])
-
-            parser = aCTPanda2Xrsl(job, self.sites[job['siteName']], self.osmap,
-                                   self.tmpdir, self.conf, self.log)
+        global converterenv
+        converterenv = (self.osmap, self.tmpdir, self.conf, self.log)
+        pool = multiprocessing.Pool(self.nconverters)
+        jobs = iter(jobs)
+        pending = deque()
+        batch = []
+        finished = False
+        try:
+            while True:
+                for job in jobs:
+                    job = dict(job)
+                    pending.append((job, pool.apply_async(Convert, (job, self.sites[job['siteName']]))))
+                    if len(pending) >= self.maxinflight:
+                        break
+                if not pending:
+                    break
+
+                job, result = pending.popleft()
+                try:
+                    converted = result.get(self.converttimeout)
+                except multiprocessing.TimeoutError:
+                    # try again later
+                    self.log.error('%s: Timeout converting job description' % job['pandaid'])
+                    self.insertArcJobs(batch)
+                    return
+                except Exception as e:
+                    # try again later
+                    self.log.error('%s: Failed to convert job description: %s' % (job['pandaid'], str(e)))
+                    continue
 
-            self.log.info("site %s maxwalltime %s", job['siteName'],self.sites[job['siteName']]['maxwalltime'] )
+                if job['proxyid'] not in proxies_map:
+                    proxies_map[job['proxyid']] = self.dbarc.getProxyPath(job['proxyid'])
 
-            try:
-                parser.parse()
-            except Exception as e:
-                # try again later
-                self.log.error('%s: Cant handle job description: %s' % (job['pandaid'], str(e)))
-                self.log.error(traceback.format_exc())
-                continue
-            self.sendTraces(parser.traces, proxies_map[job['proxyid']])
-            try:
-                xrsl = parser.getXrsl()
-            except:
-                pass
-            if xrsl is not None:
-                endpoints = self.sites[job['siteName']]['endpoints']
-                cl = []
-                for e in endpoints:
-                    if e.find('://') == -1:
-                        # gsiftp is default if not specified
-                        e = 'gsiftp://' + e
-                    cl.append(e)
-                cls = ",".join(cl)
-                self.log.info("Inserting job %i with clusterlist %s" % (job['pandaid'], cls))
-                maxattempts = 5
-                if self.sites[job['siteName']]['truepilot']:
-                    # truepilot jobs should never be resubmitted
-                    maxattempts = 0
-
-                # Set the list of files to download at the end of the job
-                downloadfiles = 'gmlog/errors'
-                try:
-                    downloadfiles += ';%s' % parser.jobdesc['logFile'][0].replace('.tgz', '')
-                except:
-                    pass
-                if not self.sites[job['siteName']]['truepilot']:
-                    downloadfiles += ';heartbeat.json'
-                if job['eventranges']:
-                    downloadfiles += ';metadata-es.xml'
-
-                aid = self.dbarc.insertArcJobDescription(xrsl, maxattempts=maxattempts, clusterlist=cls,
-                                                         proxyid=job['proxyid'], appjobid=str(job['pandaid']),
-                                                         downloadfiles=downloadfiles, fairshare=job['siteName'])
+                if 'error' in converted:
+                    # try again later
+                    self.log.error('%s: %s' % (job['pandaid'], converted['error']))
+                    self.log.error(converted['traceback'])
+                    continue
+                self.sendTraces(converted['traces'], proxies_map[job['proxyid']])
+                if converted['xrsl'] is None:
+                    continue
+                if converted['priority'] is None:
+                    self.log.error("%s: Failed to prepare job description: %s" % (job['pandaid'], converted['xrsl']))
+                    continue
+                batch.append((job, self.arcJobDescription(job, converted)))
+                if len(batch) >= self.insertbatch:
+                    self.insertArcJobs(batch)
+                    batch = []
+            self.insertArcJobs(batch)
+            finished = True
+        finally:
+            if finished:
+                # pool.terminate() would raise ExceptInterrupt in the
+                # converters, let them exit by themselves
+                pool.close()
+            else:
+                # a converter may be stuck, do not wait for it
+                KillPool(pool)
+            pool.join()
+
+    def arcJobDescription(self, job, converted):
+        '''
+        Return the arguments of dbarc.insertArcJobDescription() for a
+        converted job
+        '''
+        endpoints = self.sites[job['siteName']]['endpoints']
+        cl = []
+        for e in endpoints:
+            if e.find('://') == -1:
+                # gsiftp is default if not specified
+                e = 'gsiftp://' + e
+            cl.append(e)
+        cls = ",".join(cl)
+        self.log.info("Inserting job %i with clusterlist %s" % (job['pandaid'], cls))
+        maxattempts = 5
+        if self.sites[job['siteName']]['truepilot']:
+            # truepilot jobs should never be resubmitted
+            maxattempts = 0
+
+        # Set the list of files to download at the end of the job
+        downloadfiles = 'gmlog/errors'
+        if converted['logfile']:
+            downloadfiles += ';%s' % converted['logfile'].replace('.tgz', '')
+        if not self.sites[job['siteName']]['truepilot']:
+            downloadfiles += ';heartbeat.json'
+        if job['eventranges']:
+            downloadfiles += ';metadata-es.xml'
+
+        return {'jobdesc': converted['xrsl'], 'priority': converted['priority'], 'maxattempts': maxattempts,
+                'clusterlist': cls, 'proxyid': job['proxyid'], 'appjobid': str(job['pandaid']),
+                'downloadfiles': downloadfiles, 'fairshare': job['siteName']}
+
+    def insertArcJobs(self, batch):
+        '''
+        Insert a list of (pandajob, arc job description) and set the arcjobid
+        of the pandajobs in the same transaction, so that a job is never
+        inserted twice
+        '''
+        if not batch:
+            return
+        with self.dbpanda.transaction():
+            aids = self.dbarc.insertArcJobDescriptions([desc for (job, desc) in batch])
+            for (job, desc), aid in zip(batch, aids):
                 if not aid:
-                    self.log.error("%s: Failed to insert arc job description: %s" % (job['pandaid'], xrsl))
+                    self.log.error("%s: Failed to insert arc job description: %s" % (job['pandaid'], desc['jobdesc']))
                     continue
 
                 jd = {}
-                jd['arcjobid'] = aid['LAST_INSERT_ID()']
+                jd['arcjobid'] = aid
                 jd['pandastatus'] = 'starting'
                 # make sure actpandastatus is really 'sent', in case of resubmitting
                 jd['actpandastatus'] = 'sent'
-                self.dbpanda.updateJob(job['pandaid'], jd)
-
-                # Dump description for APFMon
-                if self.conf.get(["monitor", "apfmon"]):
-                    logdir = os.path.join(self.conf.get(["joblog", "dir"]),
-                                          job['created'].strftime('%Y-%m-%d'),
-                                          job['siteName'])
-                    try: os.makedirs(logdir, 0o755)
-                    except: pass
-                    jdlfile = os.path.join(logdir, '%s.jdl' % job['pandaid'])
-                    with open(jdlfile, 'w') as f:
-                        self.log.debug('Wrote description to %s' % jdlfile)
-                        f.write(xrsl)
+                self.dbpanda.updateJobLazy(job['pandaid'], jd)
+
+        # Dump descriptions for APFMon
+        if not self.conf.get(["monitor", "apfmon"]):
+            return
+        for (job, desc), aid in zip(batch, aids):
+            if not aid:
+                continue
+            logdir = os.path.join(self.conf.get(["joblog", "dir"]),
+                                  job['created'].strftime('%Y-%m-%d'),
+                                  job['siteName'])
+            try: os.makedirs(logdir, 0o755)
+            except: pass
+            jdlfile = os.path.join(logdir, '%s.jdl' % job['pandaid'])
+            with open(jdlfile, 'w') as f:
+                self.log.debug('Wrote description to %s' % jdlfile)
+                f.write(desc['jobdesc'])
 
     def process(self):
         self.setSites()
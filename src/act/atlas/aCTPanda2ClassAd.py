@@ -1,18 +1,18 @@
-import cgi
 import json
 import os
 import time
+from act.atlas.aCTDBPanda import getJobDesc
 
 class aCTPanda2ClassAd:
 
-    def __init__(self, pandajob, pandajobid, sitename, siteinfo, proxypath, tmpdir, atlasconf, metadata, log):
+    def __init__(self, pandajob, pandajobid, sitename, siteinfo, proxypath, tmpdir, atlasconf, metadata, log, jobinfo=None):
         # To work with htcondor.Submit() a plain dict is used instead of a
         # ClassAd object. All values must be strings.
         self.classad = {'Universe': '9'} # Always use grid universe
         self.log = log
         self.pandajob = pandajob
         self.pandajobid = pandajobid
-        self.jobdesc = cgi.parse_qs(pandajob)
+        self.jobdesc = getJobDesc({'pandajob': pandajob, 'jobinfo': jobinfo})
         self.pandaid = self.jobdesc['PandaID'][0]
         self.prodsourcelabel = self.jobdesc.get('prodSourceLabel', ['None'])[0]
         self.siteinfo = siteinfo
@@ -13,7 +13,8 @@ class aCTPanda2Condor(aCTATLASProcess):
 
     def createCondorJobs(self):
 
-        jobs = self.dbpanda.getJobs("condorjobid is NULL and siteName in %s limit 10000" % self.sitesselect)
+        # jobs which cannot be converted stay here, page through the rest
+        jobs = self.dbpanda.getJobsPage('new', "condorjobid is NULL and siteName in %s" % self.sitesselect, 10000)
         proxies_map = {}
 
         for job in jobs:
@@ -22,7 +23,7 @@ class aCTPanda2Condor(aCTATLASProcess):
                 proxies_map[job['proxyid']] = self.dbarc.getProxyPath(job['proxyid'])
 
             parser = aCTPanda2ClassAd(job['pandajob'], job['id'], job['siteName'], self.sites[job['siteName']], proxies_map[job['proxyid']],
-                                   self.tmpdir, self.conf, job['metadata'], self.log)
+                                   self.tmpdir, self.conf, job['metadata'], self.log, job['jobinfo'])
 
             self.log.info("site %s maxwalltime %s", job['siteName'],self.sites[job['siteName']]['maxwalltime'] )
 
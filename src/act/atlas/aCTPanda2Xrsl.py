@@ -1,9 +1,9 @@
-import cgi
 import json
 import os
 import re
 import time
 import uuid
+from act.atlas.aCTDBPanda import getJobDesc
 
 
 class aCTPanda2Xrsl:
@@ -11,7 +11,7 @@ class aCTPanda2Xrsl:
     def __init__(self, pandadbjob, siteinfo, osmap, tmpdir, atlasconf, log):
         self.log = log
         self.pandajob = pandadbjob['pandajob']
-        self.jobdesc = cgi.parse_qs(self.pandajob)
+        self.jobdesc = getJobDesc(pandadbjob)
         self.pandajobid = pandadbjob['id']
         self.pandaid = self.jobdesc['PandaID'][0]
         self.xrsl = {}
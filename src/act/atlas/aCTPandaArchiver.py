@@ -0,0 +1,92 @@
+import datetime
+import time
+from act.atlas.aCTATLASProcess import aCTATLASProcess
+
+class aCTPandaArchiver(aCTATLASProcess):
+    '''
+    Moves finished jobs older than one day from pandajobs to pandaarchive.
+    Runs separately from aCTAutopilot so that heartbeats are never held up
+    by archiving, and archives in bounded chunks so that a large backlog
+    (e.g. after an outage) is spread over several loops. Also maintains the
+    daily roll-up of the archive and its monthly partitions.
+    '''
+
+    # Number of jobs moved per transaction
+    chunksize = 1000
+    # Maximum number of chunks per loop
+    maxchunks = 20
+    # Seconds between checks when there is no backlog
+    interval = 3600
+
+    def __init__(self):
+        aCTATLASProcess.__init__(self)
+        self.lastcheck = 0
+        self.backlog = False
+        # days touched by archiving which are not yet rolled up
+        self.rollupdays = set()
+        self.partitionday = None
+
+    def archiveJobs(self):
+        '''
+        Archive up to maxchunks chunks of old jobs. Sets backlog if there may
+        be more jobs to archive.
+        '''
+        # modified column is reported in local time so may not be exactly one day
+        select = [self.dbpanda.timeStampLessThanCondition('modified', 60*60*24),
+                  ('actpandastatus', ['done', 'donefailed', 'donecancelled'])]
+
+        total = 0
+        self.backlog = False
+        for i in range(self.maxchunks):
+            n = self.dbpanda.archiveJobs(select, self.chunksize, self.rollupdays)
+            total += n
+            if n < self.chunksize:
+                break
+        else:
+            self.backlog = True
+
+        if total:
+            self.log.info('Archived %d jobs%s' % (total, ', more to archive' if self.backlog else ''))
+
+    def rollupArchive(self):
+        '''
+        Update the daily roll-up for the days of the jobs archived since the
+        last roll-up, once the archiving backlog is cleared
+        '''
+        if self.backlog or not self.rollupdays:
+            return
+        self.log.info('Updating archive roll-up for %d days' % len(self.rollupdays))
+        self.dbpanda.rollupArchive(self.rollupdays)
+        self.rollupdays = set()
+
+    def maintainPartitions(self):
+        '''
+        Once a day add partitions for the coming month and drop those older
+        than the configured number of months to keep
+        '''
+        today = datetime.date.today()
+        if self.partitionday == today:
+            return
+        keepmonths = int(self.conf.get(['archive', 'keepmonths']) or 0)
+        try:
+            self.dbpanda.maintainArchivePartitions(keepmonths)
+        except Exception as x:
+            self.log.error('Failed to maintain archive partitions: %s' % x)
+        self.partitionday = today
+
+    def process(self):
+        '''
+        Method called from loop
+        '''
+        if self.backlog or time.time() - self.lastcheck > self.interval:
+            self.log.debug("Checking for jobs to archive")
+            self.archiveJobs()
+            self.rollupArchive()
+            self.lastcheck = time.time()
+        self.maintainPartitions()
+
+
+if __name__ == '__main__':
+    aa = aCTPandaArchiver()
+    aa.run()
+    aa.finish()
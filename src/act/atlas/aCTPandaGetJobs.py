@@ -1,9 +1,9 @@
 from threading import Thread
-import re
 import time
 import random
 import arc
 from act.atlas import aCTPanda
+from act.atlas.aCTDBPanda import decodePandaJob
 from act.common import aCTProxy
 from act.atlas.aCTATLASProcess import aCTATLASProcess
 
@@ -125,6 +125,11 @@ class aCTPandaGetJobs(aCTATLASProcess):
 
         count=0
 
+        # Number of jobs per site and state, from the job counters
+        sitecounts = {}
+        for c in self.dbpanda.getStateCounts(groupby=['cluster', 'state']):
+            sitecounts.setdefault(c['cluster'], {})[c['state']] = c['njobs']
+
         for site, attrs in self.sites.items():
             if not attrs['enabled']:
                 continue
@@ -147,11 +152,11 @@ class aCTPandaGetJobs(aCTATLASProcess):
                 prodsourcelabel = 'unified'
 
             # Get number of jobs injected into ARC but not yet submitted
-            nsubmitting = self.dbpanda.getNJobs("actpandastatus='sent' and siteName='%s'" % site )
+            nsubmitting = sitecounts.get(site, {}).get('sent', 0)
 
             # Get total number of active jobs
-            nall = self.dbpanda.getNJobs("siteName='%s' and actpandastatus!='done' \
-                                          and actpandastatus!='donefailed' and actpandastatus!='donecancelled'" % site)
+            nall = sum([n for state, n in sitecounts.get(site, {}).items()
+                        if state not in ['done', 'donefailed', 'donecancelled']])
             self.log.info("Site %s: %i jobs in sent, %i total" % (site, nsubmitting, nall))
 
             # Limit number of jobs waiting submission to avoid getting too many
@@ -209,6 +214,7 @@ class aCTPandaGetJobs(aCTATLASProcess):
                         break
 
                 activatedjobs = False
+                batch = []
                 for t in tlist:
                     t.join()
                     (pandaid, pandajob, eventranges, prodsrclabel) = t.result
@@ -220,8 +226,11 @@ class aCTPandaGetJobs(aCTATLASProcess):
                         continue
 
                     n = {}
+                    # Decode the job description once, consumers read the
+                    # decoded fields from the jobinfo column
+                    jobinfo = decodePandaJob(pandajob)
                     # Check eventranges is defined for ES jobs
-                    if re.search('eventService=True', pandajob) and getEventRanges and (eventranges is None or eventranges == '[]'):
+                    if jobinfo.get('eventService') == 'True' and getEventRanges and (eventranges is None or eventranges == '[]'):
                         self.log.warning('%s: No event ranges given by panda' % pandaid)
                         n['pandastatus'] = 'closed'
                         n['actpandastatus'] = 'finished'
@@ -236,22 +245,20 @@ class aCTPandaGetJobs(aCTATLASProcess):
                     n['eventranges'] = eventranges
                     if pandaid != 0:
                         try:
-                            n['corecount'] = int(re.search(r'coreCount=(\d+)', pandajob).group(1))
+                            n['corecount'] = int(jobinfo['coreCount'])
                         except:
                             self.log.warning('%s: no corecount in job description' % pandaid)
                     n['sendhb'] = attrs['push']
-                    if pandaid == 0:
-                        # Pull mode: set dummy arcjobid and condorjobid to avoid
-                        # job getting picked up before setting proper job desc after insertion
-                        n['arcjobid'] = -1
-                        n['condorjobid'] = -1
-                    rowid = self.dbpanda.insertJob(pandaid, pandajob, n)['LAST_INSERT_ID()']
-                    if pandaid == 0:
-                        # Pull mode: use row id as job id for output files
-                        pandaid = rowid
-                        pandajob = 'PandaID=%d&prodSourceLabel=%s' % (pandaid, prodsrclabel)
-                        self.dbpanda.updateJobs('id=%d' % pandaid, {'pandaid': pandaid, 'pandajob': pandajob, 'arcjobid': None, 'condorjobid': None})
-                    apfmonjobs.append((rowid, pandaid))
+                    batch.append((pandaid, pandajob, n, jobinfo))
+
+                # Insert all jobs of the threads in one transaction, pull mode
+                # jobs get their row id as pandaid. Jobs which could not be
+                # inserted have no row id.
+                rowids = self.dbpanda.insertJobs(batch)
+                for (pandaid, pandajob, n, jobinfo), rowid in zip(batch, rowids):
+                    if rowid is None:
+                        continue
+                    apfmonjobs.append((rowid, pandaid or rowid))
                     count += 1
 
                 if not activatedjobs:
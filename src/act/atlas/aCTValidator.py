@@ -439,9 +439,9 @@ class aCTValidator(aCTATLASProcess):
         '''
 
         # get all jobs with pandastatus running and actpandastatus tovalidate
-        select = "(pandastatus='transferring' and actpandastatus='tovalidate') and siteName in %s limit 1000" % self.sitesselect
+        select = "(pandastatus='transferring' and actpandastatus='tovalidate') and siteName in %s" % self.sitesselect
         columns = ["arcjobid", "pandaid", "siteName", "metadata"]
-        jobstoupdate=self.dbpanda.getJobs(select, columns=columns)
+        jobstoupdate=self.dbpanda.getJobsPage('tovalidate', select, 1000, columns=columns)
 
         if len(jobstoupdate)==0:
             # nothing to do
@@ -525,9 +525,9 @@ class aCTValidator(aCTATLASProcess):
         Move actpandastatus to failed.
         '''
         # get all jobs with pandastatus transferring and actpandastatus toclean
-        select = "(pandastatus='transferring' and actpandastatus='toclean') and siteName in %s limit 1000" % self.sitesselect
+        select = "(pandastatus='transferring' and actpandastatus='toclean') and siteName in %s" % self.sitesselect
         columns = ["arcjobid", "pandaid", "siteName"]
-        jobstoupdate=self.dbpanda.getJobs(select, columns=columns)
+        jobstoupdate=self.dbpanda.getJobsPage('toclean', select, 1000, columns=columns)
 
         if len(jobstoupdate)==0:
             # nothing to do
@@ -599,10 +599,10 @@ class aCTValidator(aCTATLASProcess):
         '''
 
         # First check for resubmitting jobs with no arcjob id defined
-        select = "(actpandastatus='toresubmit' and arcjobid=NULL) and siteName in %s limit 1000" % self.sitesselect
+        select = "(actpandastatus='toresubmit' and arcjobid=NULL) and siteName in %s" % self.sitesselect
         columns = ["pandaid", "id"]
 
-        jobstoupdate=self.dbpanda.getJobs(select, columns=columns)
+        jobstoupdate=self.dbpanda.getJobsPage('toresubmit', select, 1000, columns=columns)
 
         for job in jobstoupdate:
             self.log.info('%s: resubmitting' % job['pandaid'])
@@ -97,9 +97,9 @@ class Client2Arc(object):
             submitted = 0
             for state in states:
                 if state['arcstate'] == 'running':
-                    running = state['COUNT(arcstate)']
+                    running = state['count']
                 elif state['arcstate'] in ('submitted', 'submitting'):
-                    submitted += state['COUNT(arcstate)']
+                    submitted += state['count']
             #self.log.debug('{} jobs running for proxyid {}'.format(running, proxyid))
             #self.log.debug('{} jobs submitted for proxyid {}'.format(submitted, proxyid))
 
@@ -116,15 +116,15 @@ class Client2Arc(object):
         Returns:
             A list of dictionaries where every dictionary has a state name
             and number of jobs in that state. State name is mapped by
-            'arcstate', number of jobs by 'COUNT(arcstate). For example:
+            'arcstate', number of jobs by 'count'. For example:
 
-            [{'arcstate': 'toclean', 'COUNT(arcstate)': 10},
-             {'arcstate': 'running', 'COUNT(arcstate)': 58}]
+            [{'arcstate': 'toclean', 'count': 10},
+             {'arcstate': 'running', 'count': 58}]
         """
         c = self.arcdb.db.getCursor()
         try:
             c.execute(
-                'SELECT arcstate,COUNT(arcstate) \
+                'SELECT arcstate,COUNT(arcstate) AS count \
                 FROM arcjobs \
                 WHERE {} \
                 GROUP BY arcstate'.format(select)
@@ -8,6 +8,7 @@ import arc
 import logging
 
 from act.db.aCTDB import aCTDB
+from act.db.aCTDBClusters import aCTDBClusters
 
 
 class ClientDB(aCTDB):
@@ -36,6 +37,7 @@ class ClientDB(aCTDB):
             logger: An object for logging.
         """
         aCTDB.__init__(self, logger, "clientjobs")
+        self.clusters = aCTDBClusters(logger)
 
     def createTables(self):
         """Create clientjobs table."""
@@ -62,7 +64,7 @@ class ClientDB(aCTDB):
         )"""
         try:
             c.execute(query)
-            c.execute('ALTER TABLE clientjobs ADD INDEX (arcjobid)')
+            c.execute('CREATE INDEX clientjobs_arcjobid ON clientjobs (arcjobid)')
             self.Commit()
         except:
             self.log.exception('Error creating clientjobs table')
@@ -114,11 +116,8 @@ class ClientDB(aCTDB):
             INSERT INTO clientjobs (created, jobname, jobdesc, siteName, proxyid)
             VALUES (%s, %s, %s, %s, %s)
         """
-        c = self.db.getCursor()
         try:
-            c.execute(query, [self.getTimeStamp(), jobname, None, siteName, proxyid])
-            c.execute('SELECT LAST_INSERT_ID()')
-            jobid = c.fetchone()['LAST_INSERT_ID()']
+            jobid = self.db.insert((query, [self.getTimeStamp(), jobname, None, siteName, proxyid]))
         except:
             self.log.exception('Error while inserting new job')
             raise
@@ -146,14 +145,11 @@ class ClientDB(aCTDB):
         Returns:
             ID of inserted job.
         """
-        c = self.db.getCursor()
-
-        # first, insert job description and retreive the job ID
+        # first, insert job description and retreive the job ID. The
+        # reference taken here is handed over to the arc job created by
+        # insertArcJob() and dropped when that job is deleted.
         try:
-            query = 'INSERT INTO jobdescriptions (jobdescription) VALUES (%s)'
-            c.execute(query, [jobdesc])
-            c.execute('SELECT LAST_INSERT_ID()')
-            jobdescid = c.fetchone()['LAST_INSERT_ID()']
+            jobdescid = self._storeJobDescription(jobdesc)
         except:
             self.log.exception('Error inserting job description')
             raise
@@ -168,11 +164,8 @@ class ClientDB(aCTDB):
             INSERT INTO clientjobs (created, jobname, jobdesc, siteName, proxyid)
             VALUES (%s, %s, %s, %s, %s)
         """
-        c = self.db.getCursor()
         try:
-            c.execute(query, [self.getTimeStamp(), jobname, jobdescid, siteName, proxyid])
-            c.execute('SELECT LAST_INSERT_ID()')
-            jobid = c.fetchone()['LAST_INSERT_ID()']
+            jobid = self.db.insert((query, [self.getTimeStamp(), jobname, jobdescid, siteName, proxyid]))
         except:
             self.log.exception('Error while inserting new job')
             raise
@@ -202,8 +195,6 @@ class ClientDB(aCTDB):
         if priority == -1: # use nicer default priority
             priority = 50
 
-        c = self.db.getCursor()
-
         desc = {}
         desc['created'] = self.getTimeStamp()
         desc['arcstate'] = "tosubmit"
@@ -222,11 +213,10 @@ class ClientDB(aCTDB):
             ",".join(["%s" % (k) for k in desc.keys()]) + \
             " ) " + " values " + " ( " + \
             ",".join(['%s' % (k) for k in ["%s"] * len(desc)]) + " ) "
-        c.execute(s, list(desc.values()))
-        c.execute("SELECT LAST_INSERT_ID()")
-        row = c.fetchone()
-        self.Commit()
-        return row
+        with self.transaction():
+            id = self.db.insert((s, list(desc.values())))
+            self.clusters.insertJobClusters('arcjobs', id, clusterlist, desc['arcstate'])
+        return {'LAST_INSERT_ID()': id}
 
     def deleteJobs(self, where, params):
         """
@@ -493,16 +483,11 @@ class ClientDB(aCTDB):
         for database (:class:~`act.arc.aCTDBArc.aCTDBArc`) implemented
         the same interface.
         """
-        c = self.db.getCursor()
-        query = 'SHOW columns FROM {}'.format(tableName)
         try:
-            c.execute(query)
+            return self.db.getColumns(tableName)
         except:
             self.log.exception('Error getting columns for table {}'.format(tableName))
             raise
-        else:
-            rows = c.fetchall()
-            return [row['Field'] for row in rows]
 
     def _checkColumns(self, tableName, columns):
         """Return True if all columns are in table, false otherwise."""
@@ -5,6 +5,10 @@ from act.common.aCTConfig import aCTConfigARC, aCTConfigAPP
 from act.arc.aCTDBArc import aCTDBArc
 from act.condor.aCTDBCondor import aCTDBCondor
 from act.atlas.aCTDBPanda import aCTDBPanda
+from act.db.aCTDBSchema import aCTDBSchema
+from act.db.aCTDBCounters import aCTDBCounters
+from act.db.aCTDBEvents import aCTDBEvents
+from act.db.aCTDBClusters import aCTDBClusters
 
 from act.client.clientdb import ClientDB
 
@@ -46,6 +50,15 @@ def bootstrap_db():
         print('Error creating condor tables, see aCTBootstrap.log for details')
     if not dbpanda.createTables():
         print('Error creating panda tables, see aCTBootstrap.log for details')
+    # after the job tables since recreating them drops the counter triggers
+    if not aCTDBCounters(log).createTables():
+        print('Error creating job counters, see aCTBootstrap.log for details')
+    if not aCTDBEvents(log).createTables():
+        print('Error creating job events, see aCTBootstrap.log for details')
+    if not aCTDBClusters(log).createTables():
+        print('Error creating job clusters, see aCTBootstrap.log for details')
+    if not aCTDBSchema(log).migrate():
+        print('Error applying schema migrations, see aCTBootstrap.log for details')
 
 
 def main():
@@ -0,0 +1,39 @@
+# aCTCounterReconciler.py
+#
+# Periodically repairs drift of the materialized job counters and prunes
+# acknowledged job events
+#
+
+from act.common.aCTProcess import aCTProcess
+from act.db.aCTDBCounters import aCTDBCounters
+from act.db.aCTDBEvents import aCTDBEvents
+
+import time
+
+class aCTCounterReconciler(aCTProcess):
+
+    # Seconds between reconciliations
+    interval = 600
+
+    def __init__(self):
+        aCTProcess.__init__(self)
+        self.counters = aCTDBCounters(self.log)
+        self.events = aCTDBEvents(self.log)
+        # reconcile immediately at startup, e.g. after the counters were
+        # created by a schema migration
+        self.lastreconcile = 0
+
+    def process(self):
+        if time.time() - self.lastreconcile < self.interval:
+            return
+        drift = self.counters.reconcile()
+        self.log.info("Reconciled job counters, %d repaired" % drift)
+        pruned = self.events.pruneEvents()
+        if pruned:
+            self.log.info("Pruned %d job events" % pruned)
+        self.lastreconcile = time.time()
+
+if __name__ == '__main__':
+    st=aCTCounterReconciler()
+    st.run()
+    st.finish()
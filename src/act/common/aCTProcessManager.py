@@ -27,7 +27,8 @@ class aCTProcessManager:
         self.arcsubmitter = 'act/arc/aCTSubmitter'
         self.condorsubmitter = 'act/condor/aCTSubmitter'
         # dictionary of processes:aCTProcessHandler of which to run a single instance
-        self.processes_single = {'act/common/aCTProxyHandler': None}
+        self.processes_single = {'act/common/aCTProxyHandler': None,
+                                 'act/common/aCTCounterReconciler': None}
         apps = appconf.getList(["modules", "app"])
         for app in apps:
             try:
@@ -73,15 +74,10 @@ class aCTProcessManager:
 
     def reconnectDB(self):
         '''
-        Reconnect DB
+        Reconnect DB. All table objects in this process share one connection
+        so reconnecting it once is enough.
         '''
-        try:
-            del self.dbarc
-            del self.dbcondor
-        except AttributeError: # Already deleted
-            pass
-        self.dbarc = aCTDBArc.aCTDBArc(self.log)
-        self.dbcondor = aCTDBCondor.aCTDBCondor(self.log)
+        self.dbarc.db.reconnect()
 
 
     def checkARCClusters(self):
@@ -92,9 +88,7 @@ class aCTProcessManager:
         clusters = self.dbarc.getActiveClusters()
         activeclusters = dict((k, v) for (k, v) in zip([c['cluster'] for c in clusters],
                                                        [c['COUNT(*)'] for c in clusters]))
-        clusters = self.dbarc.getClusterLists()
-        clusterlists = dict((k, v) for (k, v) in zip([c['clusterlist'] for c in clusters],
-                                                     [c['COUNT(*)'] for c in clusters]))
+        submitclusters = [c['cluster'] for c in self.dbarc.getSubmitClusters()]
 
         # Check for processes that exited and if they should be restarted
         # All running per-cluster processes
@@ -128,18 +122,8 @@ class aCTProcessManager:
                     ph.start()
                     self.running[cluster].append(ph)
 
-        # Get unique list of clusters from cluster lists
-        clusterlist = []
-        for cluster in clusterlists:
-            if not cluster:
-                cluster = ''
-            clist = cluster.split(',')
-            for c in clist:
-                if c not in clusterlist:
-                    clusterlist.append(c)
-
         # Start any new submitters required
-        for cluster in clusterlist:
+        for cluster in submitclusters:
             if cluster not in self.submitters:
                 self.log.info("Starting process aCTSubmitter for %s", cluster)
                 ph = self.aCTProcessHandler(self.arcsubmitter, self.logdir, cluster, actlocation=self.actlocation)
@@ -155,9 +139,7 @@ class aCTProcessManager:
         clusters = self.dbcondor.getActiveClusters()
         activeclusters = dict((k, v) for (k, v) in zip([c['cluster'] for c in clusters],
                                                        [c['COUNT(*)'] for c in clusters]))
-        clusters = self.dbcondor.getClusterLists()
-        clusterlists = dict((k, v) for (k, v) in zip([c['clusterlist'] for c in clusters],
-                                                     [c['COUNT(*)'] for c in clusters]))
+        submitclusters = [c['cluster'] for c in self.dbcondor.getSubmitClusters()]
 
         # Check for processes that exited and if they should be restarted
         # All running per-cluster processes
@@ -189,30 +171,8 @@ class aCTProcessManager:
                     ph.start()
                     self.running[cluster].append(ph)
 
-        # Get unique list of clusters from cluster lists
-        clusterlist = []
-        for cluster in clusterlists:
-            if not cluster:
-                cluster = ''
-            clist = cluster.split(',')
-            # Here we handle the different formats used by condor
-            for c in clist:
-                # use only hostname for condor clusters
-                cinfo = c.split()
-                if not cinfo or len(cinfo) == 1:
-                    clusterlist.append(c)
-                elif cinfo[0] == 'nordugrid':
-                    clusterlist.append(cinfo[-1])
-                elif cinfo[0] == 'condor':
-                    clusterlist.append(cinfo[-2])
-                elif cinfo[0] == 'cream':
-                    clusterlist.append(cinfo[1][:cinfo[1].find('/')])
-                else:
-                    # unknown flavour, just use whole string
-                    clusterlist.append(c)
-
-        # Start any new submitters required
-        for cluster in clusterlist:
+        # Start any new submitters required, condor clusters are named by host
+        for cluster in submitclusters:
             if cluster not in self.submitters:
                 self.log.info("Starting process aCTSubmitter for %s", cluster)
                 ph = self.aCTProcessHandler(self.condorsubmitter, self.logdir, cluster, actlocation=self.actlocation)
@@ -1,4 +1,5 @@
 import argparse
+import datetime
 import os
 import re
 import signal
@@ -18,6 +19,7 @@ class aCTReport:
     def __init__(self, args):
         self.output = ""
         self.harvester = args.harvester
+        self.history = args.history
         self.outfile = args.web
         self.actconfs = args.conffiles or [''] # empty string for default behaviour
 
@@ -152,6 +154,35 @@ class aCTReport:
                 log += f'{"-":>10}'
         self.log(log+'\n\n')
 
+    def ArchiveReport(self):
+        '''Summary of archived jobs per site over the last days, from the
+        daily roll-up of pandaarchive'''
+        states = ["done", "donefailed", "donecancelled"]
+        since = datetime.date.today() - datetime.timedelta(days=self.history)
+        rep = {}
+        for conf in self.actconfs:
+            if conf:
+                os.environ['ACTCONFIGARC'] = conf
+
+            db = aCTDBPanda.aCTDBPanda(self.actlog)
+            rows = db.getArchiveDaily([('day', '>=', since)],
+                                      ['siteName', 'actpandastatus', 'SUM(njobs) AS njobs', 'SUM(walltime) AS walltime'],
+                                      groupby=['siteName', 'actpandastatus'])
+            for r in rows:
+                site = rep.setdefault(str(r['siteName']), {'walltime': 0})
+                site[r['actpandastatus']] = site.get(r['actpandastatus'], 0) + int(r['njobs'])
+                site['walltime'] += int(r['walltime'] or 0)
+
+        self.log(f"Archived Panda jobs since {since}:")
+        self.log(f"{'':29} {' '.join([f'{s:>13}' for s in states])} {'walltime (h)':>13}")
+        for k in sorted(rep.keys()):
+            log = f"{k:>28.28}:"
+            for s in states:
+                log += f'{rep[k].get(s, "-"):>14}'
+            log += f'{rep[k]["walltime"] // 3600:>14}'
+            self.log(log)
+        self.log()
+
     def ArcJobReport(self):
         rep={}
         rtot={}
@@ -346,12 +377,15 @@ def main():
     parser.add_argument('conffiles', nargs='*', help='list of configuration files')
     parser.add_argument('--web', help='Output suitable for web page')
     parser.add_argument('--harvester', action='store_true', help='Include harvester info')
+    parser.add_argument('--history', type=int, default=0, metavar='DAYS', help='Include archived jobs of the last DAYS days')
     args = parser.parse_args(sys.argv[1:])
 
     acts = aCTReport(args)
     acts.PandaReport()
     if acts.harvester:
         acts.HarvesterReport()
+    if acts.history:
+        acts.ArchiveReport()
     acts.ArcJobReport()
     acts.CondorJobReport()
     acts.StuckReport()
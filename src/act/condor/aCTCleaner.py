@@ -7,11 +7,19 @@ from act.common.aCTProcess import aCTProcess
 
 class aCTCleaner(aCTProcess):
 
+    def __init__(self):
+
+        aCTProcess.__init__(self)
+
+        # maximum number of jobs cleaned per cycle
+        self.cleanbatch = int(self.conf.get(['jobs', 'cleanbatch']) or 1000)
+
     def processToClean(self):
 
-        select = "condorstate='toclean' and cluster='%s' limit 100" % self.cluster
+        # Claim jobs so that other cleaners for the same cluster skip them
+        select = "condorstate='toclean' and cluster='%s'" % self.cluster
         columns = ['id', 'ClusterId', 'appjobid']
-        jobstoclean = self.dbcondor.getCondorJobsInfo(select, columns)
+        jobstoclean = self.dbcondor.claimCondorJobs(select, self.cleanbatch, columns)
 
         if not jobstoclean:
             return
@@ -20,7 +28,7 @@ class aCTCleaner(aCTProcess):
 
         for job in jobstoclean:
             self.log.info("%s: Cleaning job %s" % (job['appjobid'], job['ClusterId']))
-            self.dbcondor.deleteCondorJob(job['id'])
+        self.dbcondor.deleteCondorJobs([job['id'] for job in jobstoclean])
 
     def process(self):
 
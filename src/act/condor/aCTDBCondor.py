@@ -1,10 +1,14 @@
 import json
-from act.db.aCTDB import aCTDB
+from act.db.aCTDB import aCTDB, HOTCOLDSTATES
+from act.db.aCTDBClusters import aCTDBClusters
+from act.db import aCTDBQuery
 
 class aCTDBCondor(aCTDB):
 
     def __init__(self, log):
         aCTDB.__init__(self, log, 'condorjobs')
+        # clusters on which each job may run
+        self.clusters = aCTDBClusters(log)
 
 
     def createTables(self):
@@ -17,7 +21,9 @@ class aCTDBCondor(aCTDB):
           - condorstate: tosubmit, submitting, submitted, running, stalled, tocancel,
                       cancelling, cancelled, finished, failed, tofetch, torerun,
                       toresubmit, done, donefailed, lost, toclean
-            "to" states are set by application engine or Condor engine for retries
+            "to" states are set by application engine or Condor engine for retries.
+            Jobs in cold states (see HOTCOLDSTATES) are kept in a separate
+            partition from active jobs.
           - tcondorstate: time stamp of last arcstate
           - tstate: time stamp of last arc Job state change
           - cluster: hostname of the cluster chosen for the job
@@ -33,6 +39,9 @@ class aCTDBCondor(aCTDB):
           - priority: ARC job priority, extracted from the job description
           - fairshare: A string representing a share. Job submission for the same
             cluster will be spread evenly over shares.
+          - claimedby: worker which currently holds a claim on the job, see
+            claimCondorJobs()
+          - claimeduntil: time at which the claim expires
         ClassAd fields:
           - ClusterID
           - GlobalJodId
@@ -56,13 +65,15 @@ class aCTDBCondor(aCTDB):
             tstate TIMESTAMP,
             cluster VARCHAR(255),
             clusterlist VARCHAR(1024),
-            jobdesc INT(11),
+            jobdesc INTEGER,
             attemptsleft INTEGER,
             downloadfiles VARCHAR(255),
             proxyid INTEGER,
             appjobid VARCHAR(255),
             priority SMALLINT,
             fairshare VARCHAR(255),
+            claimedby VARCHAR(255),
+            claimeduntil DATETIME,
             ClusterId BIGINT,
             GlobalJobId VARCHAR(255),
             GridJobId VARCHAR(255),
@@ -77,10 +88,9 @@ class aCTDBCondor(aCTDB):
 
         # First check if table already exists
         c = self.db.getCursor()
-        c.execute("show tables like 'condorjobs'")
-        row = c.fetchone()
+        exists = self.db.tableExists('condorjobs')
         self.Commit()
-        if row:
+        if exists:
             answer = input("Table condorjobs already exists!\nAre you sure you want to recreate it? (y/n) ")
             if answer != 'y':
                 return False
@@ -89,6 +99,8 @@ class aCTDBCondor(aCTDB):
         # Create condorjobs
         try:
             c.execute(create)
+            self.db.partitionByState('condorjobs', *HOTCOLDSTATES['condorjobs'])
+            c.execute("CREATE INDEX condorjobs_cluster_state ON condorjobs (cluster, condorstate, tcondorstate)")
             self.Commit()
         except Exception as x:
             self.log.error("failed create table %s" %x)
@@ -112,14 +124,6 @@ class aCTDBCondor(aCTDB):
             self.log.error('%s: could not parse job description as dict: %s' % (appjobid, str(jobdesc)))
             return None
 
-        # todo: find some useful default for proxyid
-        c = self.db.getCursor()
-
-        s = "insert into jobdescriptions (jobdescription) values (%s)"
-        c.execute(s, [jobdescstr])
-        c.execute("SELECT LAST_INSERT_ID()")
-        jobdescid = c.fetchone()['LAST_INSERT_ID()']
-
         desc = {}
         desc['created'] = self.getTimeStamp()
         desc['condorstate'] = "tosubmit"
@@ -127,32 +131,38 @@ class aCTDBCondor(aCTDB):
         desc['tstate'] = desc['created']
         desc['cluster']  = ''
         desc['clusterlist'] = clusterlist
-        desc['jobdesc'] = jobdescid
         desc['attemptsleft'] = maxattempts
         desc['proxyid'] = proxyid
         desc['appjobid'] = appjobid
         desc['priority'] = jobdesc.get('JobPrio', 0)
         desc['fairshare'] = fairshare
-        s="insert into condorjobs" + " ( " + ",".join(['%s' % (k) for k in desc.keys()]) + " ) " + " values " + \
-            " ( " + ",".join(['%s' % (k) for k in ["%s"] * len(desc.keys()) ]) + " ) "
-        c.execute(s,list(desc.values()))
-        c.execute("SELECT LAST_INSERT_ID()")
-        row = c.fetchone()
-        self.Commit()
-        return row
+
+        # todo: find some useful default for proxyid
+        with self.transaction():
+            desc['jobdesc'] = self._storeJobDescription(jobdescstr)
+            id = self.db.insert(aCTDBQuery.insert('condorjobs', desc))
+            self.clusters.insertJobClusters('condorjobs', id, clusterlist, desc['condorstate'])
+        return {'LAST_INSERT_ID()': id}
 
 
     def deleteCondorJob(self, id):
         '''
         Delete job from Condor table.
         '''
-        c = self.db.getCursor()
-        c.execute("select jobdesc from condorjobs where id="+str(id))
-        row = c.fetchone()
-        if row:
-            c.execute("delete from jobdescriptions where id="+str(row['jobdesc']))
-        c.execute("delete from condorjobs where id="+str(id))
-        self.Commit()
+        self.deleteCondorJobs([id])
+
+    def deleteCondorJobs(self, ids):
+        '''
+        Delete a list of jobs from Condor table in one transaction and
+        release their job descriptions. Returns the number of deleted jobs.
+        '''
+        if not ids:
+            return 0
+        with self.transaction():
+            rows = self.db.fetch(aCTDBQuery.select('condorjobs', ['jobdesc'], {'id': list(ids)}))
+            self._releaseJobDescriptions([row['jobdesc'] for row in rows])
+            n = self.db.execute(aCTDBQuery.delete('condorjobs', {'id': list(ids)}))
+        return n
 
     def updateCondorJob(self, id, desc):
         '''
@@ -166,17 +176,12 @@ class aCTDBCondor(aCTDB):
         Update condor job fields specified in desc. Does not commit after
         executing update.
         '''
-        c = self.db.getCursor()
-        c.execute("select id from condorjobs where id=%d limit 1" % id)
-        row = c.fetchone()
-        if row is None:
+        if not self.db.fetch(aCTDBQuery.select('condorjobs', ['id'], {'id': id}, limit=1)):
             self.log.warning("Condor job id %d no longer exists" % id)
             return
 
         desc['modified'] = self.getTimeStamp()
-        s = "update condorjobs set " + ",".join(['%s=%%s' % (k) for k in desc.keys()])
-        s += " where id="+str(id)
-        c.execute(s, list(desc.values()))
+        self.db.execute(aCTDBQuery.update('condorjobs', desc, {'id': id}))
 
     def updateCondorJobs(self, desc, select):
         '''
@@ -197,23 +202,37 @@ class aCTDBCondor(aCTDB):
         c = self.db.getCursor()
         c.execute(s, list(desc.values()))
 
+    def claimCondorJobs(self, select, limit, columns=['id'], desc=None, lease=600, cursor=None):
+        '''
+        Claim up to limit condor jobs matching select for this worker and
+        return a list of column: value dictionaries for them. Jobs claimed by
+        other workers are skipped until their lease of lease seconds expires
+        or is released with releaseCondorJobs(). If desc is given the claimed
+        jobs are updated with it in the same transaction and no lease is kept.
+        If cursor is given jobs are claimed in id order after those of the
+        previous call with the same cursor.
+        '''
+        return self._claimRows(select, limit, columns, desc, lease, cursor)
+
+    def releaseCondorJobs(self, ids):
+        '''
+        Release the claim on the given condor jobs
+        '''
+        self._releaseRows(ids)
+
     def getCondorJobInfo(self, id, columns=[]):
         '''
         Return a dictionary of column name: value for the given id and columns
         '''
-        c = self.db.getCursor()
-        c.execute("SELECT "+self._column_list2str(columns)+" FROM condorjobs WHERE id="+str(id))
-        row = c.fetchone()
-        if not row:
+        rows = self.db.fetch(aCTDBQuery.select('condorjobs', columns, {'id': id}))
+        if not rows:
             return {}
-        # mysql SELECT returns list, we want dict
-        if not isinstance(row, dict):
-            row = dict(zip([col[0] for col in c.description], row))
-        return row
+        return rows[0]
 
     def getCondorJobsInfo(self, select, columns=[], tables="condorjobs", lock=False):
         '''
         Return a list of column: value dictionaries for jobs matching select.
+        select is either a where clause or conditions for aCTDBQuery.
         If lock is True the row will be locked if possible.
         '''
         c=self.db.getCursor()
@@ -223,40 +242,54 @@ class aCTDBCondor(aCTDB):
             if not res:
                 self.log.debug("Could not get lock: %s"%str(res))
                 return []
+        if not isinstance(select, str):
+            return self.db.fetch(aCTDBQuery.select(tables, columns, select))
         c.execute("SELECT "+self._column_list2str(columns)+" FROM "+tables+" WHERE "+select)
         rows=c.fetchall()
         return rows
 
+    def getCondorJobsInfoStream(self, select, columns=[], chunksize=1000):
+        '''
+        Generator of lists of at most chunksize column: value dictionaries
+        for jobs matching select (a where clause), like getCondorJobsInfo()
+        but streamed from the DB so memory does not grow with the number of
+        jobs. Statements may be executed between chunks.
+        '''
+        query = ("SELECT "+self._column_list2str(columns)+" FROM condorjobs WHERE "+select, [])
+        for rows in self.db.stream(query, chunksize):
+            yield rows
+
     def getCondorJobDescription(self, jobdescid):
         '''
         Return the job description for the given id in jobdescriptions
         '''
-        c = self.db.getCursor()
-        c.execute("SELECT jobdescription from jobdescriptions where id="+str(jobdescid))
-        row = c.fetchone()
-        if not row:
-            return None
-        return row['jobdescription']
+        return self._getJobDescription(jobdescid)
 
     def getActiveClusters(self):
         '''
-        Return a list and count of clusters
+        Return a list and count of clusters, from the job counters
         '''
-        c = self.db.getCursor()
-        c.execute("SELECT cluster, COUNT(*) FROM condorjobs WHERE cluster!='' GROUP BY cluster")
-        rows = c.fetchall()
-        return rows
+        return [{'cluster': r['cluster'], 'COUNT(*)': r['njobs']} for r in
+                self.getStateCounts([('cluster', '!=', '')], ['cluster'])]
 
-    def getClusterLists(self):
+    def getSubmitClusters(self):
         '''
-        Return a list and count of clusterlists for jobs to submit
+        Return a list and count of clusters for jobs to submit, from the
+        job_clusters table. Clusters are named by host, see
+        aCTDBClusters.splitClusterList().
         '''
-        c = self.db.getCursor()
         # submitting state is included here so that a submitter process is not
         # killed while submitting jobs
-        c.execute("SELECT clusterlist, COUNT(*) FROM condorjobs WHERE condorstate in ('tosubmit', 'submitting', 'torerun', 'toresubmit', 'tocancel') GROUP BY clusterlist")
-        rows = c.fetchall()
-        return rows
+        states = ['tosubmit', 'submitting', 'torerun', 'toresubmit', 'tocancel']
+        return [{'cluster': r['cluster'], 'COUNT(*)': r['njobs']} for r in
+                self.clusters.getClusters('condorjobs', states)]
+
+    def clusterSelect(self, cluster, states):
+        '''
+        Return an aCTDBQuery.Raw condition selecting jobs in one of states
+        which may run on cluster
+        '''
+        return self.clusters.clusterSelect('condorjobs', cluster, states)
 
 if __name__ == '__main__':
     import logging, sys
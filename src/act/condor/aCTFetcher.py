@@ -12,10 +12,12 @@ class aCTFetcher(aCTProcess):
 
     def fetchJobs(self, condorstate, nextcondorstate):
 
-        # Get list of jobs in the right state
-        select = "condorstate='%s' and cluster='%s' limit 100" % (condorstate, self.cluster)
+        # Claim jobs in the right state, moving them on in the same transaction
+        select = "condorstate='%s' and cluster='%s'" % (condorstate, self.cluster)
         columns = ['id', 'ClusterId', 'appjobid']
-        jobstofetch = self.dbcondor.getCondorJobsInfo(select, columns)
+        jobstofetch = self.dbcondor.claimCondorJobs(select, 100, columns,
+                                                    desc={"condorstate": nextcondorstate,
+                                                          "tcondorstate": self.db.getTimeStamp()})
 
         if not jobstofetch:
             return
@@ -24,8 +26,6 @@ class aCTFetcher(aCTProcess):
 
         for job in jobstofetch:
             self.log.info("%s: Finished with job %s" % (job['appjobid'], job['ClusterId']))
-            self.dbcondor.updateCondorJob(job['id'], {"condorstate": nextcondorstate,
-                                                      "tcondorstate": self.db.getTimeStamp()})
 
 
     def process(self):
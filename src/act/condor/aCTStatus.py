@@ -2,6 +2,7 @@
 #
 # Process to check the status of running Condor jobs
 #
+import itertools
 import time
 import htcondor
 import classad
@@ -31,6 +32,8 @@ class aCTStatus(aCTProcess):
 
         # store the last checkJobs time to avoid overloading of GIIS
         self.checktime=time.time()
+        # number of jobs read from the DB at a time
+        self.chunksize = 1000
 
 
     def checkJobs(self):
@@ -49,11 +52,13 @@ class aCTStatus(aCTProcess):
                 "ClusterId not like '' and cluster='"+self.cluster+"' and "+ \
                 self.dbcondor.timeStampLessThan("tcondorstate", self.conf.get(['jobs','checkinterval'])) + \
                 " limit 100000"
-        jobstocheck = self.dbcondor.getCondorJobsInfo(query, columns=['id', 'appjobid', 'JobStatus', 'ClusterId'])
-
-        if not jobstocheck:
+        # Jobs are streamed from the DB in chunks so that memory stays flat
+        # however many jobs there are to check
+        chunks = self.dbcondor.getCondorJobsInfoStream(query, columns=['id', 'appjobid', 'JobStatus', 'ClusterId'],
+                                                       chunksize=self.chunksize)
+        firstchunk = next(chunks, None)
+        if not firstchunk:
             return
-        self.log.info("%d jobs to check" % len(jobstocheck))
 
         # Query condor for all jobs with this cluster
         # Add here attributes we eventually want in the DB
@@ -80,7 +85,9 @@ class aCTStatus(aCTProcess):
         t2 = time.time()
         self.log.debug('took %f to query schedd (returning %d results)' % ((t2-t1), len(condorstatuses)))
         # Loop over jobs
-        for job in jobstocheck:
+        njobstocheck = 0
+        for job in itertools.chain.from_iterable(itertools.chain([firstchunk], chunks)):
+            njobstocheck += 1
 
             appjobid = job['appjobid']
             oldstatus = job['JobStatus']
@@ -153,7 +160,7 @@ class aCTStatus(aCTProcess):
             self.log.debug(str(jobdesc))
             self.dbcondor.updateCondorJob(job['id'], jobdesc)
 
-        self.log.info('Done')
+        self.log.info('Done, checked %d jobs' % njobstocheck)
 
     def checkLostJobs(self):
         '''
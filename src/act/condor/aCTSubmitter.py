@@ -5,6 +5,7 @@ import htcondor
 
 from threading import Thread
 from act.common.aCTProcess import aCTProcess
+from act.db import aCTDBQuery
 
 class SubmitThr(Thread):
     def __init__ (self, func, id, appjobid, jobdesc, logger, schedd):
@@ -96,7 +97,8 @@ class aCTSubmitter(aCTProcess):
             return 0
 
         # Apply fair-share
-        fairshares = self.dbcondor.getCondorJobsInfo("condorstate='tosubmit' and clusterlist like '%"+self.cluster+"%'", ['fairshare'])
+        tosubmit = [('condorstate', 'tosubmit'), self.dbcondor.clusterSelect(self.cluster, ['tosubmit'])]
+        fairshares = self.dbcondor.getCondorJobsInfo(tosubmit, ['fairshare'])
 
         if not fairshares:
             self.log.info('Nothing to submit')
@@ -107,28 +109,12 @@ class aCTSubmitter(aCTProcess):
 
         for fairshare in fairshares:
 
-            try:
-                # catch any exceptions here to avoid leaving lock
-                # Lock row for update in case multiple clusters are specified
-                jobs = self.dbcondor.getCondorJobsInfo("condorstate='tosubmit' and ( clusterlist like '% {0}%' or clusterlist like '%{0},%' ) and fairshare='{1}' limit 10".format(self.cluster, fairshare),
-                                            columns=["id", "jobdesc", "appjobid", "priority", "proxyid", "clusterlist"], lock=True)
-                if jobs:
-                    self.log.debug("started lock for writing %d jobs" % len(jobs))
-
-                # mark submitting in db
-                jobs_taken = []
-                for j in jobs:
-                    jd = {'cluster': self.cluster, 'condorstate': 'submitting', 'tcondorstate': self.dbcondor.getTimeStamp()}
-                    self.dbcondor.updateCondorJobLazy(j['id'], jd)
-                    jobs_taken.append(j)
-                jobs = jobs_taken
-
-            finally:
-                try:
-                    self.dbcondor.Commit(lock=True)
-                    self.log.debug("ended lock")
-                except:
-                    self.log.warning("Failed to release DB lock")
+            # Claim jobs and mark them submitting in one transaction, so that
+            # several submitters (also for other clusters in the clusterlist)
+            # never pick the same job
+            select = tosubmit + [('fairshare', fairshare)]
+            jd = {'cluster': self.cluster, 'condorstate': 'submitting', 'tcondorstate': self.dbcondor.getTimeStamp()}
+            jobs = self.dbcondor.claimCondorJobs(select, 10, columns=["id", "jobdesc", "appjobid", "priority", "proxyid", "clusterlist"], desc=jd)
 
             if len(jobs) == 0:
                 #self.log.debug("No jobs to submit")
@@ -146,24 +132,26 @@ class aCTSubmitter(aCTProcess):
             queuelist = []
 
             # Check queued jobs and limits
-            qjobs=self.dbcondor.getCondorJobsInfo("cluster='" +str(self.cluster)+ "' and ( condorstate='submitted' or condorstate='holding' ) and fairshare='%s'" % fairshare, ['id', 'priority'])
-            rjobs=self.dbcondor.getCondorJobsInfo("cluster='" +str(self.cluster)+ "' and condorstate='running' and fairshare='%s'" % fairshare, ['id'])
+            counts = dict((c['state'], c['njobs']) for c in self.dbcondor.getStateCounts(
+                {'cluster': str(self.cluster), 'state': ['submitted', 'holding', 'running'], 'fairshare': fairshare or ''}))
+            nqueued = counts.get('submitted', 0) + counts.get('holding', 0)
+            nrunning = counts.get('running', 0)
 
             # max queued priority
-            try:
-                maxprioqueued = max(qjobs,key = lambda x : x['priority'])['priority']
-            except:
-                maxprioqueued = 0
+            maxprioqueued = 0
+            if nqueued:
+                qjobs=self.dbcondor.getCondorJobsInfo("cluster='" +str(self.cluster)+ "' and ( condorstate='submitted' or condorstate='holding' ) and fairshare='%s'" % fairshare, ['MAX(priority) AS priority'])
+                maxprioqueued = (qjobs[0]['priority'] if qjobs else 0) or 0
             self.log.info("Max priority queued: %d" % maxprioqueued)
 
             # Set number of submitted jobs to (running * qfraction + qoffset/num of shares)/num CEs
             # Note: assumes only a few shares are used and all jobs in the fairshare have the same clusterlist
             qfraction = float(self.conf.get(['jobs', 'queuefraction'])) if self.conf.get(['jobs', 'queuefraction']) else 0.15
             qoffset = int(self.conf.get(['jobs', 'queueoffset'])) if self.conf.get(['jobs', 'queueoffset']) else 100
-            jlimit = (len(rjobs)*qfraction + qoffset/len(fairshares)) / len(jobs[0]['clusterlist'].split(','))
-            self.log.debug("running %d, queued %d, queue limit %d" % (len(rjobs), len(qjobs), jlimit))
+            jlimit = (nrunning*qfraction + qoffset/len(fairshares)) / len(jobs[0]['clusterlist'].split(','))
+            self.log.debug("running %d, queued %d, queue limit %d" % (nrunning, nqueued, jlimit))
 
-            if len(qjobs) < jlimit or ( ( maxpriowaiting > maxprioqueued ) and ( maxpriowaiting > 10 ) ) :
+            if nqueued < jlimit or ( ( maxpriowaiting > maxprioqueued ) and ( maxpriowaiting > 10 ) ) :
                 if maxpriowaiting > maxprioqueued :
                     self.log.info("Overriding limit, maxpriowaiting: %d > maxprioqueued: %d" % (maxpriowaiting, maxprioqueued))
                 queuelist.append(self.cluster)
@@ -230,7 +218,9 @@ class aCTSubmitter(aCTProcess):
 
     def processToCancel(self):
 
-        jobstocancel = self.dbcondor.getCondorJobsInfo("condorstate='tocancel' and (cluster='{0}' or clusterlist like '%{0}' or clusterlist like '%{0},%')".format(self.cluster),
+        oncluster = self.dbcondor.clusterSelect(self.cluster, ['tocancel'])
+        oncluster = aCTDBQuery.Raw("(cluster=%s or " + oncluster.sql + ")", [self.cluster] + oncluster.params)
+        jobstocancel = self.dbcondor.getCondorJobsInfo([('condorstate', 'tocancel'), oncluster],
                                                        ['id', 'appjobid', 'ClusterId'])
         if not jobstocancel:
             return
@@ -1,15 +1,68 @@
 import datetime
+import hashlib
+import os
+import socket
+import time
+import uuid
+import zlib
 from act.db import aCTDBMS
+from act.db import aCTDBQuery
 from act.common.aCTConfig import aCTConfigARC
 
+# Config and DB connection shared by all table objects of a process. Keyed by
+# pid so that forked children open their own connection, and by config file so
+# that tools looping over several aCT instances get one connection each.
+_shared = {}
+
+def getSharedDB(log):
+    '''
+    Return (config, aCTDBMS) shared by all aCTDB objects in this process,
+    creating them on first use
+    '''
+    key = (os.getpid(), os.environ.get('ACTCONFIGARC'))
+    if key not in _shared:
+        conf = aCTConfigARC()
+        _shared[key] = (conf, aCTDBMS.getDB(log, conf))
+    return _shared[key]
+
+# Hot/cold layout of the job tables: (state column, hot states, cold states).
+# Jobs in cold states have left the CE and only wait for the application
+# engine, the cleaner or the archiver, so they are kept apart from the active
+# jobs (see aCTDBMS.partitionByState()) and selects on the state column only
+# touch one side. Every state a job can be in must be listed.
+HOTCOLDSTATES = {
+    'arcjobs': ('arcstate',
+                ['', 'tosubmit', 'submitting', 'submitted', 'running', 'stalled', 'holding', 'tocancel',
+                 'cancelling', 'finished', 'failed', 'tofetch', 'torerun', 'toresubmit'],
+                ['done', 'donefailed', 'cancelled', 'lost', 'toclean']),
+    'condorjobs': ('condorstate',
+                   ['', 'tosubmit', 'submitting', 'submitted', 'running', 'stalled', 'holding', 'tocancel',
+                    'cancelling', 'finished', 'failed', 'tofetch', 'torerun', 'toresubmit'],
+                   ['done', 'donefailed', 'cancelled', 'lost', 'toclean']),
+}
+
+def monthRange(first, last):
+    '''
+    Return the list of the first days (datetime.date) of the months from the
+    month of first to the month of last, inclusive
+    '''
+    months = []
+    month = datetime.date(first.year, first.month, 1)
+    while month <= last:
+        months.append(month)
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+    return months
+
 class aCTDB(object):
     '''Superclass representing a general table in the DB'''
 
     def __init__(self, logger, tablename):
         self.log = logger
         self.table = tablename
-        self.conf = aCTConfigARC()
-        self.db = aCTDBMS.getDB(self.log, self.conf)
+        self.conf, self.db = getSharedDB(self.log)
+        # last id returned for each keyset cursor of this process, see
+        # getPageIds()
+        self.cursors = {}
 
     def _column_list2str(self,columns):
         s=""
@@ -30,15 +83,215 @@ class aCTDB(object):
     def timeStampLessThan(self, column, timediff):
         return self.db.timeStampLessThan(column, timediff)
 
+    def timeStampGreaterThan(self, column, timediff):
+        return self.db.timeStampGreaterThan(column, timediff)
+
+    def timeStampLessThanCondition(self, column, timediff):
+        return self.db.timeStampLessThanCondition(column, timediff)
+
+    def timeStampGreaterThanCondition(self, column, timediff):
+        return self.db.timeStampGreaterThanCondition(column, timediff)
+
+    def getPageIds(self, cursor, select, limit, tables=None, idcolumn='id'):
+        '''
+        Return the ids of the next page of at most limit rows matching select
+        (a where clause on tables, this table by default) in id order,
+        continuing after the last id returned for the named cursor in this
+        process. When fewer than limit ids are left the cursor wraps around to
+        the start, so repeated calls cycle through all matching rows instead
+        of rescanning the same leading rows while later rows starve.
+        '''
+        last = self.cursors.get(cursor, 0)
+        c = self.db.getCursor()
+        c.execute("SELECT %s AS id FROM %s WHERE (%s) AND %s > %d ORDER BY %s LIMIT %d" %
+                  (idcolumn, tables or self.table, select, idcolumn, last, idcolumn, limit))
+        ids = [row['id'] for row in c.fetchall()]
+        self.cursors[cursor] = ids[-1] if len(ids) == limit else 0
+        return ids
+
+    def iterPageIds(self, select, limit, tables=None, idcolumn='id'):
+        '''
+        Generator of lists of at most limit ids of the rows matching select,
+        in id order, covering all matching rows once. Each page is a keyset
+        query after the last id of the previous page so the cost per page is
+        constant however large the backlog.
+        '''
+        last = 0
+        while True:
+            c = self.db.getCursor()
+            c.execute("SELECT %s AS id FROM %s WHERE (%s) AND %s > %d ORDER BY %s LIMIT %d" %
+                      (idcolumn, tables or self.table, select, idcolumn, last, idcolumn, limit))
+            ids = [row['id'] for row in c.fetchall()]
+            if ids:
+                yield ids
+            if len(ids) < limit:
+                return
+            last = ids[-1]
+
+    def _claimRows(self, select, limit, columns=['id'], desc=None, lease=600, cursor=None):
+        '''
+        Atomically claim up to limit rows of this table matching select, a
+        where clause or conditions for aCTDBQuery, which are not already claimed by another worker, and return a list of
+        column: value dictionaries for them. Claimed rows get a lease
+        (claimedby/claimeduntil) so that concurrent workers skip them until the
+        lease expires or is released. If desc is given it is applied to the
+        claimed rows in the same transaction (typically a state transition)
+        and the lease is dropped again since the new state protects the rows.
+        Candidate rows are selected with SKIP LOCKED where the backend
+        supports it, otherwise the update checks select and the lease again
+        so that a worker does not claim a row which another worker claimed,
+        or moved out of select, since the candidates were read. If cursor is
+        given candidates are taken in id order after the rows claimed by the
+        previous call with the same cursor, see getPageIds().
+        '''
+        token = '%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        now = self.db.timeStampBound(0)
+        unclaimed = "(claimedby IS NULL OR claimeduntil < %s)"
+        keyset = ""
+        if cursor:
+            keyset = " AND id > %d ORDER BY id" % self.cursors.get(cursor, 0)
+        if isinstance(select, str):
+            # inlined SQL, escape it for the parameter substitution
+            select = aCTDBQuery.Raw(select.replace('%', '%%'))
+        select, selectparams = aCTDBQuery.where(select)
+        selected = "(%s)" % select
+        with self.transaction():
+            c = self.db.getCursor()
+            c.execute("SELECT id FROM %s WHERE %s AND %s%s LIMIT %d%s" % (self.table, selected, unclaimed, keyset, limit, self.db.skipLocked()),
+                      selectparams + [now])
+            ids = [row['id'] for row in c.fetchall()]
+            if cursor:
+                self.cursors[cursor] = ids[-1] if len(ids) == limit else 0
+            if not ids:
+                return []
+
+            update = dict(desc or {})
+            update['claimedby'] = token
+            update['claimeduntil'] = self.getTimeStamp(time.time() + lease)
+            update['modified'] = self.getTimeStamp()
+            s = "UPDATE %s SET " % self.table + ",".join(['%s=%%s' % (k) for k in update.keys()])
+            s += " WHERE id IN (" + ",".join(['%s'] * len(ids)) + ") AND " + selected + " AND " + unclaimed
+            c.execute(s, list(update.values()) + ids + selectparams + [now])
+
+            # only look at the candidate rows, claimedby is not indexed
+            claimed = " WHERE id IN (" + ",".join(['%s'] * len(ids)) + ") AND claimedby=%s"
+            if desc:
+                # desc may have moved the claimed rows out of select
+                c.execute("SELECT "+self._column_list2str(columns)+" FROM "+self.table+claimed, ids + [token])
+            else:
+                c.execute("SELECT "+self._column_list2str(columns)+" FROM "+self.table+claimed+" AND "+selected, ids + [token] + selectparams)
+            rows = c.fetchall()
+            if desc:
+                c.execute("UPDATE "+self.table+" SET claimedby=NULL, claimeduntil=NULL"+claimed, ids + [token])
+        return rows
+
+    def _releaseRows(self, ids):
+        '''
+        Drop the claim on the given rows so other workers can pick them up
+        '''
+        if not ids:
+            return
+        c = self.db.getCursor()
+        c.execute("UPDATE "+self.table+" SET claimedby=NULL, claimeduntil=NULL WHERE id IN (" + ",".join(['%s'] * len(ids)) + ")", list(ids))
+        self.Commit()
+
+    def _storeJobDescription(self, jobdesc):
+        '''
+        Store a job description in the jobdescriptions table and return its
+        id. Descriptions are stored zlib-compressed and keyed by the sha256 of
+        their content, so identical descriptions share one row with a
+        reference count. Each call adds one reference which must be dropped
+        with _releaseJobDescription(). Does not commit.
+        '''
+        jobdesc = str(jobdesc).encode('utf-8')
+        digest = hashlib.sha256(jobdesc).hexdigest()
+        rows = self.db.fetch(aCTDBQuery.select('jobdescriptions', ['id'], {'hash': digest}, limit=1))
+        # the row may have been released in the meantime, then insert a new one
+        if rows and self.db.execute(aCTDBQuery.update('jobdescriptions', {'refcount': aCTDBQuery.Raw('refcount+1')},
+                                                      [('id', rows[0]['id']), ('refcount', '>', 0)])):
+            return rows[0]['id']
+        return self.db.insert(aCTDBQuery.insert('jobdescriptions', {'hash': digest, 'refcount': 1,
+                                                                   'data': zlib.compress(jobdesc)}))
+
+    def _getJobDescription(self, jobdescid):
+        '''
+        Return the job description with the given id in jobdescriptions, None
+        if it does not exist
+        '''
+        rows = self.db.fetch(aCTDBQuery.select('jobdescriptions', ['jobdescription', 'data'], {'id': jobdescid}))
+        if not rows:
+            return None
+        # rows written before compression was introduced only have the text
+        if rows[0]['data'] is None:
+            return rows[0]['jobdescription']
+        return zlib.decompress(rows[0]['data']).decode('utf-8')
+
+    def _releaseJobDescription(self, jobdescid):
+        '''
+        Drop one reference to a job description and delete it when no
+        references are left. Does not commit.
+        '''
+        self._releaseJobDescriptions([jobdescid])
+
+    def _releaseJobDescriptions(self, jobdescids):
+        '''
+        Drop one reference to the job description for each id in the list,
+        which may contain the same id several times, and delete the
+        descriptions which have no references left. Does not commit.
+        '''
+        jobdescids = [i for i in jobdescids if i is not None]
+        if not jobdescids:
+            return
+        counts = {}
+        for jobdescid in jobdescids:
+            counts[jobdescid] = counts.get(jobdescid, 0) + 1
+        byrefs = {}
+        for jobdescid, n in counts.items():
+            byrefs.setdefault(n, []).append(jobdescid)
+        for n, ids in byrefs.items():
+            self.db.execute(aCTDBQuery.update('jobdescriptions', {'refcount': aCTDBQuery.Raw('refcount-%d' % n)},
+                                              {'id': ids}))
+        # rows without refcount predate reference counting and have one owner
+        self.db.execute(aCTDBQuery.delete('jobdescriptions', [('id', list(counts)),
+                                                              aCTDBQuery.Raw('(refcount IS NULL OR refcount <= 0)')]))
+
+    def getStateCounts(self, conditions=None, groupby=['state']):
+        '''
+        Return a list of dictionaries of the groupby columns and njobs, the
+        number of jobs of this table matching conditions. Conditions and
+        groupby are on the cluster, clusterlist, state and fairshare columns
+        of the materialized counters (see aCTDBCounters), so no job rows are
+        scanned.
+        '''
+        if isinstance(conditions, dict):
+            conditions = list(conditions.items())
+        select = [('tablename', self.table)] + (conditions or [])
+        rows = self.db.fetch(aCTDBQuery.select('jobcounters', list(groupby) + ['SUM(njobs) AS njobs'], select,
+                                               groupby=groupby or None))
+        for row in rows:
+            row['njobs'] = int(row['njobs'] or 0)
+        # a count is spread over several rows, only their sum is meaningful
+        if groupby:
+            rows = [row for row in rows if row['njobs'] > 0]
+        return rows
+
+    def transaction(self):
+        '''
+        Context manager grouping all statements of this table object into one
+        transaction, committed once at the end. See aCTDBMS.transaction().
+        '''
+        return self.db.transaction()
+
     def Commit(self, lock=False):
         if lock:
             res = self.db.releaseMutexLock(self.table)
             if not res:
                 self.log.warning("Could not release lock: %s" % str(res))
-        try:
-            self.db.conn.commit()
-        except Exception as e:
-            self.log.error("Exception on commit: %s" % str(e))
+        # inside a transaction block the commit happens when the block ends
+        if not self.db.inTransaction():
+            try:
+                self.db.conn.commit()
+            except Exception as e:
+                self.log.error("Exception on commit: %s" % str(e))
         if lock:
-            c = self.db.getCursor()
-            c.execute("UNLOCK TABLES")
+            self.db.unlockTables()
@@ -0,0 +1,147 @@
+'''
+Mapping of arc and condor jobs to the clusters of their clusterlist. The job
+tables keep the clusterlist as a comma separated string, which can only be
+searched with substring matches that cannot use an index and may match the
+wrong cluster. job_clusters has one row per job and cluster, inserted with the
+job, and triggers keep the state of the rows in step with the job state and
+delete them with the job, so that submitters find their jobs with an exact
+lookup on (cluster, state).
+'''
+from act.db.aCTDB import aCTDB
+from act.db import aCTDBQuery
+from act.db.aCTDBEvents import STATECOLUMNS
+
+JOBCLUSTERS = 'tablename VARCHAR(32), jobid INTEGER, cluster VARCHAR(255), state VARCHAR(255), ' \
+              'PRIMARY KEY (tablename, jobid, cluster)'
+JOBCLUSTERSINDEX = ['cluster', 'state', 'tablename']
+
+
+def _condorHost(entry):
+    # condor clusterlist entries are grid resources, e.g. "condor host
+    # host:port", and submitters are named after the host only
+    cinfo = entry.split()
+    if len(cinfo) <= 1:
+        return entry
+    if cinfo[0] == 'nordugrid':
+        return cinfo[-1]
+    if cinfo[0] == 'condor':
+        return cinfo[-2]
+    if cinfo[0] == 'cream':
+        return cinfo[1][:cinfo[1].find('/')]
+    # unknown flavour, just use whole string
+    return entry
+
+def splitClusterList(table, clusterlist):
+    '''
+    Return the list of clusters, as named by their submitters, in the
+    clusterlist of a job of table. A job with an empty clusterlist may run
+    anywhere and is mapped to the cluster ''.
+    '''
+    clusters = []
+    for entry in (clusterlist or '').split(','):
+        if table == 'condorjobs':
+            entry = _condorHost(entry)
+        if entry not in clusters:
+            clusters.append(entry)
+    return clusters
+
+def clusterTriggers():
+    '''
+    Return a list of (trigger name, table, definition) for the triggers
+    maintaining job_clusters
+    '''
+    triggers = []
+    for table, state in sorted(STATECOLUMNS.items()):
+        triggers.append(('%s_clusters_update' % table, table,
+                         "AFTER UPDATE ON %s FOR EACH ROW IF NOT (NEW.%s <=> OLD.%s) THEN "
+                         "UPDATE job_clusters SET state=NEW.%s WHERE tablename='%s' AND jobid=NEW.id; END IF" %
+                         (table, state, state, state, table)))
+        triggers.append(('%s_clusters_delete' % table, table,
+                         "AFTER DELETE ON %s FOR EACH ROW DELETE FROM job_clusters WHERE tablename='%s' AND jobid=OLD.id" %
+                         (table, table)))
+    return triggers
+
+
+class aCTDBClusters(aCTDB):
+    '''
+    Access to the job_clusters table. The job table classes insert the rows
+    of new jobs and select jobs by cluster through it.
+    '''
+
+    def __init__(self, log):
+        aCTDB.__init__(self, log, 'job_clusters')
+
+    def createTables(self):
+        '''
+        job_clusters: clusters on which each job may run
+          - tablename: arcjobs or condorjobs
+          - jobid: id of the job in tablename
+          - cluster: cluster from the clusterlist of the job, '' if the
+            clusterlist is empty, see splitClusterList()
+          - state: arcstate or condorstate of the job
+        '''
+        c = self.db.getCursor()
+        try:
+            c.execute("DROP TABLE IF EXISTS job_clusters")
+            c.execute("CREATE TABLE job_clusters (%s)" % JOBCLUSTERS)
+            c.execute("CREATE INDEX job_clusters_cluster_state ON job_clusters (%s)" % ', '.join(JOBCLUSTERSINDEX))
+            for (name, table, definition) in clusterTriggers():
+                c.execute("DROP TRIGGER IF EXISTS %s" % name)
+                self.db.createTrigger(name, definition)
+        except Exception as x:
+            self.log.error("failed create table %s" %x)
+            return False
+        self.Commit()
+        for table in sorted(STATECOLUMNS):
+            self.fill(table)
+        return True
+
+    def fill(self, table, chunksize=1000):
+        '''
+        Recreate the job_clusters rows of table from the clusterlists of its
+        jobs, e.g. after job_clusters was created by a schema migration. Jobs
+        must not be inserted at the same time.
+        '''
+        columns = ['tablename', 'jobid', 'cluster', 'state']
+        query = ("SELECT id, clusterlist, %s AS state FROM %s" % (STATECOLUMNS[table], table), [])
+        with self.transaction():
+            self.db.execute(aCTDBQuery.delete('job_clusters', {'tablename': table}))
+            for jobs in self.db.stream(query, chunksize):
+                rows = [[table, j['id'], cluster, j['state']] for j in jobs
+                        for cluster in splitClusterList(table, j['clusterlist'])]
+                self.db.execute(aCTDBQuery.insertMany('job_clusters', columns, rows))
+
+    def insertJobClusters(self, table, jobid, clusterlist, state):
+        '''
+        Insert the rows of a new job of table with the given clusterlist and
+        state. Does not commit, call inside the transaction inserting the job.
+        '''
+        self.insertManyJobClusters(table, [(jobid, clusterlist, state)])
+
+    def insertManyJobClusters(self, table, jobs):
+        '''
+        Insert the rows of a list of new jobs of table, each given as (jobid,
+        clusterlist, state), in one statement. Does not commit.
+        '''
+        rows = [[table, jobid, cluster, state] for (jobid, clusterlist, state) in jobs
+                for cluster in splitClusterList(table, clusterlist)]
+        if rows:
+            self.db.execute(aCTDBQuery.insertMany('job_clusters', ['tablename', 'jobid', 'cluster', 'state'], rows))
+
+    def clusterSelect(self, table, cluster, states):
+        '''
+        Return an aCTDBQuery.Raw condition selecting the jobs of table in one
+        of states which may run on cluster, or which have an empty clusterlist
+        if cluster is ''
+        '''
+        return aCTDBQuery.Raw("%s.id IN (SELECT jobid FROM job_clusters WHERE tablename=%%s AND cluster=%%s "
+                              "AND state IN (%s))" % (table, ','.join(['%s'] * len(states))),
+                              [table, cluster] + list(states))
+
+    def getClusters(self, table, states):
+        '''
+        Return a list of dictionaries of cluster and njobs, the number of
+        jobs of table in one of states which may run on the cluster
+        '''
+        return self.db.fetch(aCTDBQuery.select('job_clusters', ['cluster', 'COUNT(*) AS njobs'],
+                                               {'tablename': table, 'state': states}, groupby='cluster'))
@@ -0,0 +1,139 @@
+'''
+Materialized job counts per table, cluster (or site), clusterlist, state and
+fairshare. The counts are maintained by triggers on every insert, delete and
+state transition of the job tables, so that callers which need the number of
+jobs in a given state read a handful of jobcounters rows instead of scanning
+the job tables. Each count is spread over COUNTERSLOTS rows chosen by job id,
+so that concurrent writers changing jobs in the same state rarely update the
+same row, and readers sum the slots. reconcile() recomputes the counts from
+the job tables to repair any drift.
+'''
+from act.db.aCTDB import aCTDB
+from act.db import aCTDBQuery
+
+# Columns of each job table mapped to the counter dimensions, in the order of
+# DIMENSIONS. None means the dimension is not used for the table.
+DIMENSIONS = ['cluster', 'clusterlist', 'state', 'fairshare']
+COUNTEDTABLES = {'arcjobs': ('cluster', 'clusterlist', 'arcstate', 'fairshare'),
+                 'condorjobs': ('cluster', 'clusterlist', 'condorstate', 'fairshare'),
+                 'pandajobs': ('siteName', None, 'actpandastatus', None)}
+
+# Number of rows each count is spread over
+COUNTERSLOTS = 8
+
+JOBCOUNTERS = 'countkey CHAR(40) PRIMARY KEY, tablename VARCHAR(32), cluster VARCHAR(255), ' \
+              'clusterlist VARCHAR(1024), state VARCHAR(255), fairshare VARCHAR(255), njobs INTEGER'
+
+
+def _values(table, row=None):
+    # SQL expressions of the dimensions of a job row, row is NEW or OLD in
+    # triggers and None in queries on the job table itself
+    prefix = row + '.' if row else ''
+    return ["IFNULL(%s%s, '')" % (prefix, col) if col else "''" for col in COUNTEDTABLES[table]]
+
+def _key(table, values, slot=None):
+    # slot 0 is NULL, which CONCAT_WS skips, so its key is that of the
+    # counters from before they were spread over slots
+    return "SHA1(CONCAT_WS(CHAR(31), '%s', %s))" % (table, ', '.join(values + ([slot] if slot else [])))
+
+def _add(table, row, n):
+    # upsert so that a slot row removed by reconcile() is created again
+    values = _values(table, row)
+    slot = "NULLIF(%s.id %% %d, 0)" % (row, COUNTERSLOTS)
+    return "INSERT INTO jobcounters (countkey, tablename, %s, njobs) VALUES (%s, '%s', %s, %d) " \
+           "ON DUPLICATE KEY UPDATE njobs=njobs%+d" % (', '.join(DIMENSIONS), _key(table, values, slot), table,
+                                                      ', '.join(values), n, n)
+
+def _increment(table, row):
+    return _add(table, row, 1)
+
+def _decrement(table, row):
+    return _add(table, row, -1)
+
+def counterTriggers():
+    '''
+    Return a list of (trigger name, table, definition) for the triggers
+    maintaining jobcounters
+    '''
+    triggers = []
+    for table, columns in sorted(COUNTEDTABLES.items()):
+        changed = ' OR '.join(['NOT (NEW.%s <=> OLD.%s)' % (col, col) for col in columns if col])
+        triggers.append(('%s_count_insert' % table, table,
+                         'AFTER INSERT ON %s FOR EACH ROW %s' % (table, _increment(table, 'NEW'))))
+        triggers.append(('%s_count_delete' % table, table,
+                         'AFTER DELETE ON %s FOR EACH ROW %s' % (table, _decrement(table, 'OLD'))))
+        triggers.append(('%s_count_update' % table, table,
+                         'AFTER UPDATE ON %s FOR EACH ROW IF %s THEN %s; %s; END IF' %
+                         (table, changed, _decrement(table, 'OLD'), _increment(table, 'NEW'))))
+    return triggers
+
+
+class aCTDBCounters(aCTDB):
+    '''
+    Access to the jobcounters table. The job table classes read it through
+    aCTDB.getStateCounts().
+    '''
+
+    def __init__(self, log):
+        aCTDB.__init__(self, log, 'jobcounters')
+
+    def createTables(self):
+        '''
+        jobcounters: number of jobs per table and dimensions
+          - countkey: hash of tablename and the dimensions
+          - tablename: arcjobs, condorjobs or pandajobs
+          - cluster: cluster of arc and condor jobs, siteName of panda jobs
+          - clusterlist: clusterlist of arc and condor jobs
+          - state: arcstate, condorstate or actpandastatus
+          - fairshare: fairshare of arc and condor jobs
+          - njobs: number of jobs
+        Unused dimensions are empty strings. There are up to COUNTERSLOTS
+        rows per dimensions whose njobs add up to the number of jobs, a
+        single row may be negative. Rows are not deleted when njobs drops to
+        0 until the next reconcile().
+        '''
+        c = self.db.getCursor()
+        try:
+            c.execute("DROP TABLE IF EXISTS jobcounters")
+            c.execute("CREATE TABLE jobcounters (%s)" % JOBCOUNTERS)
+            for (name, table, definition) in counterTriggers():
+                c.execute("DROP TRIGGER IF EXISTS %s" % name)
+                self.db.createTrigger(name, definition)
+        except Exception as x:
+            self.log.error("failed create table %s" %x)
+            return False
+        self.reconcile()
+        return True
+
+    def reconcile(self, tables=None):
+        '''
+        Recompute the counters of the given job tables (all if None) from the
+        job tables themselves. Returns the number of counters which were
+        wrong or missing.
+
+        The counts and the counters of a table are compared in one plain
+        select, which reads both in the same snapshot without locking job
+        rows, and only the differences are added to the counters so that
+        changes made by the triggers in the meantime are kept.
+        '''
+        drift = 0
+        dimensions = ', '.join(DIMENSIONS)
+        for table in tables or sorted(COUNTEDTABLES):
+            counted = "SELECT %s, COUNT(*) AS njobs FROM (SELECT %s FROM %s) AS jobs GROUP BY %s" % \
+                      (dimensions, ', '.join(['%s AS %s' % v for v in zip(_values(table), DIMENSIONS)]), table, dimensions)
+            stored = "SELECT %s, -njobs AS njobs FROM jobcounters WHERE tablename=%%s" % dimensions
+            wrong = self.db.fetch(("SELECT %s, SUM(njobs) AS njobs FROM (%s UNION ALL %s) AS counts GROUP BY %s "
+                                   "HAVING SUM(njobs) != 0" % (dimensions, counted, stored, dimensions), [table]))
+            with self.transaction():
+                for row in wrong:
+                    values = [row[d] for d in DIMENSIONS]
+                    n = int(row['njobs'])
+                    self.db.execute(("INSERT INTO jobcounters (countkey, tablename, %s, njobs) "
+                                     "VALUES (SHA1(CONCAT_WS(CHAR(31), %%s, %%s, %%s, %%s, %%s)), %%s, %%s, %%s, %%s, %%s, %%s) "
+                                     "ON DUPLICATE KEY UPDATE njobs=njobs+%%s" % dimensions,
+                                     [table] + values + [table] + values + [n, n]))
+                self.db.execute(aCTDBQuery.delete('jobcounters', {'tablename': table, 'njobs': 0}))
+            if wrong:
+                self.log.warning("Repaired %d job counters of %s" % (len(wrong), table))
+            drift += len(wrong)
+        return drift
@@ -0,0 +1,186 @@
+'''
+Outbox of job state transitions. Triggers on arcjobs and condorjobs append a
+row to jobevents for every new job and every change of arcstate/condorstate,
+in the same transaction as the change itself. Application engines consume the
+events from the last sequence number they acknowledged instead of repeatedly
+scanning the job tables, and can replay them by moving their position back.
+'''
+import datetime
+from act.db.aCTDB import aCTDB
+from act.db import aCTDBQuery
+
+# State column of each table recorded in jobevents
+STATECOLUMNS = {'arcjobs': 'arcstate',
+                'condorjobs': 'condorstate'}
+
+# The application engines select arc and condor jobs joined with pandajobs,
+# so changes of actpandastatus are recorded too, with the pandaid as appjobid
+# and the siteName as cluster
+PANDAEVENTCOLUMNS = ('pandaid', 'siteName', 'actpandastatus')
+
+JOBEVENTS = 'seq BIGINT PRIMARY KEY AUTO_INCREMENT, created DATETIME, tablename VARCHAR(32), ' \
+            'jobid INTEGER, appjobid VARCHAR(255), cluster VARCHAR(255), ' \
+            'oldstate VARCHAR(255), newstate VARCHAR(255)'
+JOBEVENTCONSUMERS = 'consumer VARCHAR(255) PRIMARY KEY, seq BIGINT, modified DATETIME'
+
+
+def _event(table, oldstate, columns=None):
+    (appjobid, cluster, state) = columns or ('appjobid', 'cluster', STATECOLUMNS[table])
+    return "INSERT INTO jobevents (created, tablename, jobid, appjobid, cluster, oldstate, newstate) " \
+           "VALUES (UTC_TIMESTAMP(), '%s', NEW.id, NEW.%s, NEW.%s, %s, NEW.%s)" % \
+           (table, appjobid, cluster, oldstate, state)
+
+def eventTriggers():
+    '''
+    Return a list of (trigger name, table, definition) for the triggers
+    filling jobevents
+    '''
+    triggers = []
+    for table, state in sorted(STATECOLUMNS.items()):
+        triggers.append(('%s_event_insert' % table, table,
+                         'AFTER INSERT ON %s FOR EACH ROW %s' % (table, _event(table, 'NULL'))))
+        triggers.append(('%s_event_update' % table, table,
+                         'AFTER UPDATE ON %s FOR EACH ROW IF NOT (NEW.%s <=> OLD.%s) THEN %s; END IF' %
+                         (table, state, state, _event(table, 'OLD.%s' % state))))
+    state = PANDAEVENTCOLUMNS[2]
+    triggers.append(('pandajobs_event_update', 'pandajobs',
+                     'AFTER UPDATE ON pandajobs FOR EACH ROW IF NOT (NEW.%s <=> OLD.%s) THEN %s; END IF' %
+                     (state, state, _event('pandajobs', 'OLD.%s' % state, PANDAEVENTCOLUMNS))))
+    return triggers
+
+
+class aCTDBEvents(aCTDB):
+    '''
+    Access to the jobevents outbox and the positions of its consumers
+    '''
+
+    def __init__(self, log):
+        aCTDB.__init__(self, log, 'jobevents')
+
+    def createTables(self):
+        '''
+        jobevents: append-only list of job state transitions
+          - seq: sequence number, increasing in insertion order
+          - created: UTC time of the transition
+          - tablename: arcjobs or condorjobs
+          - jobid: id of the job in tablename
+          - appjobid, cluster: of the job at the time of the transition
+          - oldstate: previous arcstate/condorstate, NULL for new jobs
+          - newstate: new arcstate/condorstate
+        jobeventconsumers: position of each consumer of jobevents
+          - consumer: name of the consumer
+          - seq: last sequence number acknowledged by the consumer
+          - modified: time of the last acknowledgement
+        '''
+        c = self.db.getCursor()
+        try:
+            c.execute("DROP TABLE IF EXISTS jobevents")
+            c.execute("CREATE TABLE jobevents (%s)" % JOBEVENTS)
+            c.execute("DROP TABLE IF EXISTS jobeventconsumers")
+            c.execute("CREATE TABLE jobeventconsumers (%s)" % JOBEVENTCONSUMERS)
+            for (name, table, definition) in eventTriggers():
+                c.execute("DROP TRIGGER IF EXISTS %s" % name)
+                self.db.createTrigger(name, definition)
+            self.db.notifyOnInsert('jobevents')
+        except Exception as x:
+            self.log.error("failed create table %s" %x)
+            return False
+        self.Commit()
+        return True
+
+    def getPosition(self, consumer):
+        '''
+        Return the last sequence number acknowledged by consumer. A new
+        consumer starts at the current end of the outbox.
+        '''
+        rows = self.db.fetch(aCTDBQuery.select('jobeventconsumers', ['seq'], {'consumer': consumer}))
+        if rows:
+            return rows[0]['seq']
+        seq = self.getLastSeq()
+        self.setPosition(consumer, seq)
+        return seq
+
+    def getLastSeq(self):
+        '''
+        Return the sequence number of the last event, 0 if there are none
+        '''
+        return self.db.fetch(aCTDBQuery.select('jobevents', ['MAX(seq) AS seq']))[0]['seq'] or 0
+
+    def setPosition(self, consumer, seq):
+        '''
+        Set the position of consumer, either to acknowledge all events up to
+        and including seq or to replay the events after seq
+        '''
+        now = self.getTimeStamp()
+        with self.transaction():
+            self.db.execute(("INSERT INTO jobeventconsumers (consumer, seq, modified) VALUES (%s, %s, %s) "
+                             "ON DUPLICATE KEY UPDATE seq=%s, modified=%s", [consumer, seq, now, seq, now]))
+
+    def getEvents(self, consumer, tables=None, limit=10000, gapwait=60):
+        '''
+        Return (events, seq) with the list of events after the position of
+        consumer, as column: value dictionaries in sequence order, and the
+        sequence number to acknowledge with setPosition() once they are
+        processed. If tables is given only events of those tables are
+        returned.
+
+        Sequence numbers are allocated at insertion but transactions may
+        commit out of order, so reading stops at a gap in the sequence which
+        is followed by an event younger than gapwait seconds. Older gaps are
+        left by rolled back transactions or an auto-increment step above 1
+        and are skipped.
+        '''
+        position = self.getPosition(consumer)
+        settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=gapwait)
+        rows = self.db.fetch(aCTDBQuery.select('jobevents', [], [('seq', '>', position)], orderby='seq', limit=limit))
+        events = []
+        for row in rows:
+            if row['seq'] != position + 1 and row['created'] > settled:
+                break
+            position = row['seq']
+            if not tables or row['tablename'] in tables:
+                events.append(row)
+        return (events, position)
+
+    def getScanPosition(self, consumer, gapwait=60):
+        '''
+        Return the sequence number consumer can acknowledge after a full scan
+        of the job tables started now. The scan covers all committed events,
+        so gaps in the sequence after the position of consumer are skipped,
+        except a gap followed by an event younger than gapwait seconds which
+        may still be filled by a transaction committing after the scan.
+        '''
+        position = self.getPosition(consumer)
+        settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=gapwait)
+        query = aCTDBQuery.select('jobevents', ['seq', 'created'], [('seq', '>', position)], orderby='seq')
+        for rows in self.db.stream(query):
+            for row in rows:
+                if row['seq'] != position + 1 and row['created'] > settled:
+                    return position
+                position = row['seq']
+        return position
+
+    def waitEvents(self, timeout):
+        '''
+        Wait up to timeout seconds for new events. Returns True as soon as
+        events are inserted if the backend supports notifications, see
+        aCTDBMS.notifyOnInsert(), otherwise sleeps for timeout seconds and
+        returns False.
+        '''
+        return self.db.waitNotify('jobevents', timeout)
+
+    def pruneEvents(self, keepdays=7):
+        '''
+        Delete events older than keepdays days which all consumers have
+        acknowledged. Consumers which did not set their position for
+        keepdays days are considered retired and do not hold events back.
+        Returns the number of deleted events.
+        '''
+        rows = self.db.fetch(aCTDBQuery.select('jobeventconsumers', ['MIN(seq) AS seq'],
+                                               [self.timeStampGreaterThanCondition('modified', keepdays*86400)]))
+        if not rows or rows[0]['seq'] is None:
+            return 0
+        with self.transaction():
+            n = self.db.execute(aCTDBQuery.delete('jobevents', [('seq', '<=', rows[0]['seq']),
+                                                                self.timeStampLessThanCondition('created', keepdays*86400)]))
+        return n
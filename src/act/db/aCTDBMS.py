@@ -1,3 +1,8 @@
+import datetime
+import time
+from contextlib import contextmanager
+from act.db import aCTDBQuery
+
 def getDB(log, config):
     '''Factory method for getting specific DB implementation'''
 
@@ -13,6 +18,12 @@ def getDB(log, config):
         supported_dbms['mysql'] = aCTDBMySQL
     except:
         pass
+    try:
+        from .aCTDBPostgres import aCTDBPostgres
+        supported_dbms['postgres'] = aCTDBPostgres
+        supported_dbms['postgresql'] = aCTDBPostgres
+    except:
+        pass
     try:
         from .aCTDBOracle import aCTDBOracle
         supported_dbms['oracle'] = aCTDBOracle
@@ -39,15 +50,190 @@ class aCTDBMS(object):
         self.passwd = str(config.get(('db', 'password')))
         self.host =   str(config.get(('db', 'host')))
         self.port =   str(config.get(('db', 'port')))
+        # connection opened by _connect() of the subclass
+        self.conn = None
+        # depth of nested transaction() blocks and the cursor shared inside them
+        self.txdepth = 0
+        self.txcursor = None
 
-    # Each subclass must implement the 6 methods below
-    def getCursor(self):
-        raise Exception("Method not implemented")
+    @contextmanager
+    def transaction(self):
+        '''
+        Unit of work. Inside the block getCursor() hands out one shared cursor
+        without implicit commits, and the transaction is committed once when
+        the block exits or rolled back if an exception is raised. Nested blocks
+        join the outermost transaction.
+        '''
+        if self.txdepth:
+            self.txdepth += 1
+            try:
+                yield self
+            finally:
+                self.txdepth -= 1
+            return
+
+        self.beginTransaction()
+        self.txdepth = 1
+        try:
+            yield self
+        except:
+            self.txdepth = 0
+            self.txcursor = None
+            self.conn.rollback()
+            raise
+        self.txdepth = 0
+        self.txcursor = None
+        self.conn.commit()
 
+    def inTransaction(self):
+        return self.txdepth > 0
+
+    def beginTransaction(self):
+        '''
+        Called at the start of an outermost transaction() block. By default
+        ends any implicit transaction so the block reads the newest db state.
+        '''
+        self.conn.commit()
+
+    def reconnect(self):
+        '''
+        Drop the current connection and open a new one. Any open transaction
+        is lost.
+        '''
+        self.txdepth = 0
+        self.txcursor = None
+        try:
+            self.conn.close()
+        except Exception as e:
+            self.log.warning("Error closing DB connection: %s" % str(e))
+        self._connect(self.dbname)
+
+    def timeStampBound(self, timediff):
+        '''
+        Return the UTC time timediff seconds ago, formatted like the values
+        written by aCTDB.getTimeStamp()
+        '''
+        bound = datetime.datetime.utcnow() - datetime.timedelta(seconds=int(timediff))
+        return bound.isoformat(timespec='seconds')
+
+    # The time stamp predicates compare the bare column against a bound
+    # computed here rather than applying a function to the column, so that
+    # an index on the column can be used for a range scan
     def timeStampLessThan(self,column,timediff):
-        raise Exception("Method not implemented")
+        return "%s < '%s'" % (column, self.timeStampBound(timediff))
 
     def timeStampGreaterThan(self,column,timediff):
+        return "%s > '%s'" % (column, self.timeStampBound(timediff))
+
+    # Variants for aCTDBQuery, with the bound as parameter so that the
+    # statement stays the same from one call to the next
+    def timeStampLessThanCondition(self, column, timediff):
+        return aCTDBQuery.Raw("%s < %%s" % column, [self.timeStampBound(timediff)])
+
+    def timeStampGreaterThanCondition(self, column, timediff):
+        return aCTDBQuery.Raw("%s > %%s" % column, [self.timeStampBound(timediff)])
+
+    # Execution of (sql, params) tuples built by aCTDBQuery. Backends may
+    # override these to use prepared statements.
+    def fetch(self, query):
+        '''
+        Execute a select and return the list of column: value dictionaries
+        '''
+        c = self.getCursor()
+        c.execute(*query)
+        return c.fetchall()
+
+    def execute(self, query):
+        '''
+        Execute an update or delete and return the number of affected rows.
+        Does not commit.
+        '''
+        c = self.getCursor()
+        c.execute(*query)
+        return c.rowcount
+
+    def insert(self, query):
+        '''
+        Execute an insert and return the id of the new row. Does not commit.
+        '''
+        c = self.getCursor()
+        c.execute(*query)
+        return c.lastrowid
+
+    def insertMany(self, table, columns, rows):
+        '''
+        Insert rows, each a list of values in the order of columns, and
+        return the list of their ids in the same order. Does not commit. By
+        default each row is a separate insert, backends which can return the
+        ids of a multi-row insert do it in one statement.
+        '''
+        row = '(%s)' % ','.join(['%s'] * len(columns))
+        sql = "INSERT INTO %s (%s) VALUES %s" % (table, ', '.join(columns), row)
+        return [self.insert((sql, list(r))) for r in rows]
+
+    def stream(self, query, chunksize=1000):
+        '''
+        Generator of lists of at most chunksize column: value dictionaries
+        for the rows of a select, read with fetchmany() so that the whole
+        result is never held in memory. Statements may be executed between
+        chunks, backends whose cursors do not keep a consistent result while
+        its table is updated read from a separate connection.
+        '''
+        c = self.getCursor()
+        c.execute(*query)
+        while True:
+            rows = c.fetchmany(chunksize)
+            if not rows:
+                return
+            yield rows
+
+    def getColumns(self, table):
+        '''
+        Return the list of column names of table
+        '''
+        c = self.getCursor()
+        c.execute("SELECT * FROM %s LIMIT 0" % table)
+        c.fetchall()
+        return [col[0] for col in c.description]
+
+    def createTrigger(self, name, definition):
+        '''
+        Create a trigger from a definition in MySQL syntax, i.e. everything
+        after CREATE TRIGGER name. Backends with another trigger syntax
+        translate it.
+        '''
+        c = self.getCursor()
+        c.execute("CREATE TRIGGER %s %s" % (name, definition))
+
+    def skipLocked(self):
+        '''
+        Clause appended to a select so that rows locked by other transactions
+        are skipped instead of waited for. Empty if not supported.
+        '''
+        return ""
+
+    def notifyOnInsert(self, table):
+        '''
+        Notify the listeners of waitNotify(table) when rows are inserted into
+        table, using a trigger named <table>_notify. Does nothing on backends
+        without notifications.
+        '''
+        pass
+
+    def waitNotify(self, channel, timeout):
+        '''
+        Wait up to timeout seconds for a notification on channel, see
+        notifyOnInsert(). Returns True if one arrived. Backends without
+        notifications sleep for timeout seconds and return False.
+        '''
+        time.sleep(timeout)
+        return False
+
+    # Each subclass must implement the methods below
+    def _connect(self, dbname=None):
+        raise Exception("Method not implemented")
+
+    def getCursor(self):
         raise Exception("Method not implemented")
 
     def addLock(self):
@@ -56,5 +242,66 @@ class aCTDBMS(object):
     def getMutexLock(self, lock_name, timeout=2):
         raise Exception("Method not implemented")
 
+    def unlockTables(self):
+        '''
+        Release the table locks of this connection
+        '''
+        raise Exception("Method not implemented")
+
     def releaseMutexLock(self, lock_name):
         raise Exception("Method not implemented")
+
+    # Schema introspection used by migrations and the index advisor
+    def tableExists(self, table):
+        raise Exception("Method not implemented")
+
+    def indexExists(self, table, index):
+        raise Exception("Method not implemented")
+
+    def columnExists(self, table, column):
+        raise Exception("Method not implemented")
+
+    def triggerExists(self, trigger):
+        raise Exception("Method not implemented")
+
+    def fullScans(self, query):
+        '''
+        Return the list of tables which would be fully scanned by query
+        '''
+        raise Exception("Method not implemented")
+
+    def partitionByState(self, table, column, hot, cold):
+        '''
+        Split table into a hot and a cold partition by the value of the state
+        column, hot and cold being the lists of states of each side. Rows
+        move between the partitions when their state changes.
+        '''
+        raise Exception("Method not implemented")
+
+    # Monthly range partitioning of archive tables. Partitions are named
+    # pYYYYMM after the first day of the month (a datetime.date) they hold.
+    def getPartitions(self, table):
+        '''
+        Return the list of monthly partition names of table, empty if the
+        table is not partitioned
+        '''
+        raise Exception("Method not implemented")
+
+    def partitionByMonth(self, table, column, months):
+        '''
+        Partition table by month of the timestamp column, with one partition
+        for each month in months and one for anything later
+        '''
+        raise Exception("Method not implemented")
+
+    def addMonthPartition(self, table, month):
+        '''
+        Add the partition for month to a table partitioned by partitionByMonth()
+        '''
+        raise Exception("Method not implemented")
+
+    def dropPartition(self, table, name):
+        '''
+        Drop a partition and all rows in it
+        '''
+        raise Exception("Method not implemented")
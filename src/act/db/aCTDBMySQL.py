@@ -1,12 +1,23 @@
+from collections import OrderedDict
+import datetime
 import mysql.connector as mysql
 from act.common import aCTUtils
+from act.db import aCTDBQuery
 from act.db.aCTDBMS import aCTDBMS
 
 class aCTDBMySQL(aCTDBMS):
     """Class for MySQL specific db operations."""
 
+    # Maximum number of prepared statements kept open per connection. The
+    # server limits the total over all connections (max_prepared_stmt_count)
+    stmtcachesize = 64
+    # Seconds the server waits for a stream() consumer to read more rows
+    streamtimeout = 3600
+
     def __init__(self, log, config):
         aCTDBMS.__init__(self, log, config)
+        # separate connection for stream(), opened on first use
+        self.streamconn = None
         # mysql.connector must be 8.
         if mysql.__version_info__[0] != 8:
             raise Exception("mysql-connector must be version 8.x")
@@ -22,45 +33,154 @@ class aCTDBMySQL(aCTDBMS):
             c.execute("CREATE DATABASE "+self.dbname)
             self._connect(self.dbname)
 
+        # SKIP LOCKED is available from MySQL 8.0.1 and MariaDB 10.6
+        if 'MariaDB' in self.conn.get_server_info():
+            self.hasskiplocked = self.conn.get_server_version() >= (10, 6)
+        else:
+            self.hasskiplocked = self.conn.get_server_version() >= (8, 0, 1)
+        # With the traditional and consecutive auto-increment lock modes a
+        # multi-row insert gets consecutive ids, not with the interleaved one.
+        # Consecutive ids are auto_increment_increment apart, which is more
+        # than 1 e.g. in multi-master setups.
+        c = self.conn.cursor()
+        c.execute("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment")
+        (lockmode, self.autoincrement) = c.fetchone()
+        self.consecutiveids = lockmode in (0, 1)
+        c.close()
+
         self.log.debug("initialized aCTDBMySQL")
 
     def _connect(self, dbname=None):
+        # prepared statements belong to the connection, start a new cache
+        self.stmtcache = OrderedDict()
+        self.conn = self._newConnection(dbname)
+
+    def _newConnection(self, dbname=None, **kwargs):
         if self.socket != 'None':
-            self.conn = mysql.connect(unix_socket=self.socket, database=dbname)
+            return mysql.connect(unix_socket=self.socket, database=dbname, **kwargs)
         elif self.user and self.passwd:
             if self.host != 'None' and self.port != 'None':
-                self.conn = mysql.connect(user=self.user, password=self.passwd, host=self.host, port=self.port, database=dbname)
+                return mysql.connect(user=self.user, password=self.passwd, host=self.host, port=self.port, database=dbname, **kwargs)
             else:
-                self.conn = mysql.connect(user=self.user, password=self.passwd, db=dbname)
+                return mysql.connect(user=self.user, password=self.passwd, db=dbname, **kwargs)
+        return None
 
-    def getCursor(self):
-        # make sure cursor reads newest db state
+    def beginTransaction(self):
         try:
             self.conn.commit()
         except mysql.errors.InternalError as e:
             # Unread result, force reconnection
             self.log.warning(str(e))
-            self.conn.close()
-            self._connect(self.dbname)
+            self.reconnect()
+        except (mysql.errors.OperationalError, mysql.errors.InterfaceError) as e:
+            # Connection lost, e.g. server restart or wait_timeout expired
+            self.log.warning("Lost DB connection, reconnecting: %s" % str(e))
+            self.reconnect()
+
+    def getCursor(self):
+        # inside a transaction reuse the same cursor and do not commit
+        if self.txdepth:
+            if self.txcursor is None:
+                self.txcursor = self._newCursor(buffered=True)
+            return self.txcursor
+
+        # make sure cursor reads newest db state
+        self.beginTransaction()
+        return self._newCursor()
 
+    def _newCursor(self, buffered=False):
         for _ in range(3):
             try:
-                cur = self.conn.cursor(dictionary=True)
+                cur = self.conn.cursor(dictionary=True, buffered=buffered)
                 return cur
             except mysql.errors.OperationalError as err:
                 self.log.warning("Error getting cursor: %s" % str(err))
                 aCTUtils.sleep(1)
         raise Exception("Could not get cursor")
 
-    def timeStampLessThan(self,column,timediff):
-        return "UNIX_TIMESTAMP("+column+") < UNIX_TIMESTAMP(UTC_TIMESTAMP()) - "+str(timediff)
+    def _preparedCursor(self, sql):
+        '''
+        Return a prepared cursor for sql from the statement cache, preparing
+        it on first use. The least recently used statement is closed when the
+        cache is full.
+        '''
+        if not self.txdepth:
+            # make sure cursor reads newest db state
+            self.beginTransaction()
+        cur = self.stmtcache.pop(sql, None)
+        if cur is None:
+            if len(self.stmtcache) >= self.stmtcachesize:
+                _, old = self.stmtcache.popitem(last=False)
+                old.close()
+            cur = self.conn.cursor(prepared=True)
+        self.stmtcache[sql] = cur
+        return cur
 
-    def timeStampGreaterThan(self,column,timediff):
-        return "UNIX_TIMESTAMP("+column+") > UNIX_TIMESTAMP(UTC_TIMESTAMP()) - "+str(timediff)
+    def fetch(self, query):
+        sql, params = query
+        cur = self._preparedCursor(sql)
+        cur.execute(sql, params)
+        return [dict(zip(cur.column_names, row)) for row in cur.fetchall()]
+
+    def execute(self, query):
+        sql, params = query
+        cur = self._preparedCursor(sql)
+        cur.execute(sql, params)
+        return cur.rowcount
+
+    def insert(self, query):
+        sql, params = query
+        cur = self._preparedCursor(sql)
+        cur.execute(sql, params)
+        return cur.lastrowid
+
+    def insertMany(self, table, columns, rows):
+        '''
+        One multi-row insert if the ids it assigns are consecutive, otherwise
+        one prepared insert per row
+        '''
+        if not self.consecutiveids or not rows:
+            return aCTDBMS.insertMany(self, table, columns, rows)
+        c = self.getCursor()
+        c.execute(*aCTDBQuery.insertMany(table, columns, rows))
+        # lastrowid is the id of the first inserted row
+        return list(range(c.lastrowid, c.lastrowid + len(rows) * self.autoincrement, self.autoincrement))
+
+    def stream(self, query, chunksize=1000):
+        '''
+        Rows are read with an unbuffered cursor on a separate connection, so
+        the server streams the result while the main connection stays free
+        for the statements issued between chunks. The stream connection
+        reads a consistent snapshot taken when the select starts.
+        '''
+        if self.streamconn is None or not self.streamconn.is_connected():
+            self.streamconn = self._newConnection(self.dbname, consume_results=True)
+            c = self.streamconn.cursor()
+            # the consumer may take long to process a chunk
+            c.execute("SET SESSION net_write_timeout=%d" % self.streamtimeout)
+            c.close()
+        # make sure the select reads newest db state
+        self.streamconn.commit()
+        c = self.streamconn.cursor(dictionary=True)
+        try:
+            c.execute(*query)
+            while True:
+                rows = c.fetchmany(chunksize)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            c.close()
+            self.streamconn.commit()
 
     def addLock(self):
         return " FOR UPDATE"
 
+    def skipLocked(self):
+        if self.hasskiplocked:
+            return " FOR UPDATE SKIP LOCKED"
+        return ""
+
     def getMutexLock(self, lock_name, timeout=2):
         """
         Function to get named lock. Returns 1 if lock was obtained, 0 if attempt timed out, None if error occured.
@@ -70,6 +190,73 @@ class aCTDBMySQL(aCTDBMS):
         c.execute("SELECT "+select)
         return c.fetchone()[select]
 
+    def tableExists(self, table):
+        c=self.getCursor()
+        c.execute("SHOW TABLES LIKE %s", [table])
+        return c.fetchone() is not None
+
+    def indexExists(self, table, index):
+        c=self.getCursor()
+        c.execute("SHOW INDEX FROM "+table+" WHERE Key_name=%s", [index])
+        return len(c.fetchall()) > 0
+
+    def columnExists(self, table, column):
+        c=self.getCursor()
+        c.execute("SHOW COLUMNS FROM "+table+" LIKE %s", [column])
+        return len(c.fetchall()) > 0
+
+    def triggerExists(self, trigger):
+        c=self.getCursor()
+        c.execute("SHOW TRIGGERS WHERE `Trigger`=%s", [trigger])
+        return len(c.fetchall()) > 0
+
+    def fullScans(self, query):
+        c=self.getCursor()
+        c.execute("EXPLAIN "+query)
+        return [row['table'] for row in c.fetchall() if row['type'] == 'ALL']
+
+    def _monthPartition(self, month):
+        # partition holding rows before the first day of the following month
+        nextmonth = (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return "PARTITION p%s VALUES LESS THAN (UNIX_TIMESTAMP('%s'))" % (month.strftime('%Y%m'), nextmonth.isoformat())
+
+    def getPartitions(self, table):
+        rows = self.fetch(("SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS "
+                           "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND PARTITION_NAME IS NOT NULL "
+                           "ORDER BY PARTITION_ORDINAL_POSITION", [table]))
+        return [row['name'] for row in rows if row['name'] != 'pmax']
+
+    def partitionByMonth(self, table, column, months):
+        # TIMESTAMP columns can only be partitioned on UNIX_TIMESTAMP()
+        partitions = [self._monthPartition(m) for m in sorted(months)]
+        partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        c=self.getCursor()
+        c.execute("ALTER TABLE %s PARTITION BY RANGE (UNIX_TIMESTAMP(%s)) (%s)" % (table, column, ', '.join(partitions)))
+
+    def addMonthPartition(self, table, month):
+        c=self.getCursor()
+        c.execute("ALTER TABLE %s REORGANIZE PARTITION pmax INTO (%s, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+                  % (table, self._monthPartition(month)))
+
+    def dropPartition(self, table, name):
+        c=self.getCursor()
+        c.execute("ALTER TABLE %s DROP PARTITION %s" % (table, name))
+
+    def partitionByState(self, table, column, hot, cold):
+        # every unique key of a partitioned table must contain the partitioning
+        # column, so the primary key becomes (id, state) and the state column
+        # may no longer be NULL
+        c=self.getCursor()
+        c.execute("UPDATE %s SET %s='' WHERE %s IS NULL" % (table, column, column))
+        c.execute("ALTER TABLE %s MODIFY %s VARCHAR(255) NOT NULL DEFAULT '', DROP PRIMARY KEY, ADD PRIMARY KEY (id, %s)"
+                  % (table, column, column))
+        c.execute("ALTER TABLE %s PARTITION BY LIST COLUMNS (%s) (PARTITION hot VALUES IN (%s), PARTITION cold VALUES IN (%s))"
+                  % (table, column, ', '.join(["'%s'" % s for s in hot]), ', '.join(["'%s'" % s for s in cold])))
+
+    def unlockTables(self):
+        c=self.getCursor()
+        c.execute("UNLOCK TABLES")
+
     def releaseMutexLock(self, lock_name):
         """
         Function to release named lock. Returns 1 if lock was released, 0 if someone else owns the lock, None if error occured.
@@ -0,0 +1,479 @@
+import os
+import re
+import select
+import time
+import psycopg2
+import psycopg2.extensions
+from act.db import aCTDBQuery
+from act.db.aCTDBMS import aCTDBMS
+
+# aCT writes booleans to SMALLINT flag columns, which MySQL accepts
+psycopg2.extensions.register_adapter(bool, lambda b: psycopg2.extensions.AsIs(int(b)))
+
+# MySQL column types used in aCT table definitions and their equivalents
+COLUMNTYPES = [(r'\b(MEDIUM|LONG|TINY)TEXT\b', 'TEXT'),
+               (r'\b(MEDIUM|LONG|TINY)?BLOB\b', 'BYTEA'),
+               (r'\bTINYINT(\(\d+\))?', 'SMALLINT'),
+               (r'\bINT\(\d+\)', 'INTEGER'),
+               (r'\bDATETIME\b', 'TIMESTAMP'),
+               # there is no zero time stamp
+               (r'\bTIMESTAMP\s+DEFAULT\s+0\b', 'TIMESTAMP')]
+
+# Words starting a table constraint rather than a column definition
+CONSTRAINTS = ('PRIMARY', 'UNIQUE', 'KEY', 'INDEX', 'CONSTRAINT', 'FOREIGN', 'CHECK')
+
+# String literals and identifiers of a statement
+TOKENS = re.compile(r"'(?:[^']|'')*'|\b[A-Za-z_]\w*\b")
+
+
+def _replaceCall(sql, name, template):
+    '''
+    Replace every call name(args) in sql by template % args
+    '''
+    call = re.compile(r'\b%s\(' % name, re.I)
+    m = call.search(sql)
+    while m:
+        depth, i = 1, m.end()
+        while depth:
+            depth += {'(': 1, ')': -1}.get(sql[i], 0)
+            i += 1
+        sql = sql[:m.start()] + template % sql[m.end():i-1] + sql[i:]
+        m = call.search(sql)
+    return sql
+
+def _splitColumns(body):
+    '''
+    Split the body of a CREATE TABLE statement at top level commas
+    '''
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(body):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            parts.append(body[start:i])
+            start = i + 1
+    parts.append(body[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+class aCTPostgresCursor(object):
+    '''
+    Cursor translating the MySQL dialect of aCT statements (see
+    aCTDBPostgres.translate()) and returning rows as column: value
+    dictionaries with the column names in the case aCT uses
+    '''
+
+    def __init__(self, db, cursor):
+        self.db = db
+        self.cursor = cursor
+        self.keys = None
+
+    def execute(self, sql, params=None):
+        statement, names = self.db.translate(sql)
+        try:
+            self.cursor.execute(statement, params)
+            self.db.recordColumns(self.cursor, statement)
+        except psycopg2.Error:
+            # a failed statement aborts the transaction, outside transaction
+            # blocks roll it back so that the connection stays usable
+            if not self.db.txdepth:
+                self.db.conn.rollback()
+            raise
+        self._setKeys(names)
+
+    def executemany(self, sql, seq):
+        statement, names = self.db.translate(sql)
+        try:
+            self.cursor.executemany(statement, seq)
+        except psycopg2.Error:
+            if not self.db.txdepth:
+                self.db.conn.rollback()
+            raise
+        self._setKeys(names)
+
+    def _setKeys(self, names):
+        if self.cursor.description is None:
+            self.keys = None
+        else:
+            self.keys = [names.get(col.name, col.name) for col in self.cursor.description]
+
+    def _row(self, row):
+        if row is None:
+            return None
+        return dict(zip(self.keys, [bytes(v) if isinstance(v, memoryview) else v for v in row]))
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+    def fetchmany(self, size):
+        return [self._row(row) for row in self.cursor.fetchmany(size)]
+
+    @property
+    def description(self):
+        if self.cursor.description is None:
+            return None
+        return [(key,) + tuple(col[1:]) for key, col in zip(self.keys, self.cursor.description)]
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        for row in self.cursor:
+            yield self._row(row)
+
+
+class aCTDBPostgres(aCTDBMS):
+    """Class for PostgreSQL specific db operations."""
+
+    # Maximum number of translated statements kept, see translate()
+    statementcachesize = 2000
+
+    def __init__(self, log, config):
+        aCTDBMS.__init__(self, log, config)
+        # separate connection for stream(), opened on first use
+        self.streamconn = None
+        self.nstreams = 0
+        # translate() results and the catalog information they use
+        self.statements = {}
+        self.primarykeys = {}
+        self.columnnames = {}
+        try:
+            self._connect(self.dbname)
+        except psycopg2.OperationalError as err:
+            # if db doesnt exist, create it
+            if 'does not exist' not in str(err):
+                raise err
+            self.log.warning("Database doesn't exist, will try to create it")
+            conn = self._newConnection('postgres')
+            conn.autocommit = True
+            conn.cursor().execute("CREATE DATABASE "+self.dbname)
+            conn.close()
+            self._connect(self.dbname)
+
+        self.log.debug("initialized aCTDBPostgres")
+
+    def _connect(self, dbname):
+        self.conn = self._newConnection(dbname)
+        # channels this connection listens on, see waitNotify()
+        self.listening = set()
+        # PostgreSQL folds unquoted names to lower case, the names as written
+        # in the table definitions are kept in columnnames so that rows use
+        # the same keys as with MySQL
+        c = self.conn.cursor()
+        try:
+            c.execute("CREATE TABLE IF NOT EXISTS columnnames (tablename VARCHAR(64), name VARCHAR(255), "
+                      "PRIMARY KEY (tablename, name))")
+            self.conn.commit()
+        except psycopg2.Error:
+            # created concurrently by another process
+            self.conn.rollback()
+
+    def _newConnection(self, dbname):
+        kwargs = {'dbname': dbname}
+        if self.socket != 'None':
+            # libpq takes the directory of the socket
+            kwargs['host'] = self.socket if os.path.isdir(self.socket) else os.path.dirname(self.socket)
+        elif self.host != 'None':
+            kwargs['host'] = self.host
+        if self.port != 'None':
+            kwargs['port'] = self.port
+        if self.user != 'None':
+            kwargs['user'] = self.user
+        if self.passwd != 'None':
+            kwargs['password'] = self.passwd
+        return psycopg2.connect(**kwargs)
+
+    def beginTransaction(self):
+        try:
+            self.conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Connection lost, e.g. server restart
+            self.log.warning("Lost DB connection, reconnecting: %s" % str(e))
+            self.reconnect()
+
+    def getCursor(self):
+        # inside a transaction reuse the same cursor and do not commit
+        if self.txdepth:
+            if self.txcursor is None:
+                self.txcursor = aCTPostgresCursor(self, self.conn.cursor())
+            return self.txcursor
+
+        # make sure cursor reads newest db state
+        self.beginTransaction()
+        return aCTPostgresCursor(self, self.conn.cursor())
+
+    def _primaryKey(self, table):
+        if table not in self.primarykeys:
+            c = self.conn.cursor()
+            c.execute("SELECT a.attname FROM pg_index i JOIN pg_attribute a "
+                      "ON a.attrelid=i.indrelid AND a.attnum=ANY(i.indkey) "
+                      "WHERE i.indrelid=%s::regclass AND i.indisprimary", [table.lower()])
+            self.primarykeys[table] = [row[0] for row in c.fetchall()]
+        return self.primarykeys[table]
+
+    def _columnNames(self, table):
+        table = table.lower()
+        if table not in self.columnnames:
+            c = self.conn.cursor()
+            c.execute("SELECT name FROM columnnames WHERE tablename=%s", [table])
+            self.columnnames[table] = dict((row[0].lower(), row[0]) for row in c.fetchall())
+        return self.columnnames[table]
+
+    def translate(self, sql):
+        '''
+        Translate a statement written for MySQL, as issued throughout aCT, to
+        PostgreSQL: AUTO_INCREMENT keys and column types in table definitions,
+        ON DUPLICATE KEY UPDATE, the null-safe <=> operator and the MySQL
+        functions used by aCT. Returns the statement and a dictionary mapping
+        the lower case column names of its result to the names aCT expects.
+        '''
+        if sql in self.statements:
+            return self.statements[sql]
+        statement = sql
+        if re.match(r'\s*(create|alter)\s+table', statement, re.I):
+            statement = re.sub(r'\b(\w+)(\(\d+\))?\s+PRIMARY\s+KEY\s+AUTO_INCREMENT',
+                               lambda m: ('BIGSERIAL' if m.group(1).upper() == 'BIGINT' else 'SERIAL') + ' PRIMARY KEY',
+                               statement, flags=re.I)
+            for (mysqltype, pgtype) in COLUMNTYPES:
+                statement = re.sub(mysqltype, pgtype, statement, flags=re.I)
+        else:
+            statement = re.sub(r'\bCHAR\((\d+)\)', r'CHR(\1)', statement, flags=re.I)
+        statement = re.sub(r'\bIFNULL\(', 'COALESCE(', statement, flags=re.I)
+        statement = re.sub(r'\bUTC_TIMESTAMP\(\)', "CAST(NOW() AT TIME ZONE 'UTC' AS TIMESTAMP(0))", statement, flags=re.I)
+        statement = _replaceCall(statement, 'SHA1', "SUBSTR(ENCODE(SHA256(CONVERT_TO(%s, 'UTF8')), 'hex'), 1, 40)")
+        statement = statement.replace('<=>', 'IS NOT DISTINCT FROM')
+        m = re.search(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', statement, re.I)
+        if m:
+            table = re.findall(r'\bINSERT\s+INTO\s+(\w+)', statement[:m.start()], re.I)[-1]
+            statement = statement[:m.start()] + "ON CONFLICT (%s) DO UPDATE SET" % ', '.join(self._primaryKey(table)) + \
+                        statement[m.end():]
+        # triggers are created with a function of the same name, see
+        # createTrigger(), and dropping the function drops the trigger
+        statement = re.sub(r'^\s*DROP\s+TRIGGER\s+IF\s+EXISTS\s+(\w+)\s*$', r'DROP FUNCTION IF EXISTS \1() CASCADE',
+                           statement, flags=re.I)
+
+        # MySQL returns columns of "SELECT *" as defined and everything else
+        # as written in the statement
+        names = {}
+        for tables in re.findall(r'\b(?:FROM|JOIN|INTO)\s+(\w+)|^\s*UPDATE\s+(\w+)', sql, re.I):
+            names.update(self._columnNames(''.join(tables)))
+        for token in TOKENS.findall(sql):
+            if not token.startswith("'") and token != token.lower() and token != token.upper():
+                names[token.lower()] = token
+
+        if len(self.statements) >= self.statementcachesize:
+            self.statements.clear()
+        self.statements[sql] = (statement, names)
+        return (statement, names)
+
+    def recordColumns(self, cursor, statement):
+        '''
+        Record the names of the columns added by a CREATE TABLE or ALTER
+        TABLE ADD statement in columnnames
+        '''
+        m = re.match(r'\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*)\)\s*$', statement, re.I | re.S)
+        if m:
+            table = m.group(1).lower()
+            columns = [d.split()[0] for d in _splitColumns(m.group(2)) if d.split()[0].upper() not in CONSTRAINTS]
+            cursor.execute("DELETE FROM columnnames WHERE tablename=%s", [table])
+        else:
+            m = re.match(r'\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+(?:COLUMN\s+)?(\w+)', statement, re.I)
+            if not m:
+                return
+            table = m.group(1).lower()
+            columns = [m.group(2)]
+        for column in columns:
+            if column != column.lower():
+                cursor.execute("INSERT INTO columnnames (tablename, name) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                               [table, column])
+        self.statements.clear()
+        self.columnnames.pop(table, None)
+        self.primarykeys.pop(table, None)
+
+    def insert(self, query):
+        # lastrowid is not the id of the new row
+        sql, params = query
+        c = self.getCursor()
+        c.execute(sql + " RETURNING id", params)
+        return c.fetchone()['id']
+
+    def insertMany(self, table, columns, rows):
+        # RETURNING gives the ids in the order of the VALUES list
+        if not rows:
+            return []
+        sql, params = aCTDBQuery.insertMany(table, columns, rows)
+        c = self.getCursor()
+        c.execute(sql + " RETURNING id", params)
+        return [row['id'] for row in c.fetchall()]
+
+    def stream(self, query, chunksize=1000):
+        '''
+        Rows are read with a server side cursor on a separate connection, so
+        only chunksize rows at a time are transferred while the main
+        connection stays free for the statements issued between chunks. The
+        stream connection reads a consistent snapshot taken when the select
+        starts.
+        '''
+        if self.streamconn is None or self.streamconn.closed:
+            self.streamconn = self._newConnection(self.dbname)
+        # make sure the select reads newest db state
+        self.streamconn.commit()
+        sql, params = query
+        statement, names = self.translate(sql)
+        self.nstreams += 1
+        c = self.streamconn.cursor(name='actstream%d' % self.nstreams)
+        try:
+            c.execute(statement, params)
+            while True:
+                rows = c.fetchmany(chunksize)
+                if not rows:
+                    return
+                keys = [names.get(col.name, col.name) for col in c.description]
+                yield [dict(zip(keys, [bytes(v) if isinstance(v, memoryview) else v for v in row])) for row in rows]
+        finally:
+            c.close()
+            self.streamconn.commit()
+
+    def _executeRaw(self, statements):
+        # statements which are already in PostgreSQL syntax
+        c = self.conn.cursor()
+        try:
+            for statement in statements:
+                c.execute(statement)
+        except psycopg2.Error:
+            if not self.txdepth:
+                self.conn.rollback()
+            raise
+
+    def createTrigger(self, name, definition):
+        # the statements after FOR EACH ROW, including any IF ... THEN ...
+        # END IF, become the body of a PL/pgSQL function of the same name
+        head, body = re.split(r'(?<=FOR EACH ROW)\s+', definition, maxsplit=1)
+        body = self.translate(body)[0].rstrip(' ;')
+        self._executeRaw(["CREATE OR REPLACE FUNCTION %s() RETURNS trigger LANGUAGE plpgsql AS "
+                          "$$ BEGIN %s; RETURN NULL; END $$" % (name, body),
+                          "CREATE TRIGGER %s %s EXECUTE FUNCTION %s()" % (name, head, name)])
+
+    def notifyOnInsert(self, table):
+        name = '%s_notify' % table
+        self._executeRaw(["CREATE OR REPLACE FUNCTION %s() RETURNS trigger LANGUAGE plpgsql AS "
+                          "$$ BEGIN PERFORM pg_notify('%s', ''); RETURN NULL; END $$" % (name, table),
+                          "DROP TRIGGER IF EXISTS %s ON %s" % (name, table),
+                          "CREATE TRIGGER %s AFTER INSERT ON %s FOR EACH STATEMENT EXECUTE FUNCTION %s()"
+                          % (name, table, name)])
+
+    def _takeNotifies(self, channel):
+        notified = [n for n in self.conn.notifies if n.channel == channel]
+        self.conn.notifies[:] = [n for n in self.conn.notifies if n.channel != channel]
+        return len(notified) > 0
+
+    def waitNotify(self, channel, timeout):
+        if channel not in self.listening:
+            self._executeRaw(["LISTEN %s" % channel])
+            self.listening.add(channel)
+        deadline = time.time() + timeout
+        # notifications are only delivered between transactions
+        self.conn.commit()
+        while not self._takeNotifies(channel):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            if select.select([self.conn], [], [], remaining) != ([], [], []):
+                self.conn.poll()
+        return True
+
+    def addLock(self):
+        return " FOR UPDATE"
+
+    def skipLocked(self):
+        return " FOR UPDATE SKIP LOCKED"
+
+    def getMutexLock(self, lock_name, timeout=2):
+        """
+        Named lock implemented with a session level advisory lock. Returns 1
+        if the lock was obtained, 0 if the attempt timed out, None if an error
+        occurred.
+        """
+        deadline = time.time() + timeout
+        try:
+            c = self.getCursor()
+            while True:
+                c.execute("SELECT pg_try_advisory_lock(hashtext(%s)) AS locked", [lock_name])
+                if c.fetchone()['locked']:
+                    return 1
+                if time.time() >= deadline:
+                    return 0
+                time.sleep(0.1)
+        except psycopg2.Error as e:
+            self.log.error("Could not lock %s: %s" % (lock_name, str(e)))
+            return None
+
+    def releaseMutexLock(self, lock_name):
+        """
+        Release a lock taken with getMutexLock(). Returns 1 if the lock was
+        released, 0 if this session does not hold it.
+        """
+        c = self.getCursor()
+        c.execute("SELECT pg_advisory_unlock(hashtext(%s)) AS released", [lock_name])
+        return 1 if c.fetchone()['released'] else 0
+
+    def unlockTables(self):
+        # aCT takes no table locks in PostgreSQL
+        return
+
+    def tableExists(self, table):
+        c = self.getCursor()
+        c.execute("SELECT table_name FROM information_schema.tables "
+                  "WHERE table_schema=current_schema() AND table_name=%s", [table.lower()])
+        return c.fetchone() is not None
+
+    def indexExists(self, table, index):
+        c = self.getCursor()
+        c.execute("SELECT indexname FROM pg_indexes "
+                  "WHERE schemaname=current_schema() AND tablename=%s AND indexname=%s", [table.lower(), index.lower()])
+        return c.fetchone() is not None
+
+    def columnExists(self, table, column):
+        c = self.getCursor()
+        c.execute("SELECT column_name FROM information_schema.columns "
+                  "WHERE table_schema=current_schema() AND table_name=%s AND column_name=%s", [table.lower(), column.lower()])
+        return c.fetchone() is not None
+
+    def triggerExists(self, trigger):
+        c = self.getCursor()
+        c.execute("SELECT tgname FROM pg_trigger WHERE tgname=%s AND NOT tgisinternal", [trigger.lower()])
+        return c.fetchone() is not None
+
+    def fullScans(self, query):
+        c = self.getCursor()
+        c.execute("EXPLAIN (FORMAT JSON) "+query)
+        plans = [c.fetchone()['QUERY PLAN'][0]['Plan']]
+        scans = []
+        while plans:
+            plan = plans.pop()
+            if plan['Node Type'] == 'Seq Scan':
+                scans.append(plan['Relation Name'])
+            plans.extend(plan.get('Plans', []))
+        return scans
+
+    # Tables are not partitioned, declarative partitions cannot be attached
+    # to the existing job tables in place
+    def getPartitions(self, table):
+        return []
+
+    def partitionByMonth(self, table, column, months):
+        self.log.debug("Partitioning is not implemented for PostgreSQL, %s is not partitioned" % table)
+
+    def addMonthPartition(self, table, month):
+        self.log.debug("Partitioning is not implemented for PostgreSQL, %s is not partitioned" % table)
+
+    def dropPartition(self, table, name):
+        self.log.debug("Partitioning is not implemented for PostgreSQL, %s is not partitioned" % table)
+
+    def partitionByState(self, table, column, hot, cold):
+        self.log.debug("Partitioning is not implemented for PostgreSQL, %s is not partitioned" % table)
@@ -0,0 +1,156 @@
+'''
+Small query builder for the aCT tables. Every function returns a tuple of
+(sql, params) where all values are passed as %s placeholders, so statements
+can be prepared once per connection and reused (see aCTDBMS.fetch() and
+aCTDBMS.execute()).
+
+Conditions (the where argument) can be given as
+  - a dict of column: value, all combined with AND
+  - a list of conditions, combined with AND, each of which is
+      (column, value)
+      (column, operator, value), e.g. ('tarcstate', '<', bound)
+      Raw(sql, params) for anything more complex, e.g. OR clauses
+A value which is a list, tuple or set becomes an IN (...) list, and None
+becomes IS NULL (or IS NOT NULL with the != operator).
+'''
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'like', 'not like')
+
+
+class Raw:
+    '''Literal SQL fragment with its own %s parameters'''
+
+    def __init__(self, sql, params=[]):
+        self.sql = sql
+        self.params = list(params)
+
+
+def _condition(column, op, value):
+    if op not in OPERATORS:
+        raise Exception("Unsupported operator %s" % op)
+    if value is None:
+        if op not in ('=', '!='):
+            raise Exception("Cannot compare %s to NULL with %s" % (column, op))
+        return ("%s IS %sNULL" % (column, 'NOT ' if op == '!=' else ''), [])
+    if isinstance(value, (list, tuple, set)):
+        value = list(value)
+        if op not in ('=', '!='):
+            raise Exception("Cannot compare %s to a list with %s" % (column, op))
+        if not value:
+            # IN () is invalid SQL, an empty list matches nothing
+            return ("1=0" if op == '=' else "1=1", [])
+        return ("%s %sIN (%s)" % (column, 'NOT ' if op == '!=' else '', ','.join(['%s'] * len(value))), value)
+    return ("%s %s %%s" % (column, op), [value])
+
+
+def where(conditions):
+    '''
+    Return (sql, params) for the given conditions, without the WHERE keyword.
+    sql is empty if there are no conditions.
+    '''
+    if not conditions:
+        return ('', [])
+    if isinstance(conditions, Raw):
+        conditions = [conditions]
+    elif isinstance(conditions, dict):
+        conditions = list(conditions.items())
+
+    clauses = []
+    params = []
+    for cond in conditions:
+        if isinstance(cond, Raw):
+            sql, p = cond.sql, cond.params
+        elif len(cond) == 2:
+            sql, p = _condition(cond[0], '=', cond[1])
+        else:
+            sql, p = _condition(cond[0], cond[1].lower(), cond[2])
+        clauses.append(sql)
+        params.extend(p)
+    return (' AND '.join(clauses), params)
+
+
+def _where(conditions):
+    sql, params = where(conditions)
+    return (' WHERE ' + sql if sql else '', params)
+
+
+def select(table, columns=None, conditions=None, join=None, groupby=None, orderby=None, limit=None, lock=''):
+    '''
+    SELECT columns FROM table [JOIN ...] WHERE conditions ...
+      - columns: list of columns, all columns if empty
+      - join: list of (table, on) for inner joins
+      - groupby, orderby: column or list of columns
+      - limit: maximum number of rows
+      - lock: locking clause appended to the statement, e.g. from
+        aCTDBMS.addLock()
+    '''
+    sql = "SELECT %s FROM %s" % (', '.join(columns) if columns else '*', table)
+    for (jtable, on) in join or []:
+        sql += " JOIN %s ON %s" % (jtable, on)
+    wsql, params = _where(conditions)
+    sql += wsql
+    if groupby:
+        sql += " GROUP BY " + (groupby if isinstance(groupby, str) else ', '.join(groupby))
+    if orderby:
+        sql += " ORDER BY " + (orderby if isinstance(orderby, str) else ', '.join(orderby))
+    if limit is not None:
+        sql += " LIMIT %d" % int(limit)
+    return (sql + lock, params)
+
+
+def count(table, conditions=None, join=None):
+    '''
+    SELECT COUNT(*) AS count FROM table WHERE conditions
+    '''
+    return select(table, ['COUNT(*) AS count'], conditions, join=join)
+
+
+def insert(table, values):
+    '''
+    INSERT INTO table (columns) VALUES (...) for a dict of column: value
+    '''
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (table, ', '.join(values.keys()), ','.join(['%s'] * len(values)))
+    return (sql, list(values.values()))
+
+
+def insertMany(table, columns, rows):
+    '''
+    INSERT INTO table (columns) VALUES (...), (...) for a list of rows, each
+    a list of values in the order of columns
+    '''
+    row = '(%s)' % ','.join(['%s'] * len(columns))
+    sql = "INSERT INTO %s (%s) VALUES %s" % (table, ', '.join(columns), ', '.join([row] * len(rows)))
+    return (sql, [v for r in rows for v in r])
+
+
+def update(table, values, conditions):
+    '''
+    UPDATE table SET column=value, ... WHERE conditions. A value can be a Raw
+    expression, e.g. Raw('refcount+1'). Refuses to update the whole table if
+    no conditions are given.
+    '''
+    if not conditions:
+        raise Exception("Refusing to update all rows of %s" % table)
+    assignments = []
+    params = []
+    for k, v in values.items():
+        if isinstance(v, Raw):
+            assignments.append('%s=%s' % (k, v.sql))
+            params.extend(v.params)
+        else:
+            assignments.append('%s=%%s' % k)
+            params.append(v)
+    sql = "UPDATE %s SET %s" % (table, ', '.join(assignments))
+    wsql, wparams = _where(conditions)
+    return (sql + wsql, params + wparams)
+
+
+def delete(table, conditions):
+    '''
+    DELETE FROM table WHERE conditions. Refuses to delete the whole table if
+    no conditions are given.
+    '''
+    if not conditions:
+        raise Exception("Refusing to delete all rows of %s" % table)
+    wsql, params = _where(conditions)
+    return ("DELETE FROM %s%s" % (table, wsql), params)
@@ -0,0 +1,323 @@
+import argparse
+import datetime
+import logging
+import sys
+
+from act.db.aCTDB import aCTDB, monthRange, HOTCOLDSTATES
+from act.db import aCTDBQuery
+from act.db.aCTDBCounters import JOBCOUNTERS, counterTriggers
+from act.db.aCTDBEvents import JOBEVENTS, JOBEVENTCONSUMERS, eventTriggers
+from act.db.aCTDBClusters import JOBCLUSTERS, JOBCLUSTERSINDEX, clusterTriggers, aCTDBClusters
+
+# Ordered list of (version, description, steps) where each step is one of
+#   ('index', table, index name, [columns])
+#   ('column', table, column name, column definition)
+#   ('table', table, None, column definitions)
+#   ('partition', table, timestamp column, None) for monthly partitions
+#   ('statepartition', table, state column, None) for hot/cold partitions
+#   ('trigger', table, trigger name, trigger definition)
+#   ('droptrigger', table, trigger name, None) to replace a trigger
+#   ('notify', table, None, None) for aCTDBMS.notifyOnInsert()
+#   ('clusters', table, None, None) to fill job_clusters from table
+# Migration 1 predates the step kinds and lists (table, index name, [columns])
+# index steps.
+# Migrations are applied in order and each version is recorded in the
+# schemaversion table once all its steps have run, so running migrate()
+# again only applies what is missing. Only append to this list, never change
+# an existing entry.
+MIGRATIONS = [
+    (1, 'composite indexes for hot query shapes', [
+        ('arcjobs', 'arcjobs_cluster_state', ['cluster', 'arcstate', 'tarcstate']),
+        ('arcjobs', 'arcjobs_state_tstate', ['state', 'tstate']),
+        ('condorjobs', 'condorjobs_cluster_state', ['cluster', 'condorstate', 'tcondorstate']),
+        ('pandajobs', 'pandajobs_site_actstatus', ['siteName', 'actpandastatus']),
+        ('pandajobs', 'pandajobs_status_heartbeat', ['pandastatus', 'sendhb', 'theartbeat']),
+    ]),
+    (2, 'claim lease columns for concurrent workers', [
+        ('column', 'arcjobs', 'claimedby', 'VARCHAR(255)'),
+        ('column', 'arcjobs', 'claimeduntil', 'DATETIME'),
+        ('column', 'condorjobs', 'claimedby', 'VARCHAR(255)'),
+        ('column', 'condorjobs', 'claimeduntil', 'DATETIME'),
+    ]),
+    (3, 'content-addressed compressed job descriptions', [
+        ('column', 'jobdescriptions', 'hash', 'CHAR(64)'),
+        ('column', 'jobdescriptions', 'refcount', 'INTEGER'),
+        ('column', 'jobdescriptions', 'data', 'MEDIUMBLOB'),
+        ('index', 'jobdescriptions', 'jobdescriptions_hash', ['hash']),
+    ]),
+    (4, 'panda job description decoded at insertion', [
+        ('column', 'pandajobs', 'eventservice', 'TINYINT(1)'),
+        ('column', 'pandajobs', 'jobinfo', 'MEDIUMTEXT'),
+    ]),
+    (5, 'monthly pandaarchive partitions and daily roll-up', [
+        ('partition', 'pandaarchive', 'endTime', None),
+        ('index', 'pandaarchive', 'pandaarchive_site_endtime', ['siteName', 'endTime']),
+        ('table', 'pandaarchive_daily', None,
+         'day DATE, siteName VARCHAR(255), actpandastatus VARCHAR(255), njobs INTEGER, '
+         'walltime BIGINT, walltime50 INTEGER, walltime90 INTEGER, walltime99 INTEGER, '
+         'firststart DATETIME, lastend DATETIME, PRIMARY KEY (day, siteName, actpandastatus)'),
+    ]),
+    # the counters are filled by the first aCTDBCounters.reconcile()
+    (6, 'materialized job state counters', [
+        ('table', 'jobcounters', None, JOBCOUNTERS),
+    ] + [('trigger', table, name, definition) for (name, table, definition) in counterTriggers()]),
+    (7, 'outbox of job state transitions', [
+        ('table', 'jobevents', None, JOBEVENTS),
+        ('table', 'jobeventconsumers', None, JOBEVENTCONSUMERS),
+    ] + [('trigger', table, name, definition) for (name, table, definition) in eventTriggers()]),
+    (8, 'hot/cold partitions of the job tables by state', [
+        ('statepartition', 'arcjobs', 'arcstate', None),
+        ('statepartition', 'condorjobs', 'condorstate', None),
+    ]),
+    (9, 'notifications of new job events', [
+        ('notify', 'jobevents', None, None),
+    ]),
+    # filling assumes no jobs are inserted while migrating
+    (10, 'job to cluster mapping', [
+        ('table', 'job_clusters', None, JOBCLUSTERS),
+        ('index', 'job_clusters', 'job_clusters_cluster_state', JOBCLUSTERSINDEX),
+    ] + [('trigger', table, name, definition) for (name, table, definition) in clusterTriggers()] + [
+        ('clusters', 'arcjobs', None, None),
+        ('clusters', 'condorjobs', None, None),
+    ]),
+    (11, 'job events of actpandastatus changes', [
+        ('trigger', table, name, definition) for (name, table, definition) in eventTriggers() if table == 'pandajobs'
+    ]),
+    (12, 'job counters spread over slot rows', [
+        step for (name, table, definition) in counterTriggers()
+        for step in [('droptrigger', table, name, None), ('trigger', table, name, definition)]
+    ]),
+]
+
+
+class aCTDBSchema(aCTDB):
+    '''
+    Versioned, non-interactive schema migrations on top of the tables created
+    by the createTables() methods of the other aCTDB classes, and an index
+    advisor which explains the queries aCT issues and reports full scans.
+    '''
+
+    def __init__(self, log):
+        aCTDB.__init__(self, log, 'schemaversion')
+
+    def createTables(self):
+        '''
+        schemaversion: one row per applied migration
+          - version: migration version number
+          - description: short description of the migration
+          - applied: time the migration was applied
+        '''
+        c = self.db.getCursor()
+        c.execute("CREATE TABLE IF NOT EXISTS schemaversion ( \
+                   version INTEGER PRIMARY KEY, \
+                   description VARCHAR(255), \
+                   applied TIMESTAMP)")
+        self.Commit()
+
+    def getVersion(self):
+        '''
+        Return the highest applied migration version, 0 if none
+        '''
+        self.createTables()
+        c = self.db.getCursor()
+        c.execute("SELECT MAX(version) AS version FROM schemaversion")
+        row = c.fetchone()
+        return row['version'] or 0
+
+    def pendingMigrations(self):
+        '''
+        Return the list of migrations not yet applied
+        '''
+        version = self.getVersion()
+        return [m for m in MIGRATIONS if m[0] > version]
+
+    def migrate(self):
+        '''
+        Apply all pending migrations. Indexes and columns which already exist
+        are skipped so a partially applied migration can safely be rerun.
+        Returns True if the schema is up to date afterwards.
+        '''
+        for (version, description, steps) in self.pendingMigrations():
+            self.log.info("Applying schema migration %d: %s" % (version, description))
+            for step in steps:
+                if len(step) == 3:
+                    step = ('index',) + step
+                (kind, table, name, definition) = step
+                if kind == 'table':
+                    if self.db.tableExists(table):
+                        self.log.debug("Table %s already exists" % table)
+                        continue
+                    self.log.info("Creating table %s" % table)
+                    statement = "CREATE TABLE %s (%s)" % (table, definition)
+                elif not self.db.tableExists(table):
+                    self.log.error("Table %s does not exist, cannot apply migration %d" % (table, version))
+                    return False
+                elif kind == 'partition':
+                    if self.db.getPartitions(table):
+                        self.log.debug("Table %s is already partitioned" % table)
+                        continue
+                    # one partition per month from the oldest row to next month
+                    today = datetime.date.today()
+                    first = self.db.fetch(aCTDBQuery.select(table, ['MIN(%s) AS first' % name]))[0]['first'] or today
+                    months = monthRange(first, today + datetime.timedelta(days=31))
+                    self.log.info("Partitioning %s by month of %s (%d partitions)" % (table, name, len(months)))
+                    try:
+                        self.db.partitionByMonth(table, name, months)
+                    except Exception as x:
+                        self.log.error("Failed to apply migration %d (partitioning %s): %s" % (version, table, x))
+                        return False
+                    continue
+                elif kind == 'statepartition':
+                    if self.db.getPartitions(table):
+                        self.log.debug("Table %s is already partitioned" % table)
+                        continue
+                    (column, hot, cold) = HOTCOLDSTATES[table]
+                    unknown = self.db.fetch(aCTDBQuery.select(table, ['DISTINCT %s AS state' % column],
+                                                              [(column, '!=', hot + cold)]))
+                    if unknown:
+                        self.log.error("Cannot partition %s, unknown states: %s" %
+                                       (table, ', '.join([str(r['state']) for r in unknown])))
+                        return False
+                    self.log.info("Partitioning %s into hot and cold %s" % (table, column))
+                    try:
+                        self.db.partitionByState(table, column, hot, cold)
+                    except Exception as x:
+                        self.log.error("Failed to apply migration %d (partitioning %s): %s" % (version, table, x))
+                        return False
+                    continue
+                elif kind == 'trigger':
+                    if self.db.triggerExists(name):
+                        self.log.debug("Trigger %s on %s already exists" % (name, table))
+                        continue
+                    self.log.info("Creating trigger %s on %s" % (name, table))
+                    try:
+                        self.db.createTrigger(name, definition)
+                    except Exception as x:
+                        self.log.error("Failed to apply migration %d (trigger %s): %s" % (version, name, x))
+                        return False
+                    continue
+                elif kind == 'droptrigger':
+                    self.log.info("Dropping trigger %s on %s" % (name, table))
+                    statement = "DROP TRIGGER IF EXISTS %s" % name
+                elif kind == 'notify':
+                    if self.db.triggerExists('%s_notify' % table):
+                        self.log.debug("Notifications on %s already exist" % table)
+                        continue
+                    self.log.info("Creating notifications on %s" % table)
+                    try:
+                        self.db.notifyOnInsert(table)
+                    except Exception as x:
+                        self.log.error("Failed to apply migration %d (notify %s): %s" % (version, table, x))
+                        return False
+                    continue
+                elif kind == 'clusters':
+                    self.log.info("Filling job_clusters from %s" % table)
+                    try:
+                        aCTDBClusters(self.log).fill(table)
+                    except Exception as x:
+                        self.log.error("Failed to apply migration %d (job_clusters of %s): %s" % (version, table, x))
+                        return False
+                    continue
+                elif kind == 'index':
+                    if self.db.indexExists(table, name):
+                        self.log.debug("Index %s on %s already exists" % (name, table))
+                        continue
+                    self.log.info("Creating index %s on %s (%s)" % (name, table, ', '.join(definition)))
+                    statement = "CREATE INDEX %s ON %s (%s)" % (name, table, ', '.join(definition))
+                else:
+                    if self.db.columnExists(table, name):
+                        self.log.debug("Column %s in %s already exists" % (name, table))
+                        continue
+                    self.log.info("Adding column %s %s to %s" % (name, definition, table))
+                    statement = "ALTER TABLE %s ADD COLUMN %s %s" % (table, name, definition)
+                c = self.db.getCursor()
+                try:
+                    c.execute(statement)
+                except Exception as x:
+                    self.log.error("Failed to apply migration %d (%s): %s" % (version, statement, x))
+                    return False
+            c = self.db.getCursor()
+            c.execute("INSERT INTO schemaversion (version, description, applied) VALUES (%s, %s, %s)",
+                      [version, description, self.getTimeStamp()])
+            self.Commit()
+        return True
+
+    def hotQueries(self):
+        '''
+        Return a list of (caller, query) with representative examples of the
+        selects issued every loop by the aCT engines
+        '''
+        cluster = 'https://ce.example.org/arex'
+        sites = "('SITE_A', 'SITE_B')"
+        tlt = self.db.timeStampLessThan
+        return [
+            ('arc aCTStatus.checkJobs',
+             "SELECT id FROM arcjobs WHERE arcstate in ('submitted', 'running', 'cancelling', 'holding') and "
+             "cluster='%s' and %s" % (cluster, tlt('tarcstate', 300))),
+            ('arc aCTStatus.checkStuckJobs',
+             "SELECT id FROM arcjobs WHERE state='queuing' and %s" % tlt('tstate', 86400)),
+            ('arc aCTFetcher.fetchJobs',
+             "SELECT id FROM arcjobs WHERE arcstate='finished' and cluster='%s'" % cluster),
+            ('arc aCTCleaner.processToClean',
+             "SELECT id FROM arcjobs WHERE arcstate='toclean' and cluster='%s'" % cluster),
+            ('condor aCTStatus.checkJobs',
+             "SELECT id FROM condorjobs WHERE condorstate in ('submitted', 'running', 'cancelling', 'holding') and "
+             "cluster='%s' and %s" % (cluster, tlt('tcondorstate', 300))),
+            ('aCTPandaGetJobs.getJobs',
+             "SELECT COUNT(*) FROM pandajobs WHERE actpandastatus='sent' and siteName='SITE_A'"),
+            ('aCTAutopilot.updatePandaHeartbeatBulk',
+             "SELECT pandaid FROM pandajobs WHERE pandastatus='running' and sendhb=1 and %s" % tlt('theartbeat', 1200)),
+            ('aCTPanda2Arc.createArcJobs',
+             "SELECT id FROM pandajobs WHERE arcjobid is NULL and siteName in %s" % sites),
+            ('aCTATLASStatus.updateRunningJobs',
+             "SELECT arcjobs.id FROM arcjobs, pandajobs WHERE arcjobs.id=pandajobs.arcjobid and "
+             "arcjobs.arcstate='running' and pandajobs.actpandastatus in ('starting', 'sent') and "
+             "pandajobs.sitename in %s" % sites),
+        ]
+
+    def adviseIndexes(self):
+        '''
+        Explain each of the hot queries and return a list of (caller, query,
+        tables) for those where the DB plans a full table scan
+        '''
+        report = []
+        for (caller, query) in self.hotQueries():
+            try:
+                tables = self.db.fullScans(query)
+            except Exception as x:
+                self.log.warning("Could not explain query for %s: %s" % (caller, x))
+                continue
+            if tables:
+                report.append((caller, query, tables))
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the aCT database schema')
+    parser.add_argument('command', choices=['status', 'migrate', 'advise'],
+                        help='status: show schema version, migrate: apply pending migrations, '
+                             'advise: report hot queries doing full table scans')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    schema = aCTDBSchema(logging.getLogger())
+
+    if args.command == 'status':
+        pending = schema.pendingMigrations()
+        print('Schema version %d, %d migration(s) pending' % (schema.getVersion(), len(pending)))
+        for (version, description, _) in pending:
+            print('  %d: %s' % (version, description))
+    elif args.command == 'migrate':
+        if not schema.migrate():
+            sys.exit(1)
+        print('Schema is at version %d' % schema.getVersion())
+    elif args.command == 'advise':
+        report = schema.adviseIndexes()
+        for (caller, query, tables) in report:
+            print('%s: full scan of %s\n  %s' % (caller, ', '.join(tables), query))
+        if not report:
+            print('No full table scans found')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,12 @@
+import datetime
+import errno
+import fcntl
+import hashlib
+import os
+import re
 import sqlite3 as sqlite
+import tempfile
+import time
 from act.db.aCTDBMS import aCTDBMS
 
 def dict_factory(cursor, row):
@@ -7,36 +15,270 @@ def dict_factory(cursor, row):
         d[col[0]] = row[idx]
     return d
 
+def _fromTimeStamp(value):
+    # aCTDB.getTimeStamp() writes isoformat(), with microseconds unless they
+    # are 0. Accept the MySQL style space separator too.
+    value = value.replace(' ', 'T')
+    if '.' in value:
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+def _parseTimeStamp(value):
+    # aCT writes isoformat() time stamps, MySQL style zero dates mean unset
+    value = value.decode()
+    if not value or value.startswith('0'):
+        return None
+    return _fromTimeStamp(value)
+
+def _parseDate(value):
+    value = value.decode()
+    if not value or value.startswith('0'):
+        return None
+    return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+# Return TIMESTAMP, DATETIME and DATE columns as datetime objects like MySQL
+sqlite.register_converter('TIMESTAMP', _parseTimeStamp)
+sqlite.register_converter('DATETIME', _parseTimeStamp)
+sqlite.register_converter('DATE', _parseDate)
+sqlite.register_adapter(datetime.datetime, lambda d: d.isoformat())
+sqlite.register_adapter(datetime.date, lambda d: d.isoformat())
+
+# MySQL functions used in queries and triggers, emulated in Python
+FUNCTIONS = {
+    'UTC_TIMESTAMP': (0, lambda: datetime.datetime.utcnow().isoformat(timespec='seconds')),
+    'NOW': (0, lambda: datetime.datetime.now().isoformat(timespec='seconds')),
+    'UNIX_TIMESTAMP': (1, lambda t: int(_fromTimeStamp(t).timestamp()) if t else None),
+    'SHA1': (1, lambda s: hashlib.sha1(str(s).encode('utf-8')).hexdigest() if s is not None else None),
+    'CONCAT_WS': (-1, lambda sep, *args: sep.join([str(a) for a in args if a is not None])),
+}
+
+
+def translate(sql, params=None):
+    '''
+    Translate a statement written for MySQL, as issued throughout aCT, to
+    SQLite: %s placeholders, AUTO_INCREMENT keys, ON DUPLICATE KEY UPDATE and
+    the null-safe <=> operator
+    '''
+    if params is not None:
+        sql = re.sub(r'%(s|%)', lambda m: '?' if m.group(1) == 's' else '%', sql)
+    if re.match(r'\s*create\s+table', sql, re.I):
+        # only an INTEGER PRIMARY KEY is an alias for the auto-incremented rowid
+        sql = re.sub(r'\b\w+(\(\d+\))?\s+PRIMARY\s+KEY\s+AUTO_INCREMENT', 'INTEGER PRIMARY KEY AUTOINCREMENT', sql, flags=re.I)
+    sql = re.sub(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', 'ON CONFLICT DO UPDATE SET', sql, flags=re.I)
+    return sql.replace('<=>', 'IS')
+
+
+class aCTSqliteCursor(object):
+    '''
+    Cursor translating the MySQL dialect of aCT statements, see translate()
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=None):
+        if params is None:
+            return self.cursor.execute(translate(sql))
+        return self.cursor.execute(translate(sql, params), list(params))
+
+    def executemany(self, sql, seq):
+        return self.cursor.executemany(translate(sql, []), [list(p) for p in seq])
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
 class aCTDBSqlite(aCTDBMS):
     """Class for Sqlite specific db operations."""
 
+    # Milliseconds to wait for a lock held by another connection
+    busytimeout = 60000
+
     def __init__(self, log, config):
         aCTDBMS.__init__(self, log, config)
+        # open lock files of the mutex locks held by this process
+        self.mutexlocks = {}
+        # separate connection for stream(), opened on first use
+        self.streamconn = None
+        self._connect(self.dbname)
+        self.log.info("initialized aCTDBSqlite")
+
+    def _connect(self, dbname):
+        self.conn = self._newConnection(dbname)
+
+    def _newConnection(self, dbname):
         try:
-            self.conn = sqlite.connect(self.dbname, 1800)
+            conn = sqlite.connect(dbname, timeout=self.busytimeout/1000.,
+                                  detect_types=sqlite.PARSE_DECLTYPES)
         except Exception as x:
             raise Exception("Could not connect to sqlite: " + str(x))
-        self.conn.row_factory = dict_factory
-        self.conn.execute('''PRAGMA synchronous=OFF''')
-        self.log.info("initialized aCTDBSqlite")
+        conn.row_factory = dict_factory
+        for name, (nargs, func) in FUNCTIONS.items():
+            conn.create_function(name, nargs, func)
+        # WAL lets readers proceed while one process writes, and with it
+        # NORMAL synchronisation is safe against corruption
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=%d' % self.busytimeout)
+        return conn
 
-    def getCursor(self):
-        return self.conn.cursor()
-
-    def timeStampLessThan(self,column,timediff):
-        return "datetime("+column+") < datetime('now', '-"+str(timediff)+" seconds')"
+    def beginTransaction(self):
+        # take the write lock at the start so that a transaction never has to
+        # upgrade a read lock, which fails immediately if another connection
+        # is writing
+        self.conn.commit()
+        self.conn.execute('BEGIN IMMEDIATE')
 
-    def timeStampGreaterThan(self,column,timediff):
-        return "datetime("+column+") > datetime('now', '-"+str(timediff)+" seconds')"
+    def getCursor(self):
+        if self.txdepth:
+            if self.txcursor is None:
+                self.txcursor = aCTSqliteCursor(self.conn.cursor())
+            return self.txcursor
+        return aCTSqliteCursor(self.conn.cursor())
 
     def addLock(self):
-        # SQLite does not support row locking
+        # SQLite does not support row locking, a write transaction locks the db
         return ""
 
-    def getMutexLock(self):
-        # SQLite does not support mutex locking
-        return
+    def stream(self, query, chunksize=1000):
+        '''
+        Rows are read on a separate connection, since SQLite does not define
+        what a select returns when its table is changed on the same connection
+        before all rows are read. With WAL the stream connection reads a
+        snapshot taken when the select starts. An in-memory database cannot
+        be opened twice, so its result is read at once.
+        '''
+        if self.dbname in ('', ':memory:'):
+            c = self.getCursor()
+            c.execute(*query)
+            rows = c.fetchall()
+            for i in range(0, len(rows), chunksize):
+                yield rows[i:i+chunksize]
+            return
+        if self.streamconn is None:
+            self.streamconn = self._newConnection(self.dbname)
+        c = aCTSqliteCursor(self.streamconn.cursor())
+        try:
+            c.execute(*query)
+            while True:
+                rows = c.fetchmany(chunksize)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            c.close()
 
-    def releaseMutexLock(self):
-        # SQLite does not support mutex locking
+    def _lockFile(self, lock_name):
+        if self.dbname in ('', ':memory:'):
+            directory = tempfile.gettempdir()
+        else:
+            directory = os.path.dirname(os.path.abspath(self.dbname))
+        return os.path.join(directory, '.%s.%s.lock' % (os.path.basename(self.dbname) or 'memory', lock_name))
+
+    def getMutexLock(self, lock_name, timeout=2):
+        """
+        Named lock emulated with an exclusive lock on a file next to the
+        database, released when the process exits. Returns 1 if the lock was
+        obtained, 0 if the attempt timed out, None if an error occurred.
+        """
+        if lock_name in self.mutexlocks:
+            return 1
+        try:
+            f = open(self._lockFile(lock_name), 'a')
+        except IOError as e:
+            self.log.error("Could not open lock file for %s: %s" % (lock_name, str(e)))
+            return None
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.mutexlocks[lock_name] = f
+                return 1
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    f.close()
+                    self.log.error("Could not lock %s: %s" % (lock_name, str(e)))
+                    return None
+            if time.time() >= deadline:
+                f.close()
+                return 0
+            time.sleep(0.1)
+
+    def releaseMutexLock(self, lock_name):
+        """
+        Release a lock taken with getMutexLock(). Returns 1 if the lock was
+        released, 0 if this process does not hold it.
+        """
+        f = self.mutexlocks.pop(lock_name, None)
+        if f is None:
+            return 0
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+        return 1
+
+    def unlockTables(self):
+        # there are no table locks in SQLite
         return
+
+    def tableExists(self, table):
+        c = self.getCursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", [table])
+        return c.fetchone() is not None
+
+    def indexExists(self, table, index):
+        c = self.getCursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND name=?", [table, index])
+        return c.fetchone() is not None
+
+    def columnExists(self, table, column):
+        c = self.getCursor()
+        c.execute("PRAGMA table_info(%s)" % table)
+        return column in [row['name'] for row in c.fetchall()]
+
+    def triggerExists(self, trigger):
+        c = self.getCursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name=?", [trigger])
+        return c.fetchone() is not None
+
+    def createTrigger(self, name, definition):
+        # MySQL "FOR EACH ROW [IF cond THEN] stmt; ... [END IF]" becomes
+        # "FOR EACH ROW [WHEN cond] BEGIN stmt; ... END"
+        m = re.match(r'(.*?FOR EACH ROW)\s+IF\s+(.*?)\s+THEN\s+(.*?);?\s*END IF\s*$', definition, re.S)
+        if m:
+            definition = "%s WHEN %s BEGIN %s; END" % m.groups()
+        else:
+            head, body = re.split(r'(?<=FOR EACH ROW)\s+', definition, maxsplit=1)
+            definition = "%s BEGIN %s; END" % (head, body.rstrip(' ;'))
+        c = self.getCursor()
+        c.execute("CREATE TRIGGER %s %s" % (name, definition))
+
+    def fullScans(self, query):
+        # plan details look like "SCAN arcjobs" or "SCAN TABLE arcjobs" for
+        # full scans and "SEARCH arcjobs USING INDEX ..." otherwise
+        c = self.getCursor()
+        c.execute("EXPLAIN QUERY PLAN "+query)
+        scans = []
+        for row in c.fetchall():
+            detail = row['detail'].split()
+            if detail[0] == 'SCAN' and 'USING' not in detail:
+                scans.append(detail[2] if detail[1] == 'TABLE' else detail[1])
+        return scans
+
+    # SQLite has no partitioning, tables are left unpartitioned
+    def getPartitions(self, table):
+        return []
+
+    def partitionByMonth(self, table, column, months):
+        self.log.debug("SQLite does not support partitioning, %s is not partitioned" % table)
+
+    def addMonthPartition(self, table, month):
+        self.log.debug("SQLite does not support partitioning, %s is not partitioned" % table)
+
+    def dropPartition(self, table, name):
+        self.log.debug("SQLite does not support partitioning, %s is not partitioned" % table)
+
+    def partitionByState(self, table, column, hot, cold):
+        self.log.debug("SQLite does not support partitioning, %s is not partitioned" % table)
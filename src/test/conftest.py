@@ -0,0 +1,55 @@
+'''
+pytest configuration of the aCT unit tests. Tests needing a database use
+SQLite in a temporary directory, so no database server is required.
+'''
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ARCCONFIG = '''<config>
+<db>
+  <type>sqlite</type>
+  <name>%(dir)s/act.db</name>
+</db>
+<tmp>
+  <dir>%(dir)s/tmp</dir>
+</tmp>
+<voms>
+  <proxystoredir>%(dir)s/proxies</proxystoredir>
+</voms>
+</config>
+'''
+
+
+@pytest.fixture
+def arcconfig(tmp_path, monkeypatch):
+    '''
+    Point aCTConfigARC to a configuration with a fresh SQLite database in
+    tmp_path. aCTDB objects created afterwards share a connection to it.
+    '''
+    configfile = tmp_path / 'aCTConfigARC.xml'
+    configfile.write_text(ARCCONFIG % {'dir': tmp_path})
+    monkeypatch.setenv('ACTCONFIGARC', str(configfile))
+    return configfile
+
+
+@pytest.fixture
+def acttables(arcconfig):
+    '''
+    Create the arc, condor and panda job tables with their counters, events
+    and clusters in the database of arcconfig
+    '''
+    from act.arc.aCTDBArc import aCTDBArc
+    from act.condor.aCTDBCondor import aCTDBCondor
+    from act.atlas.aCTDBPanda import aCTDBPanda
+    from act.db.aCTDBCounters import aCTDBCounters
+    from act.db.aCTDBEvents import aCTDBEvents
+    from act.db.aCTDBClusters import aCTDBClusters
+
+    log = logging.getLogger()
+    for table in [aCTDBArc, aCTDBCondor, aCTDBPanda, aCTDBCounters, aCTDBEvents, aCTDBClusters]:
+        assert table(log).createTables()
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+from act.db.aCTDB import aCTDB
+
+
+@pytest.fixture
+def jobs(arcconfig):
+    db = aCTDB(logging.getLogger(), 'claimjobs')
+    c = db.db.getCursor()
+    c.execute("CREATE TABLE claimjobs (id INTEGER PRIMARY KEY, state VARCHAR(255), modified TIMESTAMP, "
+              "claimedby VARCHAR(255), claimeduntil DATETIME)")
+    c.executemany("INSERT INTO claimjobs (id, state) VALUES (%s, %s)", [(i, 'tosubmit') for i in range(1, 5)])
+    db.Commit()
+    return db
+
+
+class RacingCursor(object):
+    '''
+    Cursor which lets another worker claim job 1 for submission right after
+    the candidate rows were selected, as happens without SKIP LOCKED
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=None):
+        result = self.cursor.execute(sql, params)
+        if sql.startswith('SELECT id FROM claimjobs'):
+            rows = self.cursor.fetchall()
+            self.cursor.execute("UPDATE claimjobs SET state='submitting' WHERE id=1")
+            self.fetchall = lambda: rows
+        return result
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+
+def test_claim(jobs):
+    claimed = jobs._claimRows("state='tosubmit'", 3, ['id', 'state'])
+    assert [r['id'] for r in claimed] == [1, 2, 3]
+    # claimed rows are skipped until released
+    assert [r['id'] for r in jobs._claimRows("state='tosubmit'", 3)] == [4]
+    jobs._releaseRows([2])
+    assert [r['id'] for r in jobs._claimRows("state like 'to%'", 3, desc={'state': 'submitting'})] == [2]
+    assert jobs.db.fetch(("SELECT claimedby FROM claimjobs WHERE id=2", [])) == [{'claimedby': None}]
+
+
+def test_claim_moved_rows(jobs, monkeypatch):
+    getCursor = jobs.db.getCursor
+    monkeypatch.setattr(jobs.db, 'getCursor', lambda: RacingCursor(getCursor()))
+    claimed = jobs._claimRows("state='tosubmit'", 2, desc={'state': 'submitting'})
+    # job 1 left the selected state and must not be submitted again
+    assert [r['id'] for r in claimed] == [2]
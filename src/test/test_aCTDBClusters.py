@@ -0,0 +1,35 @@
+import logging
+
+import pytest
+
+arc = pytest.importorskip('arc')
+
+from act.arc.aCTDBArc import aCTDBArc
+from act.condor.aCTDBCondor import aCTDBCondor
+from act.db import aCTDBQuery
+
+
+def test_clusterselect(acttables):
+    dbcondor = aCTDBCondor(logging.getLogger())
+    # cluster names come from site configuration and are passed as parameters
+    cluster = "ce'1.example.org"
+    ids = [dbcondor.insertCondorJobDescription({'a': i}, clusterlist=clusterlist, appjobid=str(i), fairshare='f')['LAST_INSERT_ID()']
+           for i, clusterlist in enumerate(["condor %s %s:9619" % (cluster, cluster), "condor ce2 ce2:9619"])]
+    select = [('condorstate', 'tosubmit'), dbcondor.clusterSelect(cluster, ['tosubmit', 'toresubmit'])]
+    assert [j['id'] for j in dbcondor.getCondorJobsInfo(select, ['id'])] == ids[:1]
+    claimed = dbcondor.claimCondorJobs(select + [('fairshare', 'f')], 10, desc={'condorstate': 'submitting'})
+    assert [j['id'] for j in claimed] == ids[:1]
+    assert dbcondor.getCondorJobsInfo(select, ['id']) == []
+
+
+def test_insertarcjob(acttables):
+    # recreated jobs share descriptions and are mapped like submitted ones
+    dbarc = aCTDBArc(logging.getLogger())
+    job = arc.Job()
+    job.JobDescriptionDocument = '&(executable=/bin/true)'
+    ids = [dbarc.insertArcJob(job)['LAST_INSERT_ID()'] for i in range(2)]
+    jobdescs = [j['jobdesc'] for j in dbarc.getArcJobsInfo([('id', ids)], ['jobdesc'])]
+    assert jobdescs[0] == jobdescs[1]
+    assert dbarc.getArcJobDescription(jobdescs[0]) == job.JobDescriptionDocument
+    rows = dbarc.db.fetch(aCTDBQuery.select('job_clusters', ['jobid', 'cluster'], [('tablename', 'arcjobs')]))
+    assert sorted((r['jobid'], r['cluster']) for r in rows) == [(id, '') for id in ids]
@@ -0,0 +1,35 @@
+import logging
+
+import pytest
+
+pytest.importorskip('arc')
+
+from act.atlas.aCTDBPanda import aCTDBPanda
+from act.db.aCTDBCounters import aCTDBCounters, COUNTERSLOTS
+
+
+def counts(dbpanda):
+    return dict(((c['cluster'], c['state']), c['njobs']) for c in dbpanda.getStateCounts(groupby=['cluster', 'state']))
+
+
+def test_counters(acttables):
+    dbpanda = aCTDBPanda(logging.getLogger())
+    dbcounters = aCTDBCounters(logging.getLogger())
+    dbpanda.insertJobs([(i, 'PandaID=%d' % i, {'siteName': 's', 'actpandastatus': 'sent'}, None) for i in range(1, 21)])
+    for i in range(1, 6):
+        dbpanda.updateJob(i, {'actpandastatus': 'starting'})
+    dbpanda.deleteJob(20)
+    assert counts(dbpanda) == {('s', 'sent'): 14, ('s', 'starting'): 5}
+    # the jobs of one state are counted in several rows
+    rows = dbcounters.db.fetch(("SELECT njobs FROM jobcounters WHERE state='sent'", []))
+    assert 1 < len(rows) <= COUNTERSLOTS
+    assert dbcounters.reconcile() == 0
+
+    # drift is repaired and counters of empty states are removed
+    dbcounters.db.execute(("UPDATE jobcounters SET njobs=njobs+3 WHERE state='starting'", []))
+    dbcounters.db.execute(("INSERT INTO jobcounters (countkey, tablename, cluster, clusterlist, state, fairshare, njobs) "
+                           "VALUES ('x', 'pandajobs', 's', '', 'running', '', 2)", []))
+    dbpanda.updateJob(6, {'actpandastatus': 'starting'})
+    assert dbcounters.reconcile(['pandajobs']) == 2
+    assert counts(dbpanda) == {('s', 'sent'): 13, ('s', 'starting'): 6}
+    assert dbcounters.db.fetch(("SELECT COUNT(*) AS n FROM jobcounters WHERE njobs=0", [])) == [{'n': 0}]
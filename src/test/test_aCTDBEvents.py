@@ -0,0 +1,63 @@
+import datetime
+import logging
+import time
+
+import pytest
+
+pytest.importorskip('arc')
+
+from act.atlas.aCTDBPanda import aCTDBPanda
+from act.db.aCTDBEvents import aCTDBEvents
+
+
+@pytest.fixture
+def dbevents(acttables):
+    return aCTDBEvents(logging.getLogger())
+
+
+def addEvent(dbevents, seq, age):
+    created = datetime.datetime.utcnow() - datetime.timedelta(seconds=age)
+    with dbevents.transaction():
+        dbevents.db.execute(("INSERT INTO jobevents (seq, created, tablename, jobid, newstate) "
+                             "VALUES (%s, %s, 'arcjobs', %s, 'tosubmit')", [seq, created.isoformat(), seq]))
+
+
+def test_pandajobs_events(dbevents):
+    dbpanda = aCTDBPanda(logging.getLogger())
+    assert dbevents.getPosition('test') == 0
+    [id] = dbpanda.insertJobs([(5, 'PandaID=5', {'siteName': 's', 'actpandastatus': 'sent'}, None)])
+    dbpanda.updateJob(5, {'pandastatus': 'starting'})
+    dbpanda.updateJob(5, {'actpandastatus': 'starting'})
+    (events, seq) = dbevents.getEvents('test')
+    assert [(e['tablename'], e['jobid'], e['appjobid'], e['cluster'], e['oldstate'], e['newstate']) for e in events] == \
+        [('pandajobs', id, '5', 's', 'sent', 'starting')]
+    assert seq == events[-1]['seq']
+
+
+def test_gaps(dbevents):
+    dbevents.setPosition('test', 0)
+    addEvent(dbevents, 1, 300)
+    addEvent(dbevents, 3, 300)
+    addEvent(dbevents, 5, 0)
+    # an old gap is skipped, a gap before a recent event is not
+    (events, seq) = dbevents.getEvents('test')
+    assert ([e['seq'] for e in events], seq) == ([1, 3], 3)
+    dbevents.setPosition('test', seq)
+    assert dbevents.getEvents('test') == ([], 3)
+    assert dbevents.getScanPosition('test') == 3
+    # the gap is filled by a late commit
+    addEvent(dbevents, 4, 0)
+    (events, seq) = dbevents.getEvents('test')
+    assert ([e['seq'] for e in events], seq) == ([4, 5], 5)
+
+
+def test_prune(dbevents):
+    for seq in range(1, 4):
+        addEvent(dbevents, seq, 8*86400)
+    dbevents.setPosition('test', 2)
+    dbevents.setPosition('retired', 1)
+    dbevents.db.execute(("UPDATE jobeventconsumers SET modified=%s WHERE consumer='retired'",
+                         [dbevents.getTimeStamp(time.time() - 8*86400)]))
+    # the retired consumer does not hold back events
+    assert dbevents.pruneEvents() == 2
+    assert [e['seq'] for e in dbevents.db.fetch(("SELECT seq FROM jobevents", []))] == [3]
@@ -0,0 +1,59 @@
+import copy
+import json
+import logging
+import pickle
+
+import pytest
+
+from act.atlas.aCTDBPanda import aCTDBPanda, LAZYCOLUMNS
+
+
+@pytest.fixture
+def dbpanda(arcconfig):
+    db = aCTDBPanda(logging.getLogger())
+    db.createTables()
+    return db
+
+
+def test_insertjobs(dbpanda):
+    ids = dbpanda.insertJobs([(5, 'PandaID=5&jobName=a', {'siteName': 's', 'prodSourceLabel': 'managed'}, None),
+                              (0, 'x=1', {'siteName': 's', 'prodSourceLabel': 'user'}, None),
+                              (0, 'x=1', {'siteName': 's', 'prodSourceLabel': 'user', 'corecount': 8}, None)])
+    jobs = dict((j['id'], j) for j in dbpanda.getJobs({'id': ids}))
+    assert jobs[ids[0]]['pandaid'] == 5
+    assert json.loads(jobs[ids[0]]['jobinfo']) == {'PandaID': '5', 'jobName': 'a'}
+    # pull mode jobs get their row id as pandaid
+    for id in ids[1:]:
+        assert jobs[id]['pandaid'] == id
+        assert jobs[id]['pandajob'] == 'PandaID=%d&prodSourceLabel=user' % id
+    assert jobs[ids[2]]['corecount'] == 8
+
+
+def test_insertjobs_duplicate(dbpanda):
+    dbpanda.insertJobs([(5, 'PandaID=5', {'siteName': 's'}, None)])
+    # a duplicate pandaid does not lose the other jobs of the batch
+    ids = dbpanda.insertJobs([(6, 'PandaID=6', {'siteName': 's'}, None),
+                              (5, 'PandaID=5', {'siteName': 's'}, None),
+                              (0, 'x=1', {'siteName': 's', 'prodSourceLabel': 'user'}, None)])
+    assert ids[1] is None
+    assert [j['pandaid'] for j in dbpanda.getJobs({'id': ids[0::2]}, ['pandaid'])] == [6, ids[2]]
+
+
+def test_lazy_row(dbpanda):
+    dbpanda.insertJobs([(5, 'PandaID=5&jobName=a', {'siteName': 's'}, None)])
+    row = dbpanda.getJobs('pandaid=5')[0]
+    assert not dict.__contains__(row, 'pandajob')
+    assert 'pandajob' in row
+    assert set(LAZYCOLUMNS) <= set(row.keys())
+    assert dict(row)['pandajob'] == 'PandaID=5&jobName=a'
+    assert json.loads(json.dumps(row, default=str))['jobinfo'] == row['jobinfo']
+
+
+def test_lazy_row_copy(dbpanda):
+    dbpanda.insertJobs([(5, 'PandaID=5&jobName=a', {'siteName': 's'}, None)])
+    for row in [pickle.loads(pickle.dumps(dbpanda.getJobs('pandaid=5')[0])),
+                copy.copy(dbpanda.getJobs('pandaid=5')[0]),
+                copy.deepcopy(dbpanda.getJobs('pandaid=5')[0])]:
+        assert type(row) is dict
+        assert row['pandajob'] == 'PandaID=5&jobName=a'
+        assert row['eventranges'] is None
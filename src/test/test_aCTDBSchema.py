@@ -0,0 +1,21 @@
+import logging
+
+import pytest
+
+pytest.importorskip('arc')
+
+from act.db.aCTDBSchema import aCTDBSchema, MIGRATIONS
+
+
+def test_createtables_indexes(acttables):
+    # tables recreated after the migrations ran must have the migrated indexes
+    schema = aCTDBSchema(logging.getLogger())
+    for (table, name, columns) in MIGRATIONS[0][2]:
+        assert schema.db.indexExists(table, name)
+
+
+def test_migrate(acttables):
+    schema = aCTDBSchema(logging.getLogger())
+    assert schema.migrate()
+    assert schema.getVersion() == MIGRATIONS[-1][0]
+    assert schema.pendingMigrations() == []
@@ -0,0 +1,119 @@
+import datetime
+import logging
+
+import pytest
+
+from act.db import aCTDBQuery
+from act.db.aCTDBSqlite import aCTDBSqlite, translate
+
+
+class Config:
+    def __init__(self, dbname):
+        self.values = {('db', 'name'): dbname}
+
+    def get(self, nodes):
+        return self.values.get(tuple(nodes))
+
+
+@pytest.fixture
+def db(tmp_path):
+    return aCTDBSqlite(logging.getLogger(), Config(str(tmp_path / 'act.db')))
+
+
+def test_translate_placeholders():
+    assert translate("SELECT * FROM t WHERE a=%s AND b LIKE '%%x'", []) == \
+        "SELECT * FROM t WHERE a=? AND b LIKE '%x'"
+    # without parameters the statement is executed as is
+    assert translate("SELECT '%s'") == "SELECT '%s'"
+
+
+def test_translate_autoincrement():
+    assert translate("CREATE TABLE t (id BIGINT(20) PRIMARY KEY AUTO_INCREMENT, a INT)") == \
+        "CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, a INT)"
+    # only create statements are rewritten
+    assert 'AUTO_INCREMENT' in translate("SELECT 'id INT PRIMARY KEY AUTO_INCREMENT'")
+
+
+def test_translate_upsert_and_nullsafe():
+    assert translate("INSERT INTO t (a) VALUES (%s) ON DUPLICATE KEY UPDATE a=%s", []) == \
+        "INSERT INTO t (a) VALUES (?) ON CONFLICT DO UPDATE SET a=?"
+    assert translate("SELECT * FROM t WHERE NOT (a <=> b)") == "SELECT * FROM t WHERE NOT (a IS b)"
+
+
+def test_upsert(db):
+    c = db.getCursor()
+    c.execute("CREATE TABLE t (k VARCHAR(10) PRIMARY KEY, n INTEGER)")
+    for i in range(3):
+        c.execute("INSERT INTO t (k, n) VALUES (%s, 1) ON DUPLICATE KEY UPDATE n=n+1", ['a'])
+    assert db.fetch(("SELECT n FROM t WHERE k=%s", ['a'])) == [{'n': 3}]
+
+
+def test_timestamps(db):
+    c = db.getCursor()
+    c.execute("CREATE TABLE t (id INTEGER, created DATETIME, day DATE)")
+    now = datetime.datetime(2020, 1, 2, 3, 4, 5, 600)
+    c.execute("INSERT INTO t VALUES (%s, %s, %s)", [1, now.isoformat(), '2020-01-02'])
+    c.execute("INSERT INTO t VALUES (%s, %s, %s)", [2, '2020-01-02 03:04:05', '0000-00-00'])
+    c.execute("INSERT INTO t VALUES (%s, UTC_TIMESTAMP(), NULL)", [3])
+    rows = db.fetch(("SELECT * FROM t ORDER BY id", []))
+    assert rows[0]['created'] == now
+    assert rows[0]['day'] == datetime.date(2020, 1, 2)
+    assert rows[1]['created'] == datetime.datetime(2020, 1, 2, 3, 4, 5)
+    assert rows[1]['day'] is None
+    assert isinstance(rows[2]['created'], datetime.datetime)
+    assert db.fetch(("SELECT UNIX_TIMESTAMP(created) AS t FROM t WHERE id=2", []))[0]['t'] == \
+        int(datetime.datetime(2020, 1, 2, 3, 4, 5).timestamp())
+
+
+def test_trigger(db):
+    c = db.getCursor()
+    c.execute("CREATE TABLE t (id INTEGER, state VARCHAR(10))")
+    c.execute("CREATE TABLE log (id INTEGER, state VARCHAR(10))")
+    db.createTrigger('t_update', "AFTER UPDATE ON t FOR EACH ROW IF NOT (NEW.state <=> OLD.state) THEN "
+                                 "INSERT INTO log VALUES (NEW.id, NEW.state); END IF")
+    c.execute("INSERT INTO t VALUES (1, 'a')")
+    c.execute("UPDATE t SET state='a'")
+    c.execute("UPDATE t SET state='b'")
+    assert db.fetch(("SELECT * FROM log", [])) == [{'id': 1, 'state': 'b'}]
+    assert db.triggerExists('t_update')
+
+
+def test_mutex(tmp_path, db):
+    other = aCTDBSqlite(logging.getLogger(), Config(str(tmp_path / 'act.db')))
+    assert db.getMutexLock('lock', timeout=0) == 1
+    # taking the lock again in the same process is allowed
+    assert db.getMutexLock('lock', timeout=0) == 1
+    assert other.getMutexLock('lock', timeout=0.2) == 0
+    assert other.getMutexLock('otherlock', timeout=0) == 1
+    assert db.releaseMutexLock('lock') == 1
+    assert db.releaseMutexLock('lock') == 0
+    assert other.getMutexLock('lock', timeout=0) == 1
+
+
+def test_stream_with_updates(db):
+    c = db.getCursor()
+    c.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, state VARCHAR(10))")
+    c.executemany("INSERT INTO t (id, state) VALUES (%s, %s)", [(i, 'new') for i in range(1, 11)])
+    db.conn.commit()
+    seen = []
+    for rows in db.stream(("SELECT id, state FROM t WHERE state=%s ORDER BY id", ['new']), 3):
+        seen.extend(rows)
+        # the rows read so far move to another state and the last row is
+        # deleted, the stream still returns the result of the select
+        c = db.getCursor()
+        c.executemany("UPDATE t SET state='done' WHERE id=%s", [(r['id'],) for r in rows])
+        c.execute("DELETE FROM t WHERE id=10")
+        db.conn.commit()
+    assert seen == [{'id': i, 'state': 'new'} for i in range(1, 11)]
+
+
+def test_timestamp_condition(db):
+    c = db.getCursor()
+    c.execute("CREATE TABLE t (id INTEGER, modified TIMESTAMP)")
+    c.execute("INSERT INTO t VALUES (1, %s), (2, %s)", [(datetime.datetime.utcnow() - datetime.timedelta(hours=2)).isoformat(),
+                                                     datetime.datetime.utcnow().isoformat()])
+    old = db.timeStampLessThanCondition('modified', 3600)
+    # the bound is a parameter, the statement does not change
+    assert old.sql == 'modified < %s' == db.timeStampLessThanCondition('modified', 60).sql
+    assert db.fetch(aCTDBQuery.select('t', ['id'], [old])) == [{'id': 1}]
+    assert db.fetch(aCTDBQuery.select('t', ['id'], [db.timeStampGreaterThanCondition('modified', 3600)])) == [{'id': 2}]
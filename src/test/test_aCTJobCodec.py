@@ -0,0 +1,63 @@
+import timeit
+
+import pytest
+
+arc = pytest.importorskip('arc')
+
+from act.arc.aCTJobCodec import getJobCodec
+
+
+def makeJob():
+    job = arc.Job()
+    job.JobID = 'https://ce.example.org:443/arex/abcdefghijklmnopqrstuvwxyz'
+    job.Name = 'test job'
+    job.State = arc.JobState('Running')
+    job.ExitCode = 0
+    job.UsedTotalWallTime = arc.Period(3600)
+    job.SubmissionTime = arc.Time('2020-01-02T03:04:05')
+    for i in range(3):
+        job.Error.append('error %d' % i)
+    return job
+
+
+def test_roundtrip():
+    codec = getJobCodec()
+    row = codec.encode(makeJob())
+    assert row['JobID'] == 'https://ce.example.org:443/arex/abcdefghijklmnopqrstuvwxyz'
+    assert row['State'] == 'Running'
+    assert row['Error'] == 'error 0|error 1|error 2'
+    assert codec.encode(codec.decode(row)) == row
+
+
+def test_unset_time_not_stored():
+    row = getJobCodec().encode(arc.Job())
+    assert 'SubmissionTime' not in row
+
+
+def test_ascii():
+    job = makeJob()
+    job.Name = 'test job é'
+    row = getJobCodec().encode(job)
+    assert row['Name'] == 'test job '
+
+
+def test_decodeattr_default():
+    codec = getJobCodec()
+    assert codec.decodeAttr('ExitCode', None) == arc.Job().ExitCode
+    assert codec.decodeAttr('ExitCode', '3') == 3
+
+
+# jobs per second the codec must convert in each direction
+THROUGHPUT = 100000
+
+
+@pytest.mark.parametrize('conversion', ['encode', 'decode'])
+def test_throughput(conversion):
+    codec = getJobCodec()
+    job = makeJob()
+    row = codec.encode(job)
+    func = {'encode': lambda: codec.encode(job), 'decode': lambda: codec.decode(row)}[conversion]
+    n = 20000
+    # best of several runs, so that a busy machine does not fail the test
+    t = min(timeit.repeat(func, number=n, repeat=3))
+    assert n / t >= THROUGHPUT, '%s: %.0f jobs/s' % (conversion, n / t)
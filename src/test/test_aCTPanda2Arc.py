@@ -0,0 +1,78 @@
+import logging
+
+import pytest
+
+pytest.importorskip('arc')
+
+from act.arc.aCTDBArc import aCTDBArc
+from act.atlas.aCTDBPanda import aCTDBPanda
+from act.atlas.aCTPanda2Arc import aCTPanda2Arc
+from act.common.aCTConfig import aCTConfigAPP
+
+APPCONFIG = '''<config>
+<executable>
+  <wrapperurl>http://example.org/wrapper.sh</wrapperurl>
+  <ptarurl>http://example.org/pilot.tar.gz</ptarurl>
+</executable>
+<panda>
+  <schedulerid>test</schedulerid>
+</panda>
+<joblog>
+  <urlprefix>http://example.org/joblogs</urlprefix>
+</joblog>
+</config>
+'''
+
+SITE = {'schedconfig': 'SITE', 'corecount': 1, 'truepilot': False, 'maxwalltime': 10800,
+        'type': 'production', 'endpoints': ['ce.example.org'], 'params': {}}
+
+PANDAJOB = 'PandaID=%d&prodSourceLabel=managed&jobName=job%d&transformation=Sim_tf.py&jobPars=--help' \
+           '&swRelease=Atlas-21.0.0&homepackage=AtlasOffline/21.0.0&cmtConfig=x86_64-slc6-gcc62-opt' \
+           '&coreCount=1&maxDiskCount=1000&minRamCount=2000&maxCpuCount=3600&currentPriority=100' \
+           '&logFile=job%d.log.tgz&outFiles=job%d.log.tgz&inFiles=&GUID=&fsize=&scopeIn=' \
+           '&realDatasetsIn=&prodDBlockToken=&ddmEndPointIn=&jobsetID=1&taskID=1'
+
+
+@pytest.fixture
+def panda2arc(acttables, tmp_path, monkeypatch):
+    configfile = tmp_path / 'aCTConfigAPP.xml'
+    configfile.write_text(APPCONFIG)
+    monkeypatch.setenv('ACTCONFIGAPP', str(configfile))
+    # only the attributes used by createArcJobs()
+    p = aCTPanda2Arc.__new__(aCTPanda2Arc)
+    p.log = logging.getLogger()
+    p.conf = aCTConfigAPP()
+    p.dbarc = aCTDBArc(p.log)
+    p.dbpanda = aCTDBPanda(p.log)
+    p.osmap = {}
+    p.tmpdir = str(tmp_path)
+    p.sites = {'SITE': SITE}
+    p.sitesselect = "('SITE')"
+    p.sendTraces = lambda traces, proxypath: None
+    p.nconverters = 2
+    p.maxinflight = 3
+    p.insertbatch = 2
+    return p
+
+
+def test_createarcjobs(panda2arc):
+    jobs = [(i, PANDAJOB % (i, i, i, i), {'siteName': 'SITE', 'proxyid': 1, 'actpandastatus': 'sent'}, None)
+            for i in range(1, 8)]
+    # a job which cannot be converted stays new
+    jobs.append((8, 'PandaID=8', {'siteName': 'SITE', 'proxyid': 1, 'actpandastatus': 'sent'}, None))
+    panda2arc.dbpanda.insertJobs(jobs)
+
+    panda2arc.createArcJobs()
+
+    pandajobs = panda2arc.dbpanda.getJobs('pandaid>0', ['pandaid', 'arcjobid', 'pandastatus'])
+    arcjobs = dict((j['id'], j) for j in panda2arc.dbarc.db.fetch(("SELECT id, appjobid, arcstate, jobdesc FROM arcjobs", [])))
+    assert len(arcjobs) == 7
+    for job in pandajobs:
+        if job['pandaid'] == 8:
+            assert job['arcjobid'] is None
+            continue
+        assert job['pandastatus'] == 'starting'
+        assert arcjobs[job['arcjobid']]['appjobid'] == str(job['pandaid'])
+        assert arcjobs[job['arcjobid']]['arcstate'] == 'tosubmit'
+        xrsl = panda2arc.dbarc.getArcJobDescription(arcjobs[job['arcjobid']]['jobdesc'])
+        assert '(jobname = "job%d")' % job['pandaid'] in xrsl
@@ -3,6 +3,7 @@
 #
 # Call this in a cron with arguments service_id webpage_url
 
+import datetime
 import os
 import kibanaXML
 import subprocess
@@ -48,6 +49,11 @@ def getPandaDone():
 def getPandaDoneFailed():
     return str(pandadb.getNJobs("actpandastatus='donefailed'"))
 
+def getPandaArchived(state, days=7):
+    since = datetime.date.today() - datetime.timedelta(days=days)
+    rows = pandadb.getArchiveDaily([('day', '>=', since), ('actpandastatus', state)], ['SUM(njobs) AS njobs'])
+    return str(int(rows[0]['njobs'] or 0) if rows else 0)
+
 def getAvailability():
 
     # Check autopilot is running
@@ -94,6 +100,8 @@ kibana_xml.add_data( "pandasent12h", "Number of panda jobs waiting for >12h", ge
 kibana_xml.add_data( "arcqueued12h", "Number of arc jobs queued for >12h", getArcQueuedLong())
 kibana_xml.add_data( "pandadone", "Number of panda jobs done in 24h", getPandaDone())
 kibana_xml.add_data( "pandafailed", "Number of panda jobs failed in 24h", getPandaDoneFailed())
+kibana_xml.add_data( "pandadone7d", "Number of archived panda jobs done in 7 days", getPandaArchived('done'))
+kibana_xml.add_data( "pandafailed7d", "Number of archived panda jobs failed in 7 days", getPandaArchived('donefailed'))
 sendXML(kibana_xml.print_xml())
 #print(kibana_xml.print_xml())
 